@@ -0,0 +1,86 @@
+# backfill.py
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import get_backfill_cursors
+from ingest import IncomingMessage, store_messages
+
+logger = logging.getLogger(__name__)
+
+
+async def backfill_channel(client, subscription, cursor=None, batch_size=500, max_age_hours=24,
+                           on_ingested=None):
+    """
+    Догружает сообщения канала, пропущенные пока парсер не работал.
+
+    Читает историю от курсора догрузки вперёд (iter_messages сам ходит в API
+    пачками по 100) и сохраняет её пачками по batch_size одной транзакцией.
+    Курсор сдвигается до последнего сообщения пачки в той же транзакции, поэтому
+    после обрыва догрузка продолжится с последней сохранённой пачки. Живой приём
+    курсор не двигает (только high-water mark), так что пропуск между ними не
+    теряется; уже сохранённые живым приёмом сообщения пропускаются. Для канала
+    без курсора берутся только последние max_age_hours часов.
+    Канал адресуется закэшированным InputPeer, без лишнего resolve.
+    """
+    source_id = subscription.source_id
+    peer = subscription.input_peer
+    if cursor is not None:
+        messages = client.iter_messages(peer, min_id=cursor, reverse=True)
+    else:
+        since = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+        messages = client.iter_messages(peer, offset_date=since, reverse=True)
+
+    started = time.monotonic()
+    total, new = 0, 0
+    batch = []
+    album = []  # Части альбома идут подряд и сохраняются одним постом
+    async for message in messages:
+        if message.action is not None:
+            continue  # Служебные сообщения (закрепы, смена названия и т.п.)
+        if album and message.grouped_id != album[0].grouped_id:
+            batch.append(IncomingMessage.from_telethon_album(album, source_id))
+            album = []
+        if message.grouped_id:
+            album.append(message)
+        else:
+            batch.append(IncomingMessage.from_telethon(message, source_id))
+        if len(batch) >= batch_size:
+            new += await _store(batch, on_ingested)
+            total += len(batch)
+            batch = []
+    if album:
+        batch.append(IncomingMessage.from_telethon_album(album, source_id))
+    if batch:
+        new += await _store(batch, on_ingested)
+        total += len(batch)
+
+    if total:
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"⏪ {source_id}: догружено {total} сообщений ({new} новых постов) "
+            f"за {elapsed:.1f} с, {total / max(elapsed, 1e-6):.0f} сообщ./с"
+        )
+    return new
+
+
+async def _store(batch, on_ingested):
+    # Сообщения идут по возрастанию ID: курсор — конец пачки
+    last = batch[-1]
+    post_ids, _, _ = await store_messages(batch, (last.channel_id, last.last_message_id))
+    if on_ingested and post_ids:
+        on_ingested(post_ids)
+    return len(post_ids)
+
+
+async def backfill_all(client, subscriptions, on_ingested=None, **kwargs):
+    """Догружает пропущенные сообщения всех каналов по очереди"""
+    cursors = await get_backfill_cursors()
+    for subscription in subscriptions:
+        try:
+            await backfill_channel(
+                client, subscription, cursors.get(subscription.peer_id), on_ingested=on_ingested, **kwargs
+            )
+        except Exception as e:
+            logger.error(f"❌ Не удалось догрузить историю канала {subscription.source_id}: {e}")
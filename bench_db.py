@@ -0,0 +1,204 @@
+# bench_db.py
+#
+# Микробенчмарки db.py и горячего пути модерации на синтетических данных.
+#
+#   python bench_db.py                          # 1k, 100k и 1M строк
+#   python bench_db.py --sizes 1000 100000      # только выбранные размеры
+#   python bench_db.py --compare bench_results/<старый>.json
+#
+# Базы создаются во временном каталоге (или в --workdir), рабочий news.db не трогается.
+# Результаты пишутся в bench_results/<время>_<коммит>.json.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# db.py применяет миграции при импорте — направляем его во временную базу до импорта
+os.environ["DB_PATH"] = os.path.join(tempfile.gettempdir(), "bench_bootstrap.db")
+
+import db  # noqa: E402
+from config import DB_READ_POOL_SIZE, DB_WRITE_BATCH_SIZE  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+STATUS_WEIGHTS = {"published": 55, "declined": 15, "new": 20, "pending": 5, "skipped": 5}
+ADMIN_ID = 1
+# Редкие слова для поиска: каждое встречается примерно в одном посте из len(TOPICS)
+TOPICS = [f"тема{i}" for i in range(1000)]
+RESULTS_DIR = "bench_results"
+
+
+def seed(path, rows):
+    """Создаёт базу с rows синтетическими постами; ~1% новых постов не разосланы"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_migrations(conn)
+    rng = random.Random(rows)
+    statuses = rng.choices(list(STATUS_WEIGHTS), weights=list(STATUS_WEIGHTS.values()), k=rows)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO news (source_id, raw_text, styled_text, status, notified) VALUES (?, ?, ?, ?, ?)",
+        (
+            (f"channel{i % 20}", f"Пост номер {i}. " * 20 + rng.choice(TOPICS), None, status,
+             0 if status == "new" and rng.random() < 0.05 else 1)
+            for i, status in enumerate(statuses)
+        )
+    )
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def use_database(path):
+    """Переключает db.py на другую базу"""
+    db.storage = db.Storage(path, DB_READ_POOL_SIZE, DB_WRITE_BATCH_SIZE)
+    db._session_cursors.clear()
+    db._session_versions.clear()
+
+
+async def measure(fn, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "runs": runs,
+        "min_ms": round(timings[0], 4),
+        "median_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+    }
+
+
+async def bench_size(rows, workdir):
+    path = os.path.join(workdir, f"bench_{rows}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    started = time.perf_counter()
+    seed(path, rows)
+    print(f"🌱 {rows} строк засеяно за {time.perf_counter() - started:.1f} с")
+    use_database(path)
+
+    # Чем больше база, тем меньше повторов тяжёлых операций
+    heavy_runs = 20 if rows <= 100_000 else 5
+    results = {}
+
+    new_posts = await db.get_new_posts()
+    unnotified = await db.get_unnotified_posts()
+    results["get_new_posts"] = await measure(db.get_new_posts, heavy_runs)
+    results["get_unnotified_posts"] = await measure(db.get_unnotified_posts, heavy_runs)
+    results["count_posts_by_status"] = await measure(
+        lambda: db.count_posts_by_status("new", "pending", "skipped"), 200
+    )
+    results["create_session"] = await measure(lambda: db.create_session(ADMIN_ID, new_posts), heavy_runs)
+    results["create_session_from_queue"] = await measure(
+        lambda: db.create_session_from_queue(ADMIN_ID), heavy_runs
+    )
+
+    async def current_post_uncached():
+        db._session_cursors.clear()
+        await db.get_current_post_for_admin(ADMIN_ID)
+
+    results["get_current_post_for_admin"] = await measure(
+        lambda: db.get_current_post_for_admin(ADMIN_ID), 500
+    )
+    results["get_current_post_for_admin_uncached"] = await measure(current_post_uncached, 500)
+    results["advance_session"] = await measure(lambda: db.advance_session(ADMIN_ID), 200)
+    batch = unnotified[:100] or new_posts[:100]
+    results["mark_posts_notified"] = await measure(lambda: db.mark_posts_notified(batch), 50)
+
+    # Поиск: редкое слово, слово из каждого поста, вторая страница по ключу
+    rare, common = db.fts_query("тема7"), db.fts_query("пост")
+    results["search_posts_rare"] = await measure(lambda: db.search_posts(rare, limit=9), heavy_runs)
+    results["search_posts_common"] = await measure(lambda: db.search_posts(common, limit=9), heavy_runs)
+    first_page = await db.search_posts(rare, ("published",), limit=9)
+    after = (first_page[-1][5], first_page[-1][0]) if first_page else None
+    results["search_posts_next_page"] = await measure(
+        lambda: db.search_posts(rare, ("published",), after, limit=9), heavy_runs
+    )
+
+    await db.storage.close()
+    return {
+        "rows": rows,
+        "moderation_queue": len(new_posts),
+        "unnotified": len(unnotified),
+        "operations": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current, baseline_path, threshold):
+    """Печатает сравнение медиан с базовым прогоном; True, если есть регрессии"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressed = False
+    print(f"\n📊 Сравнение с {baseline_path} ({baseline.get('commit')})")
+    for rows, data in current["results"].items():
+        old = baseline["results"].get(rows)
+        if not old:
+            continue
+        for name, stats in data["operations"].items():
+            old_stats = old["operations"].get(name)
+            if not old_stats or not old_stats["median_ms"]:
+                continue
+            ratio = stats["median_ms"] / old_stats["median_ms"]
+            mark = "❌" if ratio > threshold else "✅"
+            regressed |= ratio > threshold
+            print(f"{mark} {rows:>8} {name:<40} {old_stats['median_ms']:>10.3f} → {stats['median_ms']:>10.3f} мс (x{ratio:.2f})")
+    return regressed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки хранилища модерации")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--workdir", help="каталог для баз бенчмарка (по умолчанию временный)")
+    parser.add_argument("--out", help="путь к JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.5, help="допустимое замедление медианы")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        for rows in args.sizes:
+            report["results"][str(rows)] = await bench_size(rows, workdir)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{report['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 Результаты записаны в {out}")
+
+    for rows, data in report["results"].items():
+        print(f"\n📏 {rows} строк (в очереди {data['moderation_queue']}, не разослано {data['unnotified']})")
+        for name, stats in data["operations"].items():
+            print(f"   {name:<40} median {stats['median_ms']:>10.3f} мс   p95 {stats['p95_ms']:>10.3f} мс")
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
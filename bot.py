@@ -3,12 +3,21 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from config import TELEGRAM_BOT_TOKEN, ADMIN_CHAT_IDS
+from config import TELEGRAM_BOT_TOKEN, ADMIN_CHAT_IDS, METRICS_FILE, METRICS_EXPORT_INTERVAL
 from menu_router import menu_router
 from moderation_router import moderation_router
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from bulk_router import bulk_router
+from search_router import search_router
+from publisher import publish_queue
+from cleanup import cleanup
+from retention import retention
+from telemetry import gemini_metrics
+from timeline import stage_recorder
+from bulk_rewrite import bulk_rewrite_tasks
+from sender import install_rate_limiter
+from ledger import install_message_ledger
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from fsm_storage import SQLiteStorage
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,87 +30,39 @@ logging.basicConfig(
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())  # ⬅️ Без этого текстовые сообщения не обрабатываются
+install_rate_limiter(bot)  # Все запросы роутеров идут через общий ограничитель
+dp = Dispatcher(storage=SQLiteStorage())  # ⬅️ Без этого текстовые сообщения не обрабатываются; состояния в news.db
+install_message_ledger(bot, ADMIN_CHAT_IDS, dp)  # Журнал сообщений в чатах админов для /clear
 
 # Подключение роутеров
 dp.include_router(moderation_router)
+dp.include_router(bulk_router)
+dp.include_router(search_router)
 dp.include_router(menu_router)
 
-# Храним последние уведомления для админов
-last_notification = {}  # admin_id: message_id
-
-
-# Фоновая проверка новых постов
-async def background_check_for_news():
-    await asyncio.sleep(3)  # Пауза перед стартом
-
-    while True:
-        from db import get_unnotified_posts, mark_posts_notified, get_current_post_for_admin
-
-        post_ids = get_unnotified_posts()
-        if post_ids:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🚀 Начать модерацию", callback_data="start_moderation")]
-            ])
-
-            for admin_id in ADMIN_CHAT_IDS:
-                # Пропускаем админов, которые уже в сессии модерации
-                if get_current_post_for_admin(admin_id) is not None:
-                    logging.info(f"Админ {admin_id} уже в сессии модерации, пропускаем уведомление")
-                    continue
-
-                text = f"📬 Получено <b>{len(post_ids)}</b> новых постов."
-                try:
-                    if admin_id in last_notification:
-                        # Проверяем, существует ли сообщение
-                        try:
-                            await bot.edit_message_text(
-                                chat_id=admin_id,
-                                message_id=last_notification[admin_id],
-                                text=text,
-                                reply_markup=keyboard
-                            )
-                            logging.info(f"🔁 Обновлено уведомление для {admin_id}")
-                        except Exception:
-                            # Если сообщение не найдено, отправляем новое
-                            sent = await bot.send_message(
-                                chat_id=admin_id,
-                                text=text,
-                                reply_markup=keyboard
-                            )
-                            last_notification[admin_id] = sent.message_id
-                            logging.info(f"📤 Отправлено новое уведомление администратору {admin_id}")
-                    else:
-                        sent = await bot.send_message(
-                            chat_id=admin_id,
-                            text=text,
-                            reply_markup=keyboard
-                        )
-                        last_notification[admin_id] = sent.message_id
-                        logging.info(f"📤 Отправлено первое уведомление администратору {admin_id}")
-
-                except Exception as e:
-                    logging.warning(f"⚠️ Не удалось обновить/отправить сообщение для {admin_id}: {e}")
-                    try:
-                        sent = await bot.send_message(
-                            chat_id=admin_id,
-                            text=text,
-                            reply_markup=keyboard
-                        )
-                        last_notification[admin_id] = sent.message_id
-                        logging.info(f"📤 Повторно отправлено уведомление администратору {admin_id}")
-                    except Exception as inner_e:
-                        logging.error(f"❌ Не удалось вообще отправить уведомление: {inner_e}")
-
-            mark_posts_notified(post_ids)
-
-        await asyncio.sleep(30)  # Проверка каждые 30 секунд
-
 
 # Точка входа
 async def main():
-    asyncio.create_task(background_check_for_news())
-    await dp.start_polling(bot)
+    from db import close_db
+
+    background = [
+        publish_queue.start(bot),  # Публикация пакетных действий (и оставшихся с прошлого запуска)
+        cleanup.start(bot),  # Отложенное удаление служебных сообщений
+        retention.start(),  # Перенос старых постов в архив
+    ]
+    if METRICS_FILE:
+        # Метрики Gemini для Prometheus (textfile)
+        background.append(asyncio.create_task(gemini_metrics.export(METRICS_FILE, METRICS_EXPORT_INTERVAL)))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Фоновые задачи останавливаем до закрытия базы: их записи не должны упасть на закрытом хранилище
+        background += bulk_rewrite_tasks()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        stage_recorder.flush()  # Отметки показа, не дождавшиеся фоновой записи
+        await close_db()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+# bulk_rewrite.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from db import get_post, set_styled_texts
+from gemini import rewrite_service, build_prompt, estimate_tokens
+from sender import TokenBucket
+from session_engine import session_engine
+
+logger = logging.getLogger(__name__)
+
+# Статусы очереди модерации — только такие посты имеет смысл переписывать
+_QUEUE_STATUSES = ("new", "pending", "skipped")
+
+
+class BulkRewrite:
+    """
+    Пакетная обработка постов через Gemini по одной инструкции.
+
+    Несколько воркеров (concurrency) берут посты из общего списка; перед
+    запросом каждый резервирует оценку токенов промпта и ответа в бюджете
+    tpm_budget токенов в минуту. Результаты копятся и пишутся пачками по
+    batch_size одной транзакцией (styled_text, статус pending). Ход работы
+    показывается в одном сообщении, которое обновляется не чаще раза
+    в progress_interval секунд.
+    """
+
+    def __init__(self, post_ids, comment="", concurrency=3, tpm_budget=200000,
+                 batch_size=20, progress_interval=2.0):
+        self.post_ids = list(post_ids)
+        self.comment = comment
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.budget = TokenBucket(tpm_budget / 60, tpm_budget)
+        self.processed = self.changed = self.unchanged = self.failed = self.skipped = 0
+        self.cancelled = False
+        self._results = []
+        self._finished = asyncio.Event()
+
+    async def run(self, bot, chat_id, message_id):
+        started = time.monotonic()
+        progress = asyncio.create_task(self._report_progress(bot, chat_id, message_id))
+        post_ids = iter(self.post_ids)
+        try:
+            await asyncio.gather(*(self._worker(post_ids) for _ in range(self.concurrency)))
+            await self._flush()
+        finally:
+            self._finished.set()
+            await progress
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"🧠 Пакетная обработка завершена за {elapsed:.0f} с: изменено {self.changed}, "
+            f"без изменений {self.unchanged}, ошибок {self.failed}, пропущено {self.skipped}"
+        )
+        title = "⏹ Обработка остановлена" if self.cancelled else "✅ Обработка завершена"
+        await self._edit(bot, chat_id, message_id, f"{title} за {elapsed:.0f} с\n\n{self.summary()}", final=True)
+
+    async def _worker(self, post_ids):
+        for post_id in post_ids:
+            if self.cancelled:
+                return
+            post = await get_post(post_id)
+            if not post or post[4] not in _QUEUE_STATUSES:
+                self.skipped += 1
+                continue
+            raw_text = post[2]
+            await self.budget.acquire(
+                estimate_tokens(build_prompt(raw_text, self.comment)) + estimate_tokens(raw_text)
+            )
+            try:
+                revised = await rewrite_service.revise(raw_text, self.comment, post[1])
+            except Exception as e:
+                logger.error(f"❌ Пост {post_id} не обработан Gemini: {e}")
+                self.failed += 1
+                continue
+            finally:
+                self.processed += 1
+
+            if revised == raw_text or revised == post[3]:
+                self.unchanged += 1
+                continue
+            self.changed += 1
+            self._results.append((post_id, revised))
+            if len(self._results) >= self.batch_size:
+                await self._flush()
+
+    async def _flush(self):
+        if not self._results:
+            return
+        results, self._results = self._results, []
+        for post_id in await set_styled_texts(results):
+            session_engine.invalidate_post(post_id)
+
+    def summary(self):
+        return (
+            f"Обработано {self.processed} из {len(self.post_ids)}\n"
+            f"✏️ изменено {self.changed} · без изменений {self.unchanged}\n"
+            f"❌ ошибок {self.failed} · ⏭ пропущено {self.skipped}"
+        )
+
+    async def _report_progress(self, bot, chat_id, message_id):
+        last = None
+        while not self._finished.is_set():
+            text = f"🧠 Пакетная обработка Gemini…\n\n{self.summary()}"
+            if text != last:
+                await self._edit(bot, chat_id, message_id, text)
+                last = text
+            try:
+                await asyncio.wait_for(self._finished.wait(), self.progress_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _edit(bot, chat_id, message_id, text, final=False):
+        button = (
+            InlineKeyboardButton(text="🔙 В меню", callback_data="back_to_main") if final
+            else InlineKeyboardButton(text="⏹ Остановить", callback_data="bulk_gemini_stop")
+        )
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=text,
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[[button]])
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"⚠️ Не удалось обновить прогресс обработки: {e}")
+
+
+# Запущенные обработки по админам: одна на админа
+_jobs = {}
+# Их фоновые задачи — ссылки держим до завершения, чтобы отменить при остановке бота
+_tasks = set()
+
+
+def start_bulk_rewrite(admin_id, bot, chat_id, message_id, post_ids, comment, **kwargs):
+    """Запускает обработку в фоне; None, если у админа уже идёт другая"""
+    if admin_id in _jobs:
+        return None
+    job = _jobs[admin_id] = BulkRewrite(post_ids, comment, **kwargs)
+
+    async def run():
+        try:
+            await job.run(bot, chat_id, message_id)
+        except Exception as e:
+            logger.exception(f"❌ Пакетная обработка Gemini прервалась: {e}")
+        finally:
+            _jobs.pop(admin_id, None)
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+
+def stop_bulk_rewrite(admin_id):
+    """Останавливает обработку админа после текущих запросов; False, если её нет"""
+    job = _jobs.get(admin_id)
+    if job is None:
+        return False
+    job.cancelled = True
+    return True
+
+
+def bulk_rewrite_tasks():
+    """Фоновые задачи идущих обработок — для отмены при остановке бота"""
+    return list(_tasks)
@@ -0,0 +1,291 @@
+# bulk_router.py
+
+import html
+import logging
+
+from aiogram import Router, types, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from bulk_rewrite import start_bulk_rewrite, stop_bulk_rewrite
+from config import BULK_PAGE_SIZE, GEMINI_BULK_CONCURRENCY, GEMINI_TPM_BUDGET
+from db import (
+    get_queue_page, set_posts_status, count_posts_by_status,
+    get_session_cursor, get_session_page, get_post_ids_by_status
+)
+from publisher import publish_queue
+from session_engine import session_engine
+from timeline import stage_recorder
+
+logger = logging.getLogger(__name__)
+
+bulk_router = Router()
+
+
+class BulkGemini(StatesGroup):
+    waiting_for_comment = State()
+
+
+# Длина превью поста на странице
+PREVIEW_LENGTH = 200
+
+
+def render_page(page, selected, page_number, queue_size):
+    lines = [f"📋 <b>Пакетная модерация</b> — страница {page_number}, в очереди {queue_size}\n"]
+    for number, (post_id, source_id, text, status, media_count) in enumerate(page, start=1):
+        mark = "☑️" if post_id in selected else "⬜"
+        preview = " ".join((text or "").split())
+        if len(preview) > PREVIEW_LENGTH:
+            preview = preview[:PREVIEW_LENGTH] + "…"
+        media = f" 📎{media_count}" if media_count else ""
+        skipped = " ⏳" if status == "skipped" else ""
+        lines.append(f"{mark} <b>{number}.</b> <i>{html.escape(source_id or '')}</i>{media}{skipped}\n{html.escape(preview)}\n")
+    return "\n".join(lines)
+
+
+def get_page_keyboard(page, selected, has_prev, has_next):
+    toggles = [
+        InlineKeyboardButton(
+            text=f"{'☑️' if post_id in selected else '⬜'} {number}",
+            callback_data=f"bulk_toggle_{post_id}"
+        )
+        for number, (post_id, *_) in enumerate(page, start=1)
+    ]
+    rows = [toggles[i:i + 4] for i in range(0, len(toggles), 4)]
+    rows.append([
+        InlineKeyboardButton(text="☑️ Все", callback_data="bulk_all"),
+        InlineKeyboardButton(text="⬜ Снять", callback_data="bulk_none"),
+    ])
+    count = len(selected)
+    rows.append([
+        InlineKeyboardButton(text=f"✅ Опубликовать ({count})", callback_data="bulk_publish"),
+        InlineKeyboardButton(text=f"⏳ Отложить ({count})", callback_data="bulk_skip"),
+    ])
+    rows.append([InlineKeyboardButton(text=f"🗑 Отклонить ({count})", callback_data="bulk_decline")])
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data="bulk_prev"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data="bulk_next"))
+    if navigation:
+        rows.append(navigation)
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def show_page(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Показывает страницу очереди в том же сообщении.
+
+    Страница читается по ключу (id > последнего id предыдущей страницы);
+    стек начал страниц и выбранные посты хранятся в FSM.
+    """
+    data = await state.get_data()
+    starts = data.get("bulk_starts", [0])
+    page = await get_queue_page(starts[-1], BULK_PAGE_SIZE + 1)
+    if not page and len(starts) > 1:
+        # Страница опустела после действий — возвращаемся на предыдущую
+        starts = starts[:-1]
+        page = await get_queue_page(starts[-1], BULK_PAGE_SIZE + 1)
+
+    has_next = len(page) > BULK_PAGE_SIZE
+    page = page[:BULK_PAGE_SIZE]
+    page_ids = [row[0] for row in page]
+    selected = set(data.get("bulk_selected", [])) & set(page_ids)
+    await state.update_data(bulk_starts=starts, bulk_page=page_ids, bulk_selected=list(selected))
+
+    if not page:
+        await edit_page(
+            callback.message,
+            "Нет постов для модерации.",
+            InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
+            ])
+        )
+        return
+
+    queue_size = await count_posts_by_status("new", "pending", "skipped")
+    await edit_page(
+        callback.message,
+        render_page(page, selected, len(starts), queue_size),
+        get_page_keyboard(page, selected, len(starts) > 1, has_next)
+    )
+    stage_recorder.mark("first_shown_at", page_ids)
+
+
+async def edit_page(message, text, reply_markup):
+    # Повторное нажатие той же кнопки даёт ту же страницу — Telegram отвечает «message is not modified»
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
+
+@bulk_router.callback_query(F.data == "bulk_moderation")
+async def start_bulk_moderation(callback: types.CallbackQuery, state: FSMContext):
+    await state.update_data(bulk_starts=[0], bulk_selected=[])
+    await show_page(callback, state)
+    await callback.answer()
+
+
+@bulk_router.callback_query(F.data.startswith("bulk_toggle_"))
+async def toggle_post(callback: types.CallbackQuery, state: FSMContext):
+    post_id = int(callback.data.replace("bulk_toggle_", ""))
+    selected = set((await state.get_data()).get("bulk_selected", []))
+    selected ^= {post_id}
+    await state.update_data(bulk_selected=list(selected))
+    await show_page(callback, state)
+    await callback.answer()
+
+
+@bulk_router.callback_query(F.data.in_({"bulk_all", "bulk_none"}))
+async def select_all(callback: types.CallbackQuery, state: FSMContext):
+    page_ids = (await state.get_data()).get("bulk_page", [])
+    await state.update_data(bulk_selected=page_ids if callback.data == "bulk_all" else [])
+    await show_page(callback, state)
+    await callback.answer()
+
+
+@bulk_router.callback_query(F.data.in_({"bulk_next", "bulk_prev"}))
+async def change_page(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    starts = data.get("bulk_starts", [0])
+    page_ids = data.get("bulk_page", [])
+    if callback.data == "bulk_next" and page_ids:
+        starts = starts + [page_ids[-1]]
+    elif callback.data == "bulk_prev" and len(starts) > 1:
+        starts = starts[:-1]
+    await state.update_data(bulk_starts=starts, bulk_selected=[])
+    await show_page(callback, state)
+    await callback.answer()
+
+
+@bulk_router.callback_query(F.data.in_({"bulk_publish", "bulk_skip", "bulk_decline"}))
+async def apply_bulk_action(callback: types.CallbackQuery, state: FSMContext):
+    selected = (await state.get_data()).get("bulk_selected", [])
+    if not selected:
+        await callback.answer("Ничего не выбрано")
+        return
+
+    # Каждое действие — одна транзакция; посты, уже обработанные другим админом, пропускаются
+    if callback.data == "bulk_publish":
+        post_ids = await publish_queue.enqueue(selected)
+        status_text = f"✅ В очереди на публикацию: {len(post_ids)}"
+    elif callback.data == "bulk_skip":
+        post_ids = await set_posts_status(selected, "skipped")
+        status_text = f"⏳ Отложено: {len(post_ids)}"
+    else:
+        post_ids = await set_posts_status(selected, "declined")
+        status_text = f"🗑 Отклонено: {len(post_ids)}"
+
+    for post_id in post_ids:
+        session_engine.invalidate_post(post_id)
+    logger.info(f"📋 Админ {callback.from_user.id}: {callback.data} для {len(post_ids)} постов")
+
+    await state.update_data(bulk_selected=[])
+    await show_page(callback, state)
+    await callback.answer(status_text)
+
+
+# --- Пакетная обработка Gemini ---
+
+async def get_scope_post_ids(admin_id, scope):
+    """ID постов для обработки: оставшиеся в сессии модерации или все новые"""
+    if scope == "session":
+        cursor = await get_session_cursor(admin_id)
+        if not cursor:
+            return []
+        index, total = cursor
+        return [post_id for _, post_id in await get_session_page(admin_id, index - 1, total)]
+    return await get_post_ids_by_status("new")
+
+
+async def run_bulk_gemini(admin_id, bot, message, post_ids, comment):
+    job = start_bulk_rewrite(
+        admin_id, bot, message.chat.id, message.message_id, post_ids, comment,
+        concurrency=GEMINI_BULK_CONCURRENCY, tpm_budget=GEMINI_TPM_BUDGET
+    )
+    if job is None:
+        await message.edit_text(
+            "⏳ Пакетная обработка уже идёт — дождитесь её окончания или остановите.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="⏹ Остановить", callback_data="bulk_gemini_stop")],
+                [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
+            ])
+        )
+        return
+    logger.info(f"🧠 Админ {admin_id} запустил пакетную обработку {len(post_ids)} постов: «{comment}»")
+
+
+@bulk_router.callback_query(F.data == "bulk_gemini")
+async def choose_bulk_gemini_scope(callback: types.CallbackQuery, state: FSMContext):
+    admin_id = callback.from_user.id
+    session_count = len(await get_scope_post_ids(admin_id, "session"))
+    new_count = len(await get_scope_post_ids(admin_id, "new"))
+    rows = []
+    if session_count:
+        rows.append([InlineKeyboardButton(
+            text=f"🗂 Текущая сессия ({session_count})", callback_data="bulk_gemini_scope_session"
+        )])
+    if new_count:
+        rows.append([InlineKeyboardButton(text=f"🆕 Все новые ({new_count})", callback_data="bulk_gemini_scope_new")])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")])
+    text = "🧠 Какие посты обработать Gemini?" if len(rows) > 1 else "Нет постов для обработки."
+    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    await callback.answer()
+
+
+# Отдельной «стандартной обработки» нет: правила замены (название, телефон) уже
+# применяются при приёме поста и перед публикацией, а пустой комментарий перезаписал
+# бы правки админа и Gemini. Пакетная обработка — только по комментарию.
+@bulk_router.callback_query(F.data.startswith("bulk_gemini_scope_"))
+async def prompt_bulk_gemini_comment(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(BulkGemini.waiting_for_comment)
+    await state.update_data(
+        bulk_gemini_scope=callback.data.replace("bulk_gemini_scope_", ""),
+        bulk_gemini_message_id=callback.message.message_id
+    )
+    await callback.message.edit_text(
+        "💬 Введите комментарий — он будет применён к каждому посту.\n"
+        "Название и телефон заменяются автоматически, их указывать не нужно:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Отмена", callback_data="back_to_main")]
+        ])
+    )
+    await callback.answer()
+
+
+@bulk_router.message(BulkGemini.waiting_for_comment)
+async def start_bulk_gemini_with_comment(message: types.Message, state: FSMContext):
+    admin_id = message.from_user.id
+    if not (message.text or "").strip():
+        await message.answer("💬 Нужен текстовый комментарий для Gemini.")
+        return
+    data = await state.get_data()
+    await state.set_state(None)
+    await message.delete()
+
+    post_ids = await get_scope_post_ids(admin_id, data.get("bulk_gemini_scope", "new"))
+    # Прогресс показываем в сообщении с вопросом (или в новом, если его уже нет)
+    progress = None
+    if data.get("bulk_gemini_message_id"):
+        try:
+            progress = await message.bot.edit_message_text(
+                chat_id=message.chat.id, message_id=data["bulk_gemini_message_id"], text="🧠 Запускаю обработку…"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось использовать сообщение с вопросом для прогресса: {e}")
+    if not isinstance(progress, types.Message):
+        progress = await message.answer("🧠 Запускаю обработку…")
+    await run_bulk_gemini(admin_id, message.bot, progress, post_ids, message.text)
+
+
+@bulk_router.callback_query(F.data == "bulk_gemini_stop")
+async def stop_bulk_gemini(callback: types.CallbackQuery):
+    if stop_bulk_rewrite(callback.from_user.id):
+        await callback.answer("Останавливаю после текущих запросов…")
+    else:
+        await callback.answer("Пакетная обработка уже завершена")
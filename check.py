@@ -1,12 +1,14 @@
 # test_gemini.py
 
-from gemini import revise_text_with_chatgpt
+import asyncio
+
+from gemini import rewrite_service
 
 if __name__ == "__main__":
     raw = "Это текст, который нужно переписать."
     comment = "Сделай его более профессиональным и структурированным."
     source = "Test Channel"
 
-    revised = revise_text_with_chatgpt(raw, comment, source)
+    revised = asyncio.run(rewrite_service.revise(raw, comment, source))
     print("\n🔄 Доработанный текст:")
     print(revised)
@@ -0,0 +1,105 @@
+# cleanup.py
+
+import asyncio
+import heapq
+import logging
+import time
+from itertools import groupby
+
+from db import save_pending_deletion, get_pending_deletions, remove_pending_deletions
+
+logger = logging.getLogger(__name__)
+
+# deleteMessages принимает не больше 100 ID за раз
+DELETE_BATCH_SIZE = 100
+
+
+class CleanupService:
+    """
+    Отложенное удаление служебных сообщений бота.
+
+    Обработчик регистрирует «удалить сообщение X в чате Y через N секунд»
+    и сразу возвращается. Сроки лежат в куче; воркер спит до ближайшего,
+    собирает всё, что созрело (плюс окно склейки coalesce), и удаляет
+    сообщения пачками через deleteMessages — по запросу на чат и 100 ID.
+    Задания дублируются в таблицу pending_deletion, поэтому переживают перезапуск.
+    """
+
+    def __init__(self, coalesce=0.5):
+        self.coalesce = coalesce
+        self._heap = []  # (due_at, chat_id, message_id)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.deleted = 0
+
+    def schedule(self, chat_id, message_id, delay):
+        """Планирует удаление сообщения через delay секунд (не блокирует)"""
+        due_at = time.time() + delay
+        heapq.heappush(self._heap, (due_at, chat_id, message_id))
+        save_pending_deletion(chat_id, message_id, due_at)
+        if self._heap[0][0] == due_at:
+            self._wakeup.set()  # Новый срок раньше текущего — будим воркер
+
+    def delete_later(self, message, delay):
+        """То же для aiogram Message (результат answer / send_message / edit_text)"""
+        if message is None or message is True:
+            return  # edit_text inline-сообщения возвращает True — удалять нечего
+        self.schedule(message.chat.id, message.message_id, delay)
+
+    def start(self, bot):
+        self._task = asyncio.create_task(self.run(bot))
+        return self._task
+
+    async def run(self, bot):
+        known = {(chat_id, message_id) for _, chat_id, message_id in self._heap}
+        restored = [
+            (due_at, chat_id, message_id)
+            for chat_id, message_id, due_at in await get_pending_deletions()
+            if (chat_id, message_id) not in known
+        ]
+        if restored:
+            self._heap.extend(restored)
+            heapq.heapify(self._heap)
+            logger.info(f"🧹 Восстановлено {len(restored)} отложенных удалений")
+        while True:
+            await self._wait_until_due()
+            due = self._pop_due(time.time() + self.coalesce)
+            try:
+                await self._delete(bot, due)
+            except Exception as e:
+                logger.error(f"❌ Ошибка при удалении сообщений: {e}")
+
+    async def _wait_until_due(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is not None and timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    def _pop_due(self, until):
+        due = []
+        while self._heap and self._heap[0][0] <= until:
+            _, chat_id, message_id = heapq.heappop(self._heap)
+            due.append((chat_id, message_id))
+        return due
+
+    async def _delete(self, bot, due):
+        due.sort()
+        for chat_id, rows in groupby(due, key=lambda row: row[0]):
+            message_ids = sorted({message_id for _, message_id in rows})
+            for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+                chunk = message_ids[start:start + DELETE_BATCH_SIZE]
+                try:
+                    # Уже удалённые сообщения Telegram просто пропускает
+                    await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                    self.deleted += len(chunk)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось удалить {len(chunk)} сообщений в чате {chat_id}: {e}")
+        await remove_pending_deletions(due)
+
+
+cleanup = CleanupService()
@@ -43,7 +43,84 @@ except ValueError:
     logger.error("❌ Неверный формат ADMIN_CHAT_ID в .env файле!")
     ADMIN_CHAT_IDS = []
 
+# База данных
+DB_PATH = os.getenv("DB_PATH", "news.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "64"))
+
 # Gemini / GPT
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
-    logger.warning("⚠️ Не задан GEMINI_API_KEY в .env файле!")
\ No newline at end of file
+    logger.warning("⚠️ Не задан GEMINI_API_KEY в .env файле!")
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "60"))
+
+# Кэш переписываний Gemini
+REWRITE_CACHE_MEMORY_SIZE = int(os.getenv("REWRITE_CACHE_MEMORY_SIZE", "256"))
+REWRITE_CACHE_TTL = int(os.getenv("REWRITE_CACHE_TTL", str(7 * 24 * 3600)))
+REWRITE_CACHE_MAX_ROWS = int(os.getenv("REWRITE_CACHE_MAX_ROWS", "10000"))
+
+# Уведомления о новых постах: окно склейки пачки событий, секунды
+NOTIFY_DEBOUNCE = float(os.getenv("NOTIFY_DEBOUNCE", "0.5"))
+
+# Буфер ингеста парсера: размер пачки, максимальная задержка (с) и предел очереди
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+INGEST_MAX_DELAY = float(os.getenv("INGEST_MAX_DELAY", "0.5"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "1000"))
+# Дубликаты ищутся только среди постов за последние DEDUP_WINDOW_DAYS дней:
+# повторяющиеся объявления не склеиваются с давно опубликованными
+DEDUP_WINDOW_DAYS = float(os.getenv("DEDUP_WINDOW_DAYS", "7"))
+
+# Догрузка истории каналов после простоя парсера
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "500"))
+BACKFILL_MAX_AGE_HOURS = int(os.getenv("BACKFILL_MAX_AGE_HOURS", "24"))
+
+# Список каналов-источников и период проверки его изменений, секунды
+CHANNELS_FILE = os.getenv("CHANNELS_FILE", "channels.json")
+CHANNELS_POLL_INTERVAL = float(os.getenv("CHANNELS_POLL_INTERVAL", "5"))
+
+# Правила замены текста без Gemini (название, телефон и т.п.), см. rewrite_rules.py;
+# применяются при приёме поста, перед публикацией и к ответам Gemini
+REWRITE_RULES_FILE = os.getenv("REWRITE_RULES_FILE", "rewrite_rules.json")
+
+# Служебный чат для пересылки медиа (парсер пересылает туда файлы, бот копирует их
+# при публикации). Аккаунт парсера и бот должны быть его участниками; без него
+# посты публикуются без медиа.
+MEDIA_RELAY_CHAT_ID = int(os.getenv("MEDIA_RELAY_CHAT_ID", "0")) or None
+
+# Сколько следующих постов сессии модерации готовить заранее
+MODERATION_PREFETCH_DEPTH = int(os.getenv("MODERATION_PREFETCH_DEPTH", "3"))
+
+# Пакетная модерация: постов на странице
+BULK_PAGE_SIZE = int(os.getenv("BULK_PAGE_SIZE", "8"))
+
+# Публикация: не больше PUBLISH_RATE постов в минуту, до PUBLISH_MAX_ATTEMPTS попыток.
+# PUBLISH_SLOTS — время слотов по расписанию через запятую ("09:00,13:00,19:00");
+# если задано, у поста появляется кнопка публикации в ближайший свободный слот.
+PUBLISH_RATE = float(os.getenv("PUBLISH_RATE", "20"))
+PUBLISH_MAX_ATTEMPTS = int(os.getenv("PUBLISH_MAX_ATTEMPTS", "5"))
+PUBLISH_SLOTS = [slot.strip() for slot in os.getenv("PUBLISH_SLOTS", "").split(",") if slot.strip()]
+# Поиск по постам (/search): результатов на странице и сколько самых свежих
+# совпадений ранжировать (ограничивает цену частых слов на большом архиве)
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "8"))
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "10000"))
+
+# Архив: посты со статусами ARCHIVE_STATUSES старше ARCHIVE_AFTER_DAYS дней раз в
+# ARCHIVE_INTERVAL секунд переносятся в news_archive со сжатым текстом
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_STATUSES = [s.strip() for s in os.getenv("ARCHIVE_STATUSES", "published,declined,skipped").split(",") if s.strip()]
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Хронология этапов постов (post_timeline) хранится столько дней, затем удаляется
+TIMELINE_RETENTION_DAYS = int(os.getenv("TIMELINE_RETENTION_DAYS", "90"))
+
+# Пакетная обработка Gemini: одновременных запросов и бюджет токенов в минуту
+# (оценка по длине промпта и ответа; держите ниже лимита TPM ключа)
+GEMINI_BULK_CONCURRENCY = int(os.getenv("GEMINI_BULK_CONCURRENCY", "3"))
+GEMINI_TPM_BUDGET = int(os.getenv("GEMINI_TPM_BUDGET", "200000"))
+
+# Метрики Gemini в текстовом формате Prometheus (пусто — не выгружать) и период выгрузки, секунды
+METRICS_FILE = os.getenv("METRICS_FILE", "gemini_metrics.prom")
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", "15"))
@@ -1,129 +1,1291 @@
+import asyncio
+import concurrent.futures
+import queue
+import re
 import sqlite3
-import json
-from datetime import datetime
+import threading
+import time
 import logging
+from datetime import datetime
+
+from config import DB_PATH, DB_READ_POOL_SIZE, DB_WRITE_BATCH_SIZE, DEDUP_WINDOW_DAYS
+from migrations import apply_migrations, register_functions, pack_text
+from dedup import SIMILARITY_THRESHOLD, band_keys, similarity
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DB_PATH = "news.db"
-
-# Подключение к SQLite
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-cursor = conn.cursor()
-
-# --- Таблица с новостями ---
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS news (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    source_id TEXT,
-    raw_text TEXT,
-    styled_text TEXT,
-    status TEXT,
-    notified INTEGER DEFAULT 0,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
-
-# --- Таблица сессий модерации ---
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS moderation_session (
-    admin_id INTEGER PRIMARY KEY,
-    post_ids TEXT,
-    current_index INTEGER
-)
-""")
-
-conn.commit()
+
+# --- Хранилище: пул читателей и единственный писатель ---
+
+class Storage:
+    """
+    Асинхронный доступ к SQLite.
+
+    Чтения выполняются на небольшом пуле потоков (у каждого потока своё
+    соединение), все записи проходят через один поток-писатель, который
+    собирает накопившиеся задачи в одну транзакцию (групповой коммит).
+    Благодаря WAL читатели не блокируются писателем.
+    """
+
+    def __init__(self, path, read_pool_size=4, write_batch_size=64):
+        self.path = path
+        self.write_batch_size = write_batch_size
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=read_pool_size, thread_name_prefix="db-read"
+        )
+        self._local = threading.local()
+        self._write_queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        register_functions(conn)
+        # Ожидание блокировки — первым делом: journal_mode тоже может её потребовать
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- Чтение ---
+
+    def _reader_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._reader_connection(), *args)
+
+    async def read(self, fn, *args):
+        """Выполняет fn(conn, *args) на пуле читателей"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn, args)
+
+    # --- Запись ---
+
+    def _ensure_writer(self):
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+            self._writer.start()
+
+    def submit_write(self, fn, *args):
+        """Ставит fn(conn, *args) в очередь писателя, возвращает concurrent.futures.Future"""
+        future = concurrent.futures.Future()
+        # Под блокировкой: упавший писатель либо уже вычерпал очередь, либо увидит эту задачу
+        with self._writer_lock:
+            self._ensure_writer()
+            self._write_queue.put((fn, args, future))
+        return future
+
+    async def write(self, fn, *args):
+        """Выполняет fn(conn, *args) в транзакции писателя и ждёт коммита"""
+        return await asyncio.wrap_future(self.submit_write(fn, *args))
+
+    def _writer_loop(self):
+        try:
+            conn = self.connect()
+        except Exception as e:
+            logger.exception("❌ Писатель не смог открыть базу")
+            # Ожидающие получают ошибку; следующая запись запустит писателя заново
+            with self._writer_lock:
+                while True:
+                    try:
+                        job = self._write_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is not None:
+                        _fail_future(job[2], e)
+                self._writer = None
+            return
+        stopping = False
+        while not stopping:
+            job = self._write_queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.write_batch_size:
+                try:
+                    job = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit_batch(conn, batch)
+        conn.close()
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue  # Ожидающий отменил запрос до начала записи
+                # Каждая задача в своей точке сохранения: ошибка одной не откатывает остальные
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(conn, *args), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception("❌ Ошибка группового коммита")
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            # В том числе задачи, до которых не дошло (например, не удался сам BEGIN)
+            for _, _, future in batch:
+                _fail_future(future, e)
+            return
+
+        if len(batch) > 1:
+            logger.debug(f"💾 Групповой коммит: {len(batch)} записей")
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        """Дожидается записи очереди и закрывает соединения"""
+        if self._writer is not None and self._writer.is_alive():
+            self._write_queue.put(None)
+            await asyncio.to_thread(self._writer.join)
+        self._readers.shutdown(wait=True)
+
+
+def _fail_future(future, error):
+    """Завершает незавершённую задачу записи ошибкой (отменённые пропускаются)"""
+    if future.done():
+        return
+    if future.running() or future.set_running_or_notify_cancel():
+        future.set_exception(error)
+
+
+storage = Storage(DB_PATH, DB_READ_POOL_SIZE, DB_WRITE_BATCH_SIZE)
+
+# --- Миграции схемы (синхронно, при импорте) ---
+
+_schema_conn = storage.connect()
+apply_migrations(_schema_conn)
+_schema_conn.close()
+
+
+async def close_db():
+    """Завершает работу хранилища (вызывать при остановке процесса)"""
+    await storage.close()
+    logger.info("💾 Хранилище закрыто")
+
 
 # --- Функции для работы с новостями ---
 
-def add_post(source_id, raw_text):
-    cursor.execute("""
-        INSERT INTO news (source_id, raw_text, styled_text, status)
-        VALUES (?, ?, ?, ?)
-    """, (source_id, raw_text, raw_text, "new"))
-    conn.commit()
-    post_id = cursor.lastrowid
+POST_COLUMNS = "id, source_id, raw_text, styled_text, status, notified, created_at"
+
+
+def _insert_post(conn, source_id, raw_text, channel_id=None, message_id=None, message_date=None, styled_text=None):
+    cur = conn.execute("""
+        INSERT INTO news (source_id, raw_text, styled_text, status, message_date)
+        VALUES (?, ?, ?, ?, ?)
+    """, (source_id, raw_text, raw_text if styled_text is None else styled_text, "new", message_date))
+    post_id = cur.lastrowid
+    _insert_source(conn, post_id, source_id, channel_id, message_id)
+    # Событие для уведомления пишется в той же транзакции, что и сам пост
+    conn.execute("INSERT INTO notification_outbox (post_id) VALUES (?)", (post_id,))
+    return post_id
+
+
+def _insert_source(conn, post_id, source_id, channel_id=None, message_id=None):
+    conn.execute(
+        "INSERT INTO news_source (post_id, source_id, channel_id, message_id) VALUES (?, ?, ?, ?)",
+        (post_id, source_id, channel_id, message_id)
+    )
+
+
+async def add_post(source_id, raw_text):
+    post_id = await storage.write(_insert_post, source_id, raw_text)
     logger.info(f"🆕 Пост {post_id} добавлен из канала {source_id}")
     return post_id
 
 
-def get_new_posts():
+def _find_duplicate(conn, digest, signature, keys, since):
+    # Кандидаты — только посты из news, созданные не раньше since (архив не участвует)
+    if digest:
+        row = conn.execute("""
+            SELECT f.post_id FROM news_fingerprint f JOIN news n ON n.id = f.post_id
+            WHERE f.content_hash = ? AND n.created_at >= ?
+            ORDER BY f.post_id DESC LIMIT 1
+        """, (digest, since)).fetchone()
+        if row:
+            return row[0]
+    if not signature:
+        return None
+    placeholders = ", ".join("?" * len(keys))
+    candidates = conn.execute(f"""
+        SELECT f.post_id, f.signature FROM news_fingerprint f JOIN news n ON n.id = f.post_id
+        WHERE f.post_id IN (SELECT post_id FROM news_lsh WHERE band_key IN ({placeholders}))
+          AND n.created_at >= ?
+    """, (*keys, since)).fetchall()
+    best, best_score = None, SIMILARITY_THRESHOLD
+    for post_id, candidate in candidates:
+        score = similarity(signature, candidate)
+        if score >= best_score:
+            best, best_score = post_id, score
+    return best
+
+
+def _is_ingested(conn, channel_id, message_id):
+    return conn.execute(
+        "SELECT 1 FROM news_source WHERE channel_id = ? AND message_id = ?", (channel_id, message_id)
+    ).fetchone() is not None
+
+
+def _raise_high_water_mark(conn, channel_id, message_id):
+    conn.execute("""
+        INSERT INTO channel_state (channel_id, last_message_id) VALUES (?, ?)
+        ON CONFLICT (channel_id) DO UPDATE SET
+            last_message_id = MAX(last_message_id, excluded.last_message_id),
+            updated_at = CURRENT_TIMESTAMP
+    """, (channel_id, message_id))
+
+
+def _advance_backfill_cursor(conn, channel_id, message_id):
+    conn.execute("""
+        INSERT INTO channel_state (channel_id, last_message_id, backfill_message_id) VALUES (?, ?, ?)
+        ON CONFLICT (channel_id) DO UPDATE SET
+            backfill_message_id = MAX(COALESCE(backfill_message_id, 0), excluded.backfill_message_id),
+            updated_at = CURRENT_TIMESTAMP
+    """, (channel_id, message_id, message_id))
+
+
+def _ingest_posts(conn, items, backfill_cursor=None):
+    results = []
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - DEDUP_WINDOW_DAYS * 86400))
+    for message, digest, signature in items:
+        if message.message_id is not None:
+            if _is_ingested(conn, message.channel_id, message.message_id):
+                results.append((None, "seen"))
+                continue
+            _raise_high_water_mark(conn, message.channel_id, message.last_message_id)
+
+        keys = band_keys(signature) if signature else []
+        duplicate_of = _find_duplicate(conn, digest, signature, keys, since)
+        if duplicate_of is not None:
+            _insert_source(conn, duplicate_of, message.source_id, message.channel_id, message.message_id)
+            results.append((duplicate_of, "duplicate"))
+            continue
+        post_id = _insert_post(
+            conn, message.source_id, message.raw_text,
+            message.channel_id, message.message_id, message.message_date, message.styled_text
+        )
+        conn.execute(
+            "INSERT INTO news_fingerprint (post_id, content_hash, signature) VALUES (?, ?, ?)",
+            (post_id, digest, signature)
+        )
+        conn.executemany("INSERT OR IGNORE INTO news_lsh (band_key, post_id) VALUES (?, ?)", [(key, post_id) for key in keys])
+        if message.media:
+            _insert_media(conn, post_id, message.channel_id, message.media)
+        message_at = datetime.fromisoformat(message.message_date).timestamp() if message.message_date else None
+        conn.execute(
+            "INSERT OR IGNORE INTO post_timeline (post_id, channel, message_at, ingested_at) VALUES (?, ?, ?, ?)",
+            (post_id, message.source_id, message_at, time.time())
+        )
+        results.append((post_id, "new"))
+    if backfill_cursor is not None:
+        _advance_backfill_cursor(conn, *backfill_cursor)
+    return results
+
+
+async def ingest_posts(items, backfill_cursor=None):
+    """
+    Сохраняет пачку входящих сообщений одной транзакцией.
+
+    items — [(IncomingMessage, content_hash, minhash-подпись)]. Уже сохранённые
+    сообщения (по channel_id и message_id) пропускаются, high-water mark канала
+    поднимается в той же транзакции. Точные и почти-дубликаты (в том числе
+    внутри пачки) постов за последние DEDUP_WINDOW_DAYS дней не создают нового
+    поста: их канал добавляется в источники канонического поста. backfill_cursor — (channel_id, message_id): догрузка
+    в той же транзакции сдвигает курсор канала до этого сообщения.
+    Возвращает [(post_id, "new" | "duplicate" | "seen")] в том же порядке.
+    """
+    results = await storage.write(_ingest_posts, items, backfill_cursor)
+    new = sum(1 for _, kind in results if kind == "new")
+    duplicates = sum(1 for _, kind in results if kind == "duplicate")
+    logger.info(f"🆕 Добавлено {new} постов, дубликатов {duplicates}, уже сохранённых {len(results) - new - duplicates}")
+    return results
+
+
+def _select_backfill_cursors(conn):
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT channel_id, backfill_message_id FROM channel_state WHERE backfill_message_id IS NOT NULL"
+    )}
+
+
+async def get_backfill_cursors():
+    """
+    Возвращает {channel_id: ID сообщения}, до которого история канала догружена
+    без пропусков. Живой приём курсор не двигает — только догрузка.
+    """
+    return await storage.read(_select_backfill_cursors)
+
+
+def _select_new_posts(conn):
+    rows = conn.execute("SELECT id FROM news WHERE status IN ('new', 'pending', 'skipped')").fetchall()
+    return [row[0] for row in rows]
+
+
+async def get_new_posts():
     """Возвращает список ID новых постов"""
-    cursor.execute("SELECT id FROM news WHERE status IN ('new', 'pending', 'skipped')")
-    return [row[0] for row in cursor.fetchall()]
+    return await storage.read(_select_new_posts)
+
+
+def _count_by_status(conn, statuses):
+    placeholders = ", ".join("?" * len(statuses))
+    row = conn.execute(
+        f"SELECT COALESCE(SUM(count), 0) FROM news_status_count WHERE status IN ({placeholders})", statuses
+    ).fetchone()
+    return row[0]
 
-def set_post_status(post_id, status):
+
+async def count_posts_by_status(*statuses):
+    """Возвращает число постов с указанными статусами (по таблице счётчиков, без скана news)"""
+    return await storage.read(_count_by_status, statuses)
+
+
+def _update_status(conn, post_id, status):
+    conn.execute("UPDATE news SET status = ? WHERE id = ?", (status, post_id))
+    if status == "declined":
+        _mark_stage(conn, "declined_at", [post_id])
+
+
+async def set_post_status(post_id, status):
     """Обновляет статус поста"""
-    cursor.execute("UPDATE news SET status = ? WHERE id = ?", (status, post_id))
-    conn.commit()
+    await storage.write(_update_status, post_id, status)
     logger.info(f"🔄 Статус поста {post_id} изменен на {status}")
 
-def get_post(post_id):
-    """Возвращает пост по ID"""
-    cursor.execute("SELECT * FROM news WHERE id = ?", (post_id,))
-    post = cursor.fetchone()
+
+def _update_styled_text(conn, post_id, styled_text, status):
+    conn.execute("UPDATE news SET styled_text = ?, status = ? WHERE id = ?", (styled_text, status, post_id))
+    _mark_stage(conn, "edited_at", [post_id])
+
+
+async def set_styled_text(post_id, styled_text, status="pending"):
+    """Сохраняет отредактированный текст поста"""
+    await storage.write(_update_styled_text, post_id, styled_text, status)
+    logger.info(f"✏️ Текст поста {post_id} обновлён, статус {status}")
+
+
+def _update_styled_texts(conn, updates):
+    updated = []
+    for post_id, styled_text in updates:
+        cur = conn.execute(
+            "UPDATE news SET styled_text = ?, status = 'pending' WHERE id = ? AND status IN ('new', 'pending', 'skipped')",
+            (styled_text, post_id)
+        )
+        if cur.rowcount:
+            updated.append(post_id)
+    _mark_stage(conn, "edited_at", updated)
+    return updated
+
+
+async def set_styled_texts(updates):
+    """
+    Сохраняет пачку отредактированных текстов [(post_id, styled_text)] одной
+    транзакцией со статусом pending. Посты, которые уже ушли из очереди
+    модерации, не трогаются; возвращает ID обновлённых.
+    """
+    updated = await storage.write(_update_styled_texts, updates)
+    logger.info(f"✏️ Обновлены тексты {len(updated)} постов")
+    return updated
+
+
+def _select_post_ids_by_status(conn, status):
+    return [row[0] for row in conn.execute("SELECT id FROM news WHERE status = ? ORDER BY id", (status,))]
+
+
+async def get_post_ids_by_status(status):
+    """ID постов с указанным статусом по возрастанию"""
+    return await storage.read(_select_post_ids_by_status, status)
+
+
+def _select_queue_page(conn, after_id, limit):
+    rows = conn.execute("""
+        SELECT n.id, n.source_id, COALESCE(n.styled_text, n.raw_text), n.status,
+               (SELECT COUNT(*) FROM news_media m WHERE m.post_id = n.id)
+        FROM news n
+        WHERE n.status IN ('new', 'pending', 'skipped') AND n.id > ?
+        ORDER BY n.id LIMIT ?
+    """, (after_id, limit))
+    return [tuple(row) for row in rows]
+
+
+async def get_queue_page(after_id=0, limit=10):
+    """Страница очереди модерации по ключу: [(id, source_id, text, status, media_count)]"""
+    return await storage.read(_select_queue_page, after_id, limit)
+
+
+def _update_queue_status(conn, post_ids, status):
+    updated = []
+    for post_id in post_ids:
+        cur = conn.execute(
+            "UPDATE news SET status = ? WHERE id = ? AND status IN ('new', 'pending', 'skipped')", (status, post_id)
+        )
+        if cur.rowcount:
+            updated.append(post_id)
+    if status == "declined":
+        _mark_stage(conn, "declined_at", updated)
+    return updated
+
+
+async def set_posts_status(post_ids, status):
+    """
+    Меняет статус постов одной транзакцией. Трогает только посты, которые ещё
+    в очереди модерации (другой админ мог успеть их обработать); возвращает их ID.
+    """
+    updated = await storage.write(_update_queue_status, post_ids, status)
+    logger.info(f"🔄 Статус {len(updated)} постов изменен на {status}")
+    return updated
+
+
+def _select_post(conn, post_id):
+    return conn.execute(f"SELECT {POST_COLUMNS} FROM news WHERE id = ?", (post_id,)).fetchone()
+
+
+def _select_any_post(conn, post_id):
+    post = _select_post(conn, post_id)
+    if post is None:
+        # Старые посты лежат в архиве со сжатым текстом
+        post = conn.execute("""
+            SELECT id, source_id, unpack_text(raw_text), unpack_text(styled_text), status, notified, created_at
+            FROM news_archive WHERE id = ?
+        """, (post_id,)).fetchone()
+    return post
+
+
+async def get_post(post_id):
+    """Возвращает пост по ID (в том числе из архива)"""
+    post = await storage.read(_select_any_post, post_id)
     if not post:
         logger.warning(f"⚠️ Пост с ID {post_id} не найден")
     return post
 
+# --- Полнотекстовый поиск ---
+
+# Маркеры подсветки в сниппете (заменяются на теги после экранирования HTML)
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+
+def fts_query(text):
+    """
+    Превращает запрос админа в выражение FTS5: каждое слово — термин в
+    кавычках (спецсимволы не ломают запрос), все слова обязательны.
+    «слово*» ищет по началу слова — это заметно дороже на большом архиве.
+    Возвращает None, если слов нет.
+    """
+    terms = re.findall(r"(\w+)(\*?)", text.lower())
+    return " ".join(f'"{word}"{star}' for word, star in terms) or None
+
+
+def _search_posts(conn, query, statuses, after, limit, max_candidates):
+    # Кандидаты — самые свежие совпадения (FTS5 отдаёт их по rowid без сортировки),
+    # ранжируются только они: частое слово не заставляет считать bm25 по всему архиву.
+    # Пост ищется в news и news_archive по первичному ключу, а не через представление
+    # news_all: его UNION ALL SQLite материализует целиком, распаковывая архив
+    status_filter = ""
+    params = [query]
+    if statuses:
+        placeholders = ", ".join("?" * len(statuses))
+        status_filter = f"""
+            AND (EXISTS (SELECT 1 FROM news s WHERE s.id = news_fts.rowid AND s.status IN ({placeholders}))
+              OR EXISTS (SELECT 1 FROM news_archive s WHERE s.id = news_fts.rowid AND s.status IN ({placeholders})))
+        """
+        params += list(statuses) * 2
+    sql = f"""
+        WITH hits AS (
+            SELECT news_fts.rowid AS id, news_fts.rank AS rank
+            FROM news_fts
+            WHERE news_fts MATCH ? {status_filter}
+            ORDER BY news_fts.rowid DESC LIMIT ?
+        )
+        SELECT h.id, COALESCE(n.source_id, a.source_id), COALESCE(n.status, a.status),
+               COALESCE(n.created_at, a.created_at), h.rank
+        FROM hits h
+        LEFT JOIN news n ON n.id = h.id
+        LEFT JOIN news_archive a ON a.id = h.id
+        WHERE (n.id IS NOT NULL OR a.id IS NOT NULL)
+    """
+    params.append(max_candidates)
+    if after:
+        sql += " AND (h.rank, h.id) > (?, ?)"
+        params += after
+    sql += " ORDER BY h.rank, h.id LIMIT ?"
+    params.append(limit)
+    rows = conn.execute(sql, params).fetchall()
+
+    # Сниппеты — только для строк страницы
+    snippets = {}
+    if rows:
+        ids = [row[0] for row in rows]
+        snippets = dict(conn.execute(f"""
+            SELECT rowid, snippet(news_fts, -1, ?, ?, '…', 24) FROM news_fts
+            WHERE news_fts MATCH ? AND rowid IN ({', '.join('?' * len(ids))})
+        """, [SNIPPET_OPEN, SNIPPET_CLOSE, query] + ids))
+    return [
+        (post_id, source_id, status, created_at, snippets.get(post_id, ""), rank)
+        for post_id, source_id, status, created_at, rank in rows
+    ]
+
+
+async def search_posts(query, statuses=(), after=None, limit=10, max_candidates=10000):
+    """
+    Ищет посты по raw_text и styled_text, лучшие совпадения (bm25) первыми;
+    ранжируются max_candidates самых свежих совпадений. Страницы — по ключу:
+    after — (rank, id) последнего результата предыдущей страницы.
+    Возвращает [(id, source_id, status, created_at, snippet, rank)].
+    """
+    return await storage.read(
+        _search_posts, query, list(statuses), list(after) if after else None, limit, max_candidates
+    )
+
+
+# --- Архив старых постов ---
+
+def _archive_posts(conn, statuses, cutoff, limit):
+    placeholders = ", ".join("?" * len(statuses))
+    # Отложенные посты из открытых сессий модерации не трогаем
+    rows = conn.execute(f"""
+        SELECT {POST_COLUMNS} FROM news
+        WHERE status IN ({placeholders}) AND created_at < ?
+          AND id NOT IN (SELECT post_id FROM moderation_session_item)
+        ORDER BY created_at LIMIT ?
+    """, (*statuses, cutoff, limit)).fetchall()
+    if not rows:
+        return 0
+    conn.executemany("""
+        INSERT OR REPLACE INTO news_archive (id, source_id, raw_text, styled_text, status, notified, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (post_id, source_id, pack_text(raw_text), pack_text(styled_text), status, notified, created_at)
+        for post_id, source_id, raw_text, styled_text, status, notified, created_at in rows
+    ])
+    ids = [(row[0],) for row in rows]
+    # news_fts не трогаем: текст архивного поста индекс читает через news_all.
+    # Остальные строки поста в горячих таблицах архиву не нужны: дубликаты ищутся
+    # только среди news, источники и медиа нужны лишь для модерации и публикации
+    conn.executemany("DELETE FROM news WHERE id = ?", ids)
+    conn.executemany("DELETE FROM news_media WHERE post_id = ?", ids)
+    conn.executemany("DELETE FROM news_source WHERE post_id = ?", ids)
+    conn.executemany("DELETE FROM notification_outbox WHERE post_id = ?", ids)
+    conn.executemany("DELETE FROM publish_job WHERE idempotency_key = ?", [(f"post:{post_id}",) for post_id, in ids])
+    # news_lsh без индекса по post_id — удаляем по ключам полос из подписи
+    lsh = []
+    for post_id, in ids:
+        row = conn.execute("SELECT signature FROM news_fingerprint WHERE post_id = ?", (post_id,)).fetchone()
+        if row and row[0]:
+            lsh += [(key, post_id) for key in band_keys(row[0])]
+    conn.executemany("DELETE FROM news_lsh WHERE band_key = ? AND post_id = ?", lsh)
+    conn.executemany("DELETE FROM news_fingerprint WHERE post_id = ?", ids)
+    # post_timeline остаётся: /timeline смотрит на TIMELINE_RETENTION_DAYS назад,
+    # её строки удаляет RetentionService по этому сроку
+    return len(rows)
+
+
+async def archive_posts(statuses, older_than_days, limit=500):
+    """
+    Переносит до limit постов со статусами statuses старше older_than_days дней
+    в news_archive (текст сжимается) одной транзакцией; возвращает их число.
+    """
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - older_than_days * 86400))
+    return await storage.write(_archive_posts, list(statuses), cutoff, limit)
+
+
+def _incremental_vacuum(conn, pages):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+async def incremental_vacuum(pages):
+    """
+    Возвращает файлу до pages свободных страниц; результат — сколько осталось
+    (None, если база не в режиме auto_vacuum=INCREMENTAL).
+    """
+    return await storage.write(_incremental_vacuum, pages)
+
+
 # --- Функции для модерационной сессии ---
 
-def create_session(admin_id, post_ids):
+
+# Курсоры сессий {admin_id: (current_index, total)} с записью насквозь.
+# Сессиями владеет процесс бота; из других процессов используйте has_active_session().
+_session_cursors = {}
+# Счётчик изменений сессии: результат чтения, начатого до записи, не попадает в кэш
+_session_versions = {}
+
+
+def _set_session_cursor(admin_id, cursor):
+    _session_versions[admin_id] = _session_versions.get(admin_id, 0) + 1
+    _session_cursors[admin_id] = cursor
+
+
+def _forget_session_cursor(admin_id):
+    _session_versions[admin_id] = _session_versions.get(admin_id, 0) + 1
+    _session_cursors.pop(admin_id, None)
+
+
+def _replace_session(conn, admin_id, post_ids):
+    conn.execute("DELETE FROM moderation_session_item WHERE admin_id = ?", (admin_id,))
+    conn.executemany(
+        "INSERT INTO moderation_session_item (admin_id, position, post_id) VALUES (?, ?, ?)",
+        [(admin_id, position, post_id) for position, post_id in enumerate(post_ids)]
+    )
+    conn.execute("""
+        INSERT OR REPLACE INTO moderation_session (admin_id, post_ids, current_index, total)
+        VALUES (?, NULL, 0, ?)
+    """, (admin_id, len(post_ids)))
+
+
+async def create_session(admin_id, post_ids):
     """Создает или обновляет сессию модерации для админа"""
-    post_ids_json = json.dumps(post_ids)
-    cursor.execute("""
-        INSERT OR REPLACE INTO moderation_session (admin_id, post_ids, current_index)
-        VALUES (?, ?, ?)
-    """, (admin_id, post_ids_json, 0))
-    conn.commit()
+    await storage.write(_replace_session, admin_id, post_ids)
+    _set_session_cursor(admin_id, (0, len(post_ids)))
     logger.info(f"✅ Создана сессия модерации для админа {admin_id} с {len(post_ids)} постами")
 
-def get_current_post_for_admin(admin_id):
+
+def _replace_session_from_queue(conn, admin_id):
+    conn.execute("DELETE FROM moderation_session_item WHERE admin_id = ?", (admin_id,))
+    total = conn.execute("""
+        INSERT INTO moderation_session_item (admin_id, position, post_id)
+        SELECT ?, ROW_NUMBER() OVER (ORDER BY id) - 1, id
+        FROM news WHERE status IN ('new', 'pending', 'skipped')
+    """, (admin_id,)).rowcount
+    if total:
+        conn.execute("""
+            INSERT OR REPLACE INTO moderation_session (admin_id, post_ids, current_index, total)
+            VALUES (?, NULL, 0, ?)
+        """, (admin_id, total))
+    return total
+
+
+async def create_session_from_queue(admin_id):
+    """Создает сессию из всех постов очереди модерации, не загружая их ID в память; возвращает их число"""
+    total = await storage.write(_replace_session_from_queue, admin_id)
+    if total:
+        _set_session_cursor(admin_id, (0, total))
+        logger.info(f"✅ Создана сессия модерации для админа {admin_id} с {total} постами")
+    return total
+
+
+def _select_session_cursor(conn, admin_id):
+    row = conn.execute("SELECT current_index, total FROM moderation_session WHERE admin_id = ?", (admin_id,)).fetchone()
+    return tuple(row) if row else None
+
+
+async def _get_session_cursor(admin_id):
+    if admin_id in _session_cursors:
+        return _session_cursors[admin_id]
+    version = _session_versions.get(admin_id, 0)
+    cursor = await storage.read(_select_session_cursor, admin_id)
+    if _session_versions.get(admin_id, 0) == version:
+        _session_cursors[admin_id] = cursor
+    return cursor
+
+
+def _select_session_item(conn, admin_id, position):
+    row = conn.execute(
+        "SELECT post_id FROM moderation_session_item WHERE admin_id = ? AND position = ?", (admin_id, position)
+    ).fetchone()
+    return row[0] if row else None
+
+
+async def get_current_post_for_admin(admin_id):
     """Возвращает ID текущего поста из сессии"""
-    cursor.execute("SELECT post_ids, current_index FROM moderation_session WHERE admin_id = ?", (admin_id,))
-    row = cursor.fetchone()
-    if not row:
+    cursor = await _get_session_cursor(admin_id)
+    if not cursor:
         return None
-    post_ids, index = json.loads(row[0]), row[1]
-    if index >= len(post_ids):
+    index, total = cursor
+    if index >= total:
         return None
-    return post_ids[index]
+    return await storage.read(_select_session_item, admin_id, index)
+
+
+async def get_session_cursor(admin_id):
+    """Возвращает (current_index, total) сессии админа или None"""
+    return await _get_session_cursor(admin_id)
+
+
+def _select_session_views(conn, admin_id, from_position, limit):
+    views = []
+    for position, post_id in _select_session_page(conn, admin_id, from_position - 1, limit):
+        post = _select_post(conn, post_id)
+        sources = _select_post_sources(conn, post_id) if post else []
+        media = _select_post_media(conn, post_id) if post else []
+        views.append((position, post_id, post, sources, media))
+    return views
+
+
+async def get_session_views(admin_id, from_position, limit):
+    """
+    Возвращает данные для показа limit постов сессии начиная с from_position
+    одним обращением к пулу чтения: [(position, post_id, post, sources, media)].
+    Для удалённого поста post равен None.
+    """
+    return await storage.read(_select_session_views, admin_id, from_position, limit)
+
 
-def advance_session(admin_id):
+def _select_session_page(conn, admin_id, after_position, limit):
+    rows = conn.execute("""
+        SELECT position, post_id FROM moderation_session_item
+        WHERE admin_id = ? AND position > ? ORDER BY position LIMIT ?
+    """, (admin_id, after_position, limit))
+    return [tuple(row) for row in rows]
+
+
+async def get_session_page(admin_id, after_position=-1, limit=10):
+    """Возвращает [(position, post_id)] сессии после указанной позиции (постранично по ключу)"""
+    return await storage.read(_select_session_page, admin_id, after_position, limit)
+
+
+def _has_session(conn, admin_id):
+    row = conn.execute("SELECT current_index < total FROM moderation_session WHERE admin_id = ?", (admin_id,)).fetchone()
+    return bool(row and row[0])
+
+
+async def has_active_session(admin_id):
+    """Проверяет наличие незавершённой сессии напрямую в БД (без кэша курсоров)"""
+    return await storage.read(_has_session, admin_id)
+
+
+def _advance_session(conn, admin_id):
+    conn.execute("UPDATE moderation_session SET current_index = current_index + 1 WHERE admin_id = ?", (admin_id,))
+
+
+async def advance_session(admin_id):
     """Переходит к следующему посту"""
-    cursor.execute("UPDATE moderation_session SET current_index = current_index + 1 WHERE admin_id = ?", (admin_id,))
-    conn.commit()
+    await storage.write(_advance_session, admin_id)
+    cursor = _session_cursors.get(admin_id)
+    if cursor:
+        _set_session_cursor(admin_id, (cursor[0] + 1, cursor[1]))
+    else:
+        _forget_session_cursor(admin_id)
     logger.info(f"➡️ Сессия админа {admin_id} перешла к следующему посту")
 
-def end_session(admin_id):
+
+def _delete_session(conn, admin_id):
+    conn.execute("DELETE FROM moderation_session_item WHERE admin_id = ?", (admin_id,))
+    conn.execute("DELETE FROM moderation_session WHERE admin_id = ?", (admin_id,))
+
+
+async def end_session(admin_id):
     """Завершает сессию"""
-    cursor.execute("DELETE FROM moderation_session WHERE admin_id = ?", (admin_id,))
-    conn.commit()
+    await storage.write(_delete_session, admin_id)
+    _set_session_cursor(admin_id, None)
     logger.info(f"🏁 Сессия модерации админа {admin_id} завершена")
 
-def get_session_index(admin_id):
+
+async def get_session_index(admin_id):
     """Возвращает текущий индекс поста в сессии"""
-    cursor.execute("SELECT current_index FROM moderation_session WHERE admin_id = ?", (admin_id,))
-    row = cursor.fetchone()
-    return row[0] if row else 0
+    cursor = await _get_session_cursor(admin_id)
+    return cursor[0] if cursor else 0
+
 
-def get_session_total(admin_id):
+async def get_session_total(admin_id):
     """Возвращает общее количество постов в сессии"""
-    cursor.execute("SELECT post_ids FROM moderation_session WHERE admin_id = ?", (admin_id,))
-    row = cursor.fetchone()
-    return len(json.loads(row[0])) if row else 0
+    cursor = await _get_session_cursor(admin_id)
+    return cursor[1] if cursor else 0
 
-def get_unnotified_posts():
-    cursor.execute("SELECT id FROM news WHERE notified = 0 AND status = 'new'")
-    posts = [row[0] for row in cursor.fetchall()]
+
+def _select_unnotified(conn):
+    rows = conn.execute(
+        "SELECT id FROM news INDEXED BY idx_news_unnotified WHERE notified = 0 AND status = 'new'"
+    )
+    return [row[0] for row in rows]
+
+
+async def get_unnotified_posts():
+    posts = await storage.read(_select_unnotified)
     if posts:
         logger.info(f"🔔 Найдено {len(posts)} непрочитанных постов")
     return posts
 
-def mark_posts_notified(post_ids):
+
+def _mark_notified(conn, post_ids):
+    conn.executemany("UPDATE news SET notified = 1 WHERE id = ?", [(pid,) for pid in post_ids])
+    _mark_stage(conn, "notified_at", post_ids)
+
+
+async def mark_posts_notified(post_ids):
     if post_ids:
-        cursor.executemany("UPDATE news SET notified = 1 WHERE id = ?", [(pid,) for pid in post_ids])
-        conn.commit()
-        logger.info(f"✅ Отмечено {len(post_ids)} постов как прочитанные")
\ No newline at end of file
+        await storage.write(_mark_notified, post_ids)
+        logger.info(f"✅ Отмечено {len(post_ids)} постов как прочитанные")
+
+
+# --- Функции для кэша переписываний ---
+
+def _select_cached_rewrite(conn, key, min_created_at):
+    return conn.execute(
+        "SELECT revised_text, latency, created_at FROM rewrite_cache WHERE key = ? AND created_at >= ?",
+        (key, min_created_at)
+    ).fetchone()
+
+
+def _touch_cached_rewrite(conn, key, now):
+    conn.execute("UPDATE rewrite_cache SET last_used_at = ? WHERE key = ?", (now, key))
+
+
+async def get_cached_rewrite(key, ttl):
+    """Возвращает (текст, задержка исходного запроса, время создания) или None"""
+    now = time.time()
+    row = await storage.read(_select_cached_rewrite, key, now - ttl)
+    if row:
+        # Обновление времени использования не ждём — оно нужно только для вытеснения
+        storage.submit_write(_touch_cached_rewrite, key, now)
+    return tuple(row) if row else None
+
+
+def _upsert_cached_rewrite(conn, key, revised_text, latency, now, ttl, max_rows):
+    conn.execute("""
+        INSERT OR REPLACE INTO rewrite_cache (key, revised_text, latency, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (key, revised_text, latency, now, now))
+    conn.execute("DELETE FROM rewrite_cache WHERE created_at < ?", (now - ttl,))
+    conn.execute("""
+        DELETE FROM rewrite_cache WHERE key IN (
+            SELECT key FROM rewrite_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+        )
+    """, (max_rows,))
+
+
+async def put_cached_rewrite(key, revised_text, latency, ttl, max_rows):
+    """Сохраняет результат переписывания, удаляя просроченные и самые старые записи"""
+    await storage.write(_upsert_cached_rewrite, key, revised_text, latency, time.time(), ttl, max_rows)
+
+
+# --- Функции для очереди уведомлений ---
+
+def _select_pending_notifications(conn):
+    return [tuple(row) for row in conn.execute("SELECT id, post_id FROM notification_outbox ORDER BY id")]
+
+
+async def get_pending_notifications():
+    """Возвращает список (event_id, post_id) ещё не разосланных событий"""
+    return await storage.read(_select_pending_notifications)
+
+
+def _ack_notifications(conn, event_ids, post_ids):
+    conn.executemany("DELETE FROM notification_outbox WHERE id = ?", [(eid,) for eid in event_ids])
+    conn.executemany("UPDATE news SET notified = 1 WHERE id = ?", [(pid,) for pid in post_ids])
+    _mark_stage(conn, "notified_at", post_ids)
+
+
+async def ack_notifications(event_ids, post_ids):
+    """Удаляет разосланные события и отмечает посты как прочитанные"""
+    if event_ids:
+        await storage.write(_ack_notifications, event_ids, post_ids)
+        logger.info(f"✅ Отмечено {len(post_ids)} постов как прочитанные")
+
+
+def _select_notification_messages(conn):
+    return {row[0]: row[1] for row in conn.execute("SELECT admin_id, message_id FROM admin_notification")}
+
+
+async def get_notification_messages():
+    """Возвращает {admin_id: message_id} последних уведомлений"""
+    return await storage.read(_select_notification_messages)
+
+
+def _upsert_notification_message(conn, admin_id, message_id):
+    conn.execute("INSERT OR REPLACE INTO admin_notification (admin_id, message_id) VALUES (?, ?)", (admin_id, message_id))
+
+
+async def set_notification_message(admin_id, message_id):
+    await storage.write(_upsert_notification_message, admin_id, message_id)
+
+
+# --- Функции для источников постов ---
+
+def _select_post_sources(conn, post_id):
+    rows = conn.execute("SELECT DISTINCT source_id FROM news_source WHERE post_id = ? ORDER BY rowid", (post_id,))
+    return [row[0] for row in rows]
+
+
+async def get_post_sources(post_id):
+    """Возвращает список каналов, из которых пришёл пост и его дубликаты"""
+    return await storage.read(_select_post_sources, post_id)
+
+
+# --- Функции для кэша каналов-источников ---
+
+def _select_channel_peers(conn):
+    rows = conn.execute("SELECT channel, peer_id, access_hash, title, username FROM channel_peer")
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+async def get_channel_peers():
+    """Возвращает {channel: (peer_id, access_hash, title, username)}"""
+    return await storage.read(_select_channel_peers)
+
+
+def _upsert_channel_peer(conn, channel, peer_id, access_hash, title, username):
+    conn.execute("""
+        INSERT OR REPLACE INTO channel_peer (channel, peer_id, access_hash, title, username)
+        VALUES (?, ?, ?, ?, ?)
+    """, (channel, peer_id, access_hash, title, username))
+
+
+async def save_channel_peer(channel, peer_id, access_hash, title, username):
+    await storage.write(_upsert_channel_peer, channel, peer_id, access_hash, title, username)
+
+
+# --- Функции для медиа постов ---
+
+def _insert_media(conn, post_id, channel_id, media):
+    conn.executemany("""
+        INSERT INTO news_media (
+            post_id, position, kind, channel_id, message_id, grouped_id,
+            media_id, access_hash, file_reference, mime_type, file_size
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(post_id, position, ref.kind, channel_id, ref.message_id, ref.grouped_id,
+           ref.media_id, ref.access_hash, ref.file_reference, ref.mime_type, ref.file_size)
+          for position, ref in enumerate(media)])
+
+
+def _select_pending_media(conn):
+    return conn.execute("""
+        SELECT post_id, position, channel_id, message_id FROM news_media
+        WHERE relay_status = 'pending'
+        ORDER BY channel_id, post_id, position
+    """).fetchall()
+
+
+async def get_pending_media():
+    """Возвращает медиа, ещё не пересланные в relay-чат: [(post_id, position, channel_id, message_id)]"""
+    return await storage.read(_select_pending_media)
+
+
+def _update_media_relay(conn, updates):
+    conn.executemany("""
+        UPDATE news_media SET relay_chat_id = ?, relay_message_id = ?, relay_status = ?
+        WHERE post_id = ? AND position = ?
+    """, updates)
+
+
+async def set_media_relayed(updates):
+    """updates — [(relay_chat_id, relay_message_id, relay_status, post_id, position)]"""
+    await storage.write(_update_media_relay, updates)
+
+
+def _select_post_media(conn, post_id):
+    return conn.execute("""
+        SELECT kind, relay_status, relay_chat_id, relay_message_id FROM news_media
+        WHERE post_id = ? ORDER BY position
+    """, (post_id,)).fetchall()
+
+
+async def get_post_media(post_id):
+    """Возвращает медиа поста по порядку: [(kind, relay_status, relay_chat_id, relay_message_id)]"""
+    return await storage.read(_select_post_media, post_id)
+
+
+# --- Функции для отложенного удаления сообщений ---
+
+def _insert_pending_deletion(conn, chat_id, message_id, due_at):
+    conn.execute(
+        "INSERT OR REPLACE INTO pending_deletion (chat_id, message_id, due_at) VALUES (?, ?, ?)",
+        (chat_id, message_id, due_at)
+    )
+
+
+def save_pending_deletion(chat_id, message_id, due_at):
+    """Запоминает удаление в фоне, не дожидаясь коммита (обработчик не ждёт БД)"""
+    storage.submit_write(_insert_pending_deletion, chat_id, message_id, due_at)
+
+
+def _select_pending_deletions(conn):
+    return [tuple(row) for row in conn.execute("SELECT chat_id, message_id, due_at FROM pending_deletion")]
+
+
+async def get_pending_deletions():
+    """Возвращает [(chat_id, message_id, due_at)]"""
+    return await storage.read(_select_pending_deletions)
+
+
+def _delete_pending_deletions(conn, keys):
+    conn.executemany("DELETE FROM pending_deletion WHERE chat_id = ? AND message_id = ?", keys)
+
+
+async def remove_pending_deletions(keys):
+    """keys — [(chat_id, message_id)]"""
+    await storage.write(_delete_pending_deletions, keys)
+
+
+# --- Функции для журнала сообщений в чатах админов ---
+
+def _insert_chat_messages(conn, rows):
+    conn.executemany("INSERT OR IGNORE INTO chat_message (chat_id, message_id, sent_at) VALUES (?, ?, ?)", rows)
+
+
+def record_chat_messages(rows):
+    """rows — [(chat_id, message_id, sent_at)]; пишется в фоне, обработчик не ждёт БД"""
+    storage.submit_write(_insert_chat_messages, rows)
+
+
+def _select_chat_messages(conn, chat_id, since):
+    return [row[0] for row in conn.execute(
+        "SELECT message_id FROM chat_message WHERE chat_id = ? AND sent_at >= ? ORDER BY message_id",
+        (chat_id, since)
+    )]
+
+
+async def get_chat_messages(chat_id, since=0):
+    """ID сообщений чата из журнала, отправленных не раньше since"""
+    return await storage.read(_select_chat_messages, chat_id, since)
+
+
+def _delete_chat_messages(conn, keys):
+    conn.executemany("DELETE FROM chat_message WHERE chat_id = ? AND message_id = ?", keys)
+
+
+def forget_chat_messages(keys):
+    """keys — [(chat_id, message_id)] удалённых сообщений; в фоне"""
+    storage.submit_write(_delete_chat_messages, keys)
+
+
+def _clear_chat_messages(conn, chat_id, up_to_message_id):
+    conn.execute("DELETE FROM chat_message WHERE chat_id = ? AND message_id <= ?", (chat_id, up_to_message_id))
+
+
+async def clear_chat_messages(chat_id, up_to_message_id):
+    """Очищает журнал чата до сообщения up_to_message_id включительно"""
+    await storage.write(_clear_chat_messages, chat_id, up_to_message_id)
+
+
+def _prune_chat_messages(conn, before):
+    conn.execute("DELETE FROM chat_message WHERE sent_at < ?", (before,))
+
+
+def prune_chat_messages(before):
+    """Забывает сообщения старше before — бот всё равно не может их удалить; в фоне"""
+    storage.submit_write(_prune_chat_messages, before)
+
+
+# --- Функции для хранилища состояний FSM ---
+
+def _select_fsm_state(conn, key):
+    row = conn.execute("SELECT state, data FROM fsm_state WHERE key = ?", (key,)).fetchone()
+    return tuple(row) if row else None
+
+
+async def get_fsm_state(key):
+    """Возвращает (state, data_json) или None"""
+    return await storage.read(_select_fsm_state, key)
+
+
+def _save_fsm_states(conn, rows):
+    for key, state, data in rows:
+        if state is None and data == "{}":
+            conn.execute("DELETE FROM fsm_state WHERE key = ?", (key,))
+            continue
+        conn.execute("""
+            INSERT INTO fsm_state (key, state, data) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = excluded.state, data = excluded.data, updated_at = CURRENT_TIMESTAMP
+        """, (key, state, data))
+
+
+async def save_fsm_states(rows):
+    """rows — [(key, state, data_json)]; пустое состояние удаляет строку"""
+    await storage.write(_save_fsm_states, rows)
+
+
+# --- Функции для outbox публикации ---
+
+def _enqueue_publish(conn, jobs):
+    enqueued = []
+    for post_id, scheduled_at in jobs:
+        cur = conn.execute(
+            "UPDATE news SET status = 'queued' WHERE id = ? AND status IN ('new', 'pending', 'skipped')", (post_id,)
+        )
+        if not cur.rowcount:
+            continue
+        # Ключ идемпотентности — сам пост: опубликованный однажды пост повторно не уходит,
+        # а задание, упавшее окончательно, при новой публикации перезапускается
+        conn.execute("""
+            INSERT INTO publish_job (post_id, idempotency_key, scheduled_at) VALUES (?, ?, ?)
+            ON CONFLICT (idempotency_key) DO UPDATE SET
+                status = 'pending', attempts = 0, last_error = NULL, progress = NULL,
+                scheduled_at = excluded.scheduled_at, updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'failed'
+        """, (post_id, f"post:{post_id}", scheduled_at))
+        sent = conn.execute(
+            "SELECT 1 FROM publish_job WHERE idempotency_key = ? AND status = 'sent'", (f"post:{post_id}",)
+        ).fetchone()
+        if sent:
+            conn.execute("UPDATE news SET status = 'published' WHERE id = ?", (post_id,))
+            continue
+        enqueued.append(post_id)
+    return enqueued
+
+
+async def enqueue_publish(jobs):
+    """
+    Ставит посты в очередь публикации одной транзакцией: jobs — [(post_id, scheduled_at)].
+    Посты получают статус queued; уже обработанные и уже опубликованные пропускаются.
+    Возвращает ID поставленных постов.
+    """
+    enqueued = await storage.write(_enqueue_publish, jobs)
+    logger.info(f"📤 В очередь публикации поставлено {len(enqueued)} постов")
+    return enqueued
+
+
+def _select_due_publish_job(conn, now):
+    job = conn.execute("""
+        SELECT id, post_id, attempts, progress FROM publish_job
+        WHERE status = 'pending' AND scheduled_at <= ?
+        ORDER BY scheduled_at, id LIMIT 1
+    """, (now,)).fetchone()
+    if job:
+        return tuple(job), None
+    row = conn.execute("SELECT MIN(scheduled_at) FROM publish_job WHERE status = 'pending'").fetchone()
+    return None, row[0]
+
+
+async def get_due_publish_job(now):
+    """Возвращает ((job_id, post_id, attempts, progress_json) или None, время ближайшего задания или None)"""
+    return await storage.read(_select_due_publish_job, now)
+
+
+def _select_scheduled_times(conn, since):
+    rows = conn.execute("SELECT scheduled_at FROM publish_job WHERE status = 'pending' AND scheduled_at >= ?", (since,))
+    return [row[0] for row in rows]
+
+
+async def get_scheduled_times(since):
+    """Время ещё не отправленных заданий начиная с since (для выбора свободного слота)"""
+    return await storage.read(_select_scheduled_times, since)
+
+
+def _update_publish_job(conn, job_id, status, **fields):
+    fields["status"] = status
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    conn.execute(
+        f"UPDATE publish_job SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (*fields.values(), job_id)
+    )
+
+
+async def mark_publish_sending(job_id):
+    """Отмечает начало отправки (коммит до запроса к Telegram)"""
+    await storage.write(_update_publish_job, job_id, "sending")
+
+
+def _save_publish_progress(conn, job_id, progress):
+    conn.execute("UPDATE publish_job SET progress = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?", (progress, job_id))
+
+
+async def save_publish_progress(job_id, progress):
+    """Сохраняет выполненные шаги отправки (JSON) до следующего запроса к Telegram"""
+    await storage.write(_save_publish_progress, job_id, progress)
+
+
+def _complete_publish_job(conn, job_id, post_id, message_id):
+    _update_publish_job(conn, job_id, "sent", message_id=message_id)
+    conn.execute("UPDATE news SET status = 'published' WHERE id = ?", (post_id,))
+    _mark_stage(conn, "published_at", [post_id])
+
+
+async def complete_publish_job(job_id, post_id, message_id):
+    """Задание выполнено и пост опубликован — одной транзакцией"""
+    await storage.write(_complete_publish_job, job_id, post_id, message_id)
+
+
+def _retry_publish_job(conn, job_id, scheduled_at, attempts, error):
+    _update_publish_job(conn, job_id, "pending", scheduled_at=scheduled_at, attempts=attempts, last_error=error)
+
+
+async def retry_publish_job(job_id, scheduled_at, attempts, error):
+    """Возвращает задание в очередь на время scheduled_at"""
+    await storage.write(_retry_publish_job, job_id, scheduled_at, attempts, error)
+
+
+def _fail_publish_job(conn, job_id, post_id, attempts, error):
+    _update_publish_job(conn, job_id, "failed", attempts=attempts, last_error=error)
+    # Пост возвращается в очередь модерации
+    conn.execute("UPDATE news SET status = 'pending' WHERE id = ? AND status = 'queued'", (post_id,))
+
+
+async def fail_publish_job(job_id, post_id, attempts, error):
+    await storage.write(_fail_publish_job, job_id, post_id, attempts, error)
+
+
+def _recover_publish_jobs(conn):
+    # Отправка прервалась после коммита 'sending': неизвестно, дошёл ли пост.
+    # Чтобы не опубликовать его дважды, считаем его опубликованным (at-most-once).
+    rows = conn.execute("SELECT id, post_id FROM publish_job WHERE status = 'sending'").fetchall()
+    for job_id, post_id in rows:
+        _update_publish_job(conn, job_id, "interrupted")
+        conn.execute("UPDATE news SET status = 'published' WHERE id = ?", (post_id,))
+    return [row[1] for row in rows]
+
+
+async def recover_publish_jobs():
+    """Закрывает задания, прерванные посреди отправки; возвращает ID их постов"""
+    return await storage.write(_recover_publish_jobs)
+
+
+# --- Хронология этапов поста ---
+
+TIMELINE_STAGES = ("notified_at", "first_shown_at", "edited_at", "published_at", "declined_at")
+
+
+def _mark_stage(conn, stage, post_ids, at=None):
+    # Этап фиксируется при первом наступлении; имя колонки только из TIMELINE_STAGES
+    if stage not in TIMELINE_STAGES:
+        raise ValueError(f"Неизвестный этап {stage}")
+    at = at or time.time()
+    conn.executemany(
+        f"UPDATE post_timeline SET {stage} = COALESCE({stage}, ?) WHERE post_id = ?",
+        [(at, post_id) for post_id in post_ids]
+    )
+
+
+def _record_stages(conn, marks):
+    for stage, post_id, at in marks:
+        _mark_stage(conn, stage, [post_id], at)
+
+
+def record_stages(marks):
+    """marks — [(этап, post_id, unix-время)]; пишется в фоне одной задачей писателя"""
+    storage.submit_write(_record_stages, marks)
+
+
+def _select_timeline(conn, since, until):
+    rows = conn.execute("""
+        SELECT channel, message_at, ingested_at, notified_at, first_shown_at, edited_at, published_at, declined_at
+        FROM post_timeline WHERE ingested_at >= ? AND ingested_at < ?
+    """, (since, until))
+    return [tuple(row) for row in rows]
+
+
+async def get_timeline(since, until):
+    """Хронологии постов, принятых парсером в окне [since, until)"""
+    return await storage.read(_select_timeline, since, until)
+
+
+def _prune_timeline(conn, before):
+    return conn.execute("DELETE FROM post_timeline WHERE ingested_at < ?", (before,)).rowcount
+
+
+async def prune_timeline(before):
+    """Удаляет хронологии постов, принятых раньше before; возвращает их число"""
+    return await storage.write(_prune_timeline, before)
@@ -0,0 +1,87 @@
+# dedup.py
+
+import hashlib
+import random
+import re
+from array import array
+
+# MinHash: NUM_PERM перестановок, разбитых на BANDS полос по ROWS значений (LSH).
+# Посты с похожестью по Жаккару s попадают в кандидаты с вероятностью 1 - (1 - s^ROWS)^BANDS:
+# ≈ 99.7% при s = 0.85, ≈ 98% при s = 0.8.
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+# Минимальная оценка похожести, при которой пост считается дубликатом
+SIMILARITY_THRESHOLD = 0.8
+# Слишком короткие тексты сравниваем только по точному хэшу, а у постов с медиа
+# такой хэш включает и сами файлы: одинаковая короткая подпись к разным фото — не дубликат
+MIN_WORDS = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240501)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+_url_re = re.compile(r"https?://\S+|t\.me/\S+")
+_word_re = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(text):
+    """Приводит текст к виду, в котором не важны регистр, пунктуация, ссылки и пробелы"""
+    text = _url_re.sub(" ", (text or "").lower().replace("ё", "е"))
+    return " ".join(_word_re.findall(text))
+
+
+def content_hash(normalized):
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(normalized):
+    """MinHash-подпись множества слов текста (bytes) или None для коротких текстов"""
+    words = set(normalized.split())
+    if len(words) < MIN_WORDS:
+        return None
+    hashes = [_word_hash(word) for word in words]
+    signature = array("Q", (
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in _PERMUTATIONS
+    ))
+    return signature.tobytes()
+
+
+def similarity(signature_a, signature_b):
+    """Оценка похожести по Жаккару по двум подписям"""
+    a, b = array("Q"), array("Q")
+    a.frombytes(signature_a)
+    b.frombytes(signature_b)
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def band_keys(signature):
+    """Ключи LSH-полос подписи (знаковые 64-битные, как их хранит SQLite)"""
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS * 8:(band + 1) * ROWS * 8]
+        digest = hashlib.blake2b(bytes([band]) + chunk, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def fingerprint(text, media_ids=()):
+    """
+    Возвращает (content_hash, minhash-подпись); для пустого текста (None, None).
+    media_ids — ID файлов поста: для короткого текста они входят в content_hash.
+    """
+    normalized = normalize(text)
+    if not normalized:
+        return None, None
+    key = normalized
+    if media_ids and len(normalized.split()) < MIN_WORDS:
+        key += "\n" + " ".join(str(media_id) for media_id in sorted(media_ids))
+    return content_hash(key), minhash(normalized)
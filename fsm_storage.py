@@ -0,0 +1,108 @@
+# fsm_storage.py
+
+import asyncio
+import copy
+import json
+import logging
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from db import get_fsm_state, save_fsm_states
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в news.db вместо MemoryStorage.
+
+    Чтение идёт из кэша в памяти: с диска ключ читается один раз, при первом
+    обращении. Запись сразу попадает в кэш (write-through), а в БД уходит
+    фоном — изменённые ключи копятся flush_interval секунд и сохраняются
+    одной транзакцией. Поэтому состояния и данные (post_id, ID сообщений
+    и т.п.) переживают перезапуск бота, а обработчики не ждут диск.
+    """
+
+    def __init__(self, flush_interval=0.2):
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._cache = {}  # key -> [state, data]
+        self._dirty = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def _entry(self, key):
+        key = self.key_builder.build(key)
+        entry = self._cache.get(key)
+        if entry is None:
+            row = await get_fsm_state(key)
+            # Пока шло чтение, ключ мог быть записан — кэш тогда новее диска
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = [row[0], json.loads(row[1])] if row else [None, {}]
+                self._cache[key] = entry
+        return key, entry
+
+    def _mark_dirty(self, key):
+        self._dirty.add(key)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def set_state(self, key, state=None):
+        key, entry = await self._entry(key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(key)
+
+    async def get_state(self, key):
+        _, entry = await self._entry(key)
+        return entry[0]
+
+    async def set_data(self, key, data):
+        key, entry = await self._entry(key)
+        entry[1] = copy.deepcopy(dict(data))
+        self._mark_dirty(key)
+
+    async def get_data(self, key):
+        _, entry = await self._entry(key)
+        return copy.deepcopy(entry[1])
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Сохраняет изменённые ключи одной транзакцией"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows = []
+        for key in keys:
+            state, data = self._cache[key]
+            try:
+                rows.append((key, state, json.dumps(data, ensure_ascii=False)))
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ Данные FSM {key} не сериализуются в JSON, остаются только в памяти: {e}")
+        try:
+            await save_fsm_states(rows)
+        except asyncio.CancelledError:
+            self._dirty |= keys
+            raise
+        except Exception as e:
+            logger.error(f"❌ Не удалось сохранить состояния FSM: {e}")
+            self._dirty |= keys
+            self._wakeup.set()
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
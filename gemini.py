@@ -1,8 +1,15 @@
 # gemini.py
 
+import asyncio
 import logging
+import time
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import BlockedPromptException, StopCandidateException
 import config
+from rewrite_cache import RewriteCache
+from rewrite_rules import rewrite_rules
+from telemetry import gemini_metrics
 
 # Настройка логирования с выводом в консоль
 logging.basicConfig(
@@ -14,26 +21,191 @@ logger = logging.getLogger("gemini")
 
 genai.configure(api_key=config.GEMINI_API_KEY)
 
+# Меняется при любом изменении текста промпта, чтобы не отдавать устаревшие ответы из кэша
+PROMPT_VERSION = 2
 
-def revise_text_with_chatgpt(raw_text, comment="", source=""):
-    prompt = (
-        "Внеси корректировку в текст на основании комментария. CashTaxi заменяй на Таксопарк СВОИ!. Номер телефона всегда заменяй на +7 929 515 80 66. Остальное оставь неизменным.\n\n"
+
+def build_prompt(raw_text, comment=""):
+    return (
+        "Внеси корректировку в текст на основании комментария. Остальное оставь неизменным.\n\n"
         f"Текст: {raw_text}\n\n"
         f"Комментарий администратора: {comment}\n\n"
         "Выдай итоговый вариант."
     )
 
-    logger.info("📤 Отправляем запрос в Gemini")
-    logger.debug(f"🔸 PROMPT:\n{prompt}")
-
-    try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        response = model.generate_content(prompt)
-        logger.info("✅ Ответ получен от Gemini")
-        logger.debug(f"🔹 Ответ Gemini:\n{response.text.strip()}")
-        return response.text.strip()
-    except Exception as e:
-        logger.exception("❌ Ошибка при обращении к Gemini API")
-        # В случае ошибки возвращаем исходный текст и добавляем информацию об ошибке в лог
-        logger.error(f"Детали ошибки: {str(e)}")
-        return raw_text
\ No newline at end of file
+
+# Вид ошибки -> описание для админа
+ERROR_DESCRIPTIONS = {
+    "timeout": "Gemini не ответил вовремя",
+    "rate_limit": "превышен лимит запросов Gemini",
+    "blocked": "Gemini отказался отвечать (фильтр безопасности)",
+    "empty": "Gemini вернул пустой ответ",
+    "invalid_request": "некорректный запрос к Gemini",
+    "auth": "ошибка ключа или доступа к Gemini",
+    "server": "ошибка на стороне Gemini",
+    "other": "неизвестная ошибка Gemini",
+}
+
+
+class RewriteError(Exception):
+    """Gemini не смог переписать текст; kind — вид ошибки из ERROR_DESCRIPTIONS"""
+
+    def __init__(self, kind, cause):
+        description = ERROR_DESCRIPTIONS.get(kind, kind)
+        super().__init__(f"{description}: {cause}" if str(cause) else description)
+        self.kind = kind
+
+
+class EmptyResponse(Exception):
+    pass
+
+
+class BlockedResponse(Exception):
+    pass
+
+
+# Причины остановки генерации, означающие срабатывание фильтра, а не пустой ответ
+_BLOCK_FINISH_REASONS = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+
+
+def response_text(response):
+    """
+    Текст ответа. Блокировку промпта или ответа проверяем до response.text:
+    иначе его ValueError не отличить от прочих ошибок.
+    """
+    feedback = getattr(response, "prompt_feedback", None)
+    if feedback is not None and getattr(feedback, "block_reason", 0):
+        raise BlockedResponse(f"промпт заблокирован: {getattr(feedback.block_reason, 'name', feedback.block_reason)}")
+    candidates = getattr(response, "candidates", None) or []
+    if not candidates:
+        raise EmptyResponse("в ответе нет вариантов")
+    candidate = candidates[0]
+    if not (candidate.content and candidate.content.parts):
+        reason = getattr(candidate.finish_reason, "name", str(candidate.finish_reason))
+        if reason in _BLOCK_FINISH_REASONS:
+            raise BlockedResponse(f"ответ остановлен фильтром: {reason}")
+        raise EmptyResponse(f"пустой ответ (finish_reason {reason})")
+    return response.text
+
+
+def classify_error(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return "rate_limit"
+    if isinstance(error, (BlockedPromptException, StopCandidateException, BlockedResponse)):
+        return "blocked"
+    if isinstance(error, EmptyResponse):
+        return "empty"
+    if isinstance(error, (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated)):
+        return "auth"
+    if isinstance(error, (google_exceptions.InvalidArgument, google_exceptions.FailedPrecondition,
+                          google_exceptions.BadRequest)):
+        return "invalid_request"
+    if isinstance(error, (google_exceptions.ServerError, google_exceptions.DeadlineExceeded)):
+        return "server"
+    return "other"
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов (≈3 символа кириллицы на токен) для бюджета TPM"""
+    return len(text) // 3 + 1
+
+
+class RewriteService:
+    """
+    Асинхронный сервис переписывания текстов через Gemini.
+
+    Один экземпляр модели на процесс, глобальный семафор на число
+    одновременных запросов и дедлайн на каждый запрос. Детерминированные
+    замены (название, телефон) делают локальные правила rewrite_rules до и
+    после Gemini; без комментария админа запрос к Gemini не отправляется.
+    """
+
+    def __init__(self, model_name, max_concurrency, timeout, cache=None):
+        self.model_name = model_name
+        self.timeout = timeout
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    async def revise(self, raw_text, comment="", source="", fallback=False):
+        """
+        Возвращает отредактированный текст. При ошибке или таймауте бросает
+        RewriteError; с fallback=True вместо этого возвращает исходный текст
+        после правил (такие случаи считаются в метрике fallbacks).
+        """
+        raw_text = rewrite_rules.apply(raw_text)
+        if not comment.strip():
+            # Без комментария Gemini нечего делать сверх правил
+            gemini_metrics.record_local_rewrite()
+            return raw_text
+
+        cache_key = None
+        if self.cache:
+            cache_key = RewriteCache.make_key(raw_text, comment, PROMPT_VERSION, self.model_name)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("💾 Ответ Gemini взят из кэша")
+                gemini_metrics.record_cache_hit()
+                self.cache.log_stats()
+                return rewrite_rules.apply(cached)
+
+        prompt = build_prompt(raw_text, comment)
+
+        logger.debug(f"🔸 PROMPT:\n{prompt}")
+
+        started = time.monotonic()
+        try:
+            async with self._semaphore:
+                logger.info("📤 Отправляем запрос в Gemini")
+                started = time.monotonic()  # Ожидание семафора в задержку не входит
+                response = await asyncio.wait_for(
+                    self.model.generate_content_async(prompt),
+                    timeout=self.timeout
+                )
+            revised = rewrite_rules.apply(response_text(response).strip())
+            if not revised:
+                raise EmptyResponse("пустой текст ответа")
+        except Exception as e:
+            latency = time.monotonic() - started
+            kind = classify_error(e)
+            gemini_metrics.record_call(kind, latency)
+            logger.error(f"❌ Ошибка Gemini ({kind}) через {latency:.1f} с: {e!r}")
+            if fallback:
+                gemini_metrics.record_fallback()
+                logger.warning("↩️ Вместо ответа Gemini возвращаем исходный текст")
+                return raw_text
+            raise RewriteError(kind, e) from e
+
+        latency = time.monotonic() - started
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        gemini_metrics.record_call("ok", latency, prompt_tokens, response_tokens)
+        logger.info(
+            f"✅ Ответ получен от Gemini за {latency:.1f} с (токены: промпт {prompt_tokens}, ответ {response_tokens})"
+        )
+        logger.debug(f"🔹 Ответ Gemini:\n{revised}")
+
+        if cache_key:
+            await self.cache.put(cache_key, revised, latency)
+        return revised
+
+
+rewrite_service = RewriteService(
+    config.GEMINI_MODEL,
+    config.GEMINI_MAX_CONCURRENCY,
+    config.GEMINI_TIMEOUT,
+    cache=RewriteCache(
+        config.REWRITE_CACHE_MEMORY_SIZE,
+        config.REWRITE_CACHE_TTL,
+        config.REWRITE_CACHE_MAX_ROWS
+    )
+)
@@ -0,0 +1,182 @@
+# ingest.py
+
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from db import ingest_posts
+from dedup import fingerprint
+from media import MediaRef
+from rewrite_rules import rewrite_rules
+
+logger = logging.getLogger(__name__)
+
+
+class IncomingMessage(NamedTuple):
+    """Сообщение из канала-источника, подготовленное к сохранению"""
+    source_id: str
+    raw_text: str
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
+    message_date: Optional[str] = None
+    media: tuple = ()  # MediaRef по порядку частей альбома
+    styled_text: Optional[str] = None  # Текст после правил замены; None — как raw_text
+
+    @property
+    def last_message_id(self):
+        """ID последней части альбома (для high-water mark)"""
+        return max([self.message_id, *(ref.message_id for ref in self.media)])
+
+    @classmethod
+    def from_telethon(cls, message, source_id):
+        return cls.from_telethon_album([message], source_id)
+
+    @classmethod
+    def from_telethon_album(cls, messages, source_id):
+        """Один пост из частей альбома: текст берётся из первой подписи"""
+        messages = sorted(messages, key=lambda m: m.id)
+        first = messages[0]
+        return cls(
+            source_id=source_id,
+            raw_text=next((m.message for m in messages if m.message), ""),
+            channel_id=first.chat_id,
+            message_id=first.id,
+            message_date=first.date.isoformat() if first.date else None,
+            media=tuple(ref for ref in map(MediaRef.from_telethon, messages) if ref),
+        )
+
+
+async def store_messages(messages, backfill_cursor=None):
+    """
+    Сохраняет сообщения одной транзакцией (с поиском дубликатов).
+    styled_text сразу получает текст после локальных правил замены;
+    backfill_cursor передаётся в ingest_posts (только для догрузки).
+    Возвращает (ID новых постов, число дубликатов, число уже сохранённых).
+    """
+    items = [
+        (
+            message._replace(styled_text=rewrite_rules.apply(message.raw_text)),
+            *fingerprint(message.raw_text, [ref.media_id for ref in message.media if ref.media_id])
+        )
+        for message in messages
+    ]
+    results = await ingest_posts(items, backfill_cursor)
+    post_ids = [post_id for post_id, kind in results if kind == "new"]
+    duplicates = sum(1 for _, kind in results if kind == "duplicate")
+    return post_ids, duplicates, len(results) - len(post_ids) - duplicates
+
+
+class IngestBuffer:
+    """
+    Буфер отложенной записи для входящих сообщений парсера.
+
+    Сообщения копятся в ограниченной очереди и сбрасываются в БД одной
+    транзакцией, когда набирается batch_size штук или проходит max_delay
+    секунд с первого сообщения пачки. Если очередь заполнена, submit() ждёт
+    (обратное давление на обработчик Telethon).
+
+    Отпечатки для поиска дубликатов считаются здесь, а сама проверка идёт
+    в транзакции записи: дубликаты не создают постов и не попадают в уведомления.
+
+    Если запись пачки не удалась (например, база занята), пачка повторяется
+    до max_retries раз с паузой retry_delay, 2·retry_delay, …; пока идут
+    повторы, новые сообщения ждут в очереди. Пачка отбрасывается только после
+    последней попытки — с ошибкой в логе; такие сообщения подберёт догрузка
+    при следующем запуске (её курсор живой приём не двигает).
+    """
+
+    def __init__(self, on_flushed=None, batch_size=100, max_delay=0.5, max_pending=1000,
+                 max_retries=5, retry_delay=1.0):
+        self.on_flushed = on_flushed
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._closed = False
+        self._task = None
+        self.total = 0
+        self.duplicates = 0
+        self._started_at = None
+
+    async def submit(self, message):
+        """Ставит IncomingMessage в очередь; ждёт, если очередь заполнена"""
+        if self._closed:
+            raise RuntimeError("Буфер ингеста уже закрыт")
+        await self._queue.put(message)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            stopping = await self._fill(batch)
+            await self._flush(batch)
+
+    async def _fill(self, batch):
+        """Добирает пачку до batch_size или до истечения max_delay; True — пришёл сигнал остановки"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _flush(self, batch):
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            try:
+                post_ids, duplicates, seen = await store_messages(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    messages = ", ".join(f"{m.source_id}/{m.message_id}" for m in batch)
+                    logger.error(
+                        f"❌ Пачка из {len(batch)} сообщений не сохранена после {attempt + 1} попыток "
+                        f"и отброшена ({messages}): {e}"
+                    )
+                    return
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning(f"⚠️ Не удалось сохранить пачку из {len(batch)} сообщений, повтор через {delay:.0f} с: {e}")
+                await asyncio.sleep(delay)
+
+        elapsed = time.monotonic() - started
+        self.total += len(batch)
+        self.duplicates += duplicates
+        logger.info(
+            f"📥 Сохранено {len(batch)} сообщений за {elapsed * 1000:.0f} мс, дубликатов {duplicates}, "
+            f"повторов {seen} (всего {self.total}, {self.throughput():.1f} сообщ./с)"
+        )
+        if self.on_flushed and post_ids:
+            self.on_flushed(post_ids)
+
+    def throughput(self):
+        """Средняя скорость ингеста с первого сообщения, сообщений в секунду"""
+        if self._started_at is None:
+            return 0.0
+        return self.total / max(time.monotonic() - self._started_at, 1e-6)
+
+    async def close(self):
+        """Останавливает приём и сбрасывает в БД всё, что осталось в очереди"""
+        self._closed = True
+        if self._task and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        logger.info(f"🛑 Буфер ингеста закрыт, всего сохранено {self.total} сообщений")
@@ -0,0 +1,89 @@
+# ledger.py
+
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from cleanup import DELETE_BATCH_SIZE
+from db import record_chat_messages, forget_chat_messages, get_chat_messages, clear_chat_messages, prune_chat_messages
+
+logger = logging.getLogger(__name__)
+
+# Бот может удалять сообщения не старше 48 часов — более старые в журнале не нужны
+DELETE_WINDOW = 48 * 3600
+PRUNE_INTERVAL = 3600
+
+
+class MessageLedger(BaseRequestMiddleware):
+    """
+    Журнал сообщений в чатах админов: (chat_id, message_id, время).
+
+    Как middleware сессии записывает всё, что бот отправляет в эти чаты
+    (send/copy/forward, альбомы), и забывает то, что он удалил. Через
+    incoming (outer-middleware диспетчера) записываются входящие сообщения.
+    Запись идёт в фоне через общий писатель БД; /clear удаляет по журналу.
+    """
+
+    def __init__(self, chat_ids):
+        self.chat_ids = set(chat_ids)
+        self._pruned_at = 0.0
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id not in self.chat_ids:
+            return result
+
+        name = type(method).__name__
+        if name == "DeleteMessage":
+            forget_chat_messages([(chat_id, method.message_id)])
+        elif name == "DeleteMessages":
+            forget_chat_messages([(chat_id, message_id) for message_id in method.message_ids])
+        else:
+            # Message, MessageId (copy) или их список (альбомы, copy/forward пачкой)
+            items = result if isinstance(result, list) else [result]
+            message_ids = [item.message_id for item in items if hasattr(item, "message_id")]
+            if message_ids:
+                self.record(chat_id, message_ids)
+        return result
+
+    async def incoming(self, handler, event, data):
+        if event.chat.id in self.chat_ids:
+            self.record(event.chat.id, [event.message_id])
+        return await handler(event, data)
+
+    def record(self, chat_id, message_ids):
+        now = int(time.time())
+        record_chat_messages([(chat_id, message_id, now) for message_id in message_ids])
+        if now - self._pruned_at > PRUNE_INTERVAL:
+            self._pruned_at = now
+            prune_chat_messages(now - DELETE_WINDOW)
+
+
+def install_message_ledger(bot, chat_ids, dispatcher=None):
+    """Подключает журнал к запросам бота и (если передан диспетчер) к входящим сообщениям"""
+    ledger = MessageLedger(chat_ids)
+    bot.session.middleware(ledger)
+    if dispatcher is not None:
+        dispatcher.message.outer_middleware(ledger.incoming)
+    return ledger
+
+
+async def clear_chat(bot, chat_id, up_to_message_id):
+    """
+    Удаляет сообщения чата из журнала пачками deleteMessages (до 100 ID за запрос)
+    и очищает журнал до up_to_message_id; возвращает число ID в запросах.
+    """
+    message_ids = await get_chat_messages(chat_id, int(time.time()) - DELETE_WINDOW)
+    message_ids = sorted(set(message_ids) | {up_to_message_id})
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        chunk = message_ids[start:start + DELETE_BATCH_SIZE]
+        try:
+            # Уже удалённые и слишком старые сообщения Telegram просто пропускает
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось удалить {len(chunk)} сообщений в чате {chat_id}: {e}")
+    await clear_chat_messages(chat_id, up_to_message_id)
+    logger.info(f"🧹 Очищен чат {chat_id}: {len(message_ids)} сообщений")
+    return len(message_ids)
@@ -0,0 +1,187 @@
+# media.py
+
+import asyncio
+import logging
+from itertools import groupby
+from typing import NamedTuple, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto
+
+from db import get_pending_media, set_media_relayed
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина подписи к медиа в Telegram
+CAPTION_LIMIT = 1024
+
+
+class MediaRef(NamedTuple):
+    """Ссылка на файл в сообщении канала-источника (без загрузки самого файла)"""
+    kind: str
+    message_id: int
+    grouped_id: Optional[int] = None
+    media_id: Optional[int] = None
+    access_hash: Optional[int] = None
+    file_reference: Optional[bytes] = None
+    mime_type: Optional[str] = None
+    file_size: Optional[int] = None
+
+    @classmethod
+    def from_telethon(cls, message):
+        """MediaRef для фото/видео/документа или None (текст, превью ссылки, опрос и т.п.)"""
+        kind = media_kind(message)
+        if kind is None:
+            return None
+        media = message.photo or message.document
+        file = message.file
+        return cls(
+            kind=kind,
+            message_id=message.id,
+            grouped_id=message.grouped_id,
+            media_id=media.id,
+            access_hash=media.access_hash,
+            file_reference=media.file_reference,
+            mime_type=file.mime_type if file else None,
+            file_size=file.size if file else None,
+        )
+
+
+def media_kind(message):
+    # Фото из превью ссылки (MessageMediaWebPage) медиа поста не считаем
+    if not isinstance(message.media, (MessageMediaPhoto, MessageMediaDocument)):
+        return None
+    if message.photo:
+        return "photo"
+    if message.gif:
+        return "animation"
+    if message.video:
+        return "video"
+    if message.voice:
+        return "voice"
+    if message.audio:
+        return "audio"
+    if message.document and not message.sticker:
+        return "document"
+    return None
+
+
+class MediaRelay:
+    """
+    Пересылка медиа новых постов в служебный чат без скачивания файлов.
+
+    Бот не может отправить файл по ссылке Telethon, поэтому парсер пересылает
+    сообщения-источники в relay-чат (forward на стороне Telegram — трафик
+    и память не тратятся), а бот при публикации копирует их оттуда по
+    message_id (copy_message / copy_messages). Части альбома пересылаются
+    одним запросом и остаются альбомом. Необработанные медиа разбираются
+    и после перезапуска: очередь хранится в news_media.
+    """
+
+    def __init__(self, client, relay_chat_id, registry):
+        self.client = client
+        self.relay_chat_id = relay_chat_id
+        self.registry = registry
+        self._queue = asyncio.Queue()
+
+    def submit(self, post_ids=None):
+        """Сообщает о новых постах (не блокирует)"""
+        self._queue.put_nowait(post_ids)
+
+    async def run(self):
+        self.submit()  # Досылаем то, что не успели переслать до перезапуска
+        while True:
+            await self._queue.get()
+            try:
+                await self._relay_pending()
+            except Exception as e:
+                logger.error(f"❌ Ошибка при пересылке медиа: {e}")
+
+    async def _relay_pending(self):
+        rows = await get_pending_media()
+        if not rows:
+            return
+        updates = []
+        # Пересылаем пачками по каналу-источнику, до 100 сообщений за запрос;
+        # части одного поста не разрываются между запросами, чтобы альбом не распался
+        for channel_id, channel_rows in groupby(rows, key=lambda row: row[2]):
+            batch = []
+            for _, post_rows in groupby(channel_rows, key=lambda row: row[0]):
+                post_rows = list(post_rows)
+                if batch and len(batch) + len(post_rows) > 100:
+                    updates += await self._forward(channel_id, batch)
+                    batch = []
+                batch += post_rows
+            if batch:
+                updates += await self._forward(channel_id, batch)
+        await set_media_relayed(updates)
+        relayed = sum(1 for update in updates if update[2] == "relayed")
+        logger.info(f"📎 Переслано медиа: {relayed} из {len(updates)}")
+
+    async def _forward(self, channel_id, rows):
+        subscription = self.registry.get(channel_id)
+        from_peer = subscription.input_peer if subscription else channel_id
+        try:
+            sent = await self.client.forward_messages(
+                self.relay_chat_id, [row[3] for row in rows], from_peer,
+                drop_author=True, drop_media_captions=True, silent=True
+            )
+        except Exception as e:
+            # Например, в канале запрещена пересылка — пост уйдёт без медиа
+            logger.warning(f"⚠️ Не удалось переслать медиа из канала {channel_id}: {e}")
+            return [(None, None, "failed", row[0], row[1]) for row in rows]
+        return [
+            (self.relay_chat_id, message.id, "relayed", row[0], row[1]) if message
+            else (None, None, "failed", row[0], row[1])
+            for row, message in zip(rows, sent)
+        ]
+
+
+async def send_post(bot, chat_id, text, media=(), progress=None, on_step=None):
+    """
+    Отправляет пост с медиа, копируя его из relay-чата по ссылке; возвращает
+    ID первого сообщения поста в канале.
+
+    media — [(relay_chat_id, relay_message_id)] в порядке альбома. Подпись
+    длиннее CAPTION_LIMIT отправляется отдельным сообщением после медиа.
+    Пост уходит несколькими запросами (шаги media, caption, text): после
+    каждого вызывается await on_step(progress), чтобы сохранить выполненные
+    шаги. progress прошлой попытки передаётся обратно — повтор продолжает
+    с невыполненного шага и не отправляет медиа второй раз.
+    """
+    progress = dict(progress or {})
+
+    async def done(step, value):
+        progress[step] = value
+        if on_step:
+            await on_step(progress)
+
+    caption = text if media and text and len(text) <= CAPTION_LIMIT else None
+    if media and "media" not in progress:
+        from_chat_id = media[0][0]
+        if len(media) == 1:
+            sent = await bot.copy_message(
+                chat_id=chat_id, from_chat_id=from_chat_id, message_id=media[0][1], caption=caption
+            )
+            await done("media", [sent.message_id])
+        else:
+            sent_ids = await bot.copy_messages(
+                chat_id=chat_id, from_chat_id=from_chat_id, message_ids=[message_id for _, message_id in media]
+            )
+            await done("media", [sent.message_id for sent in sent_ids])
+
+    # У copy_messages нет параметра подписи — ставим её на первую часть альбома
+    if caption and len(media) > 1 and "caption" not in progress:
+        try:
+            await bot.edit_message_caption(chat_id=chat_id, message_id=progress["media"][0], caption=caption)
+        except TelegramBadRequest as e:
+            # Подпись уже стоит: прошлая попытка успела её поставить, но не сохранить шаг
+            if "message is not modified" not in str(e):
+                raise
+        await done("caption", True)
+
+    if text and caption is None and "text" not in progress:
+        sent = await bot.send_message(chat_id=chat_id, text=text)
+        await done("text", sent.message_id)
+
+    return progress["media"][0] if media else progress.get("text")
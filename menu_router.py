@@ -3,11 +3,16 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import CommandStart
 import json
 import os
-import asyncio
 import logging
 
-from config import ADMIN_CHAT_IDS
-from aiogram.filters import Command
+from config import ADMIN_CHAT_IDS, CHANNELS_FILE
+from cleanup import cleanup
+from ledger import clear_chat
+from gemini import rewrite_service
+from telemetry import gemini_metrics
+from timeline import build_report
+from session_engine import session_engine
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
@@ -22,7 +27,6 @@ class ChannelManagement(StatesGroup):
 
 menu_router = Router()
 monitoring_active = set()
-CHANNELS_FILE = "channels.json"
 logger = logging.getLogger(__name__)
 
 
@@ -34,8 +38,12 @@ def load_channels():
 
 
 def save_channels(channels):
-    with open(CHANNELS_FILE, "w", encoding="utf-8") as f:
+    # Пишем во временный файл и подменяем атомарно: парсер перечитывает
+    # список на лету и не должен увидеть наполовину записанный JSON
+    tmp_path = f"{CHANNELS_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(channels, f)
+    os.replace(tmp_path, CHANNELS_FILE)
 
 
 def get_main_menu():
@@ -59,33 +67,61 @@ async def clear_command(message: Message):
     if message.from_user.id not in ADMIN_CHAT_IDS:
         return
 
-    # Удаляем сообщение с командой
-    try:
-        await message.delete()
-    except Exception as e:
-        pass
-
-    # Ограничиваем количество удаляемых сообщений
-    MAX_MESSAGES_TO_DELETE = 200
-
-    deleted = 0
-    try:
-        async for msg in message.bot.get_chat_history(message.chat.id, limit=MAX_MESSAGES_TO_DELETE):
-            try:
-                await message.bot.delete_message(message.chat.id, msg.message_id)
-                deleted += 1
-                # Небольшие задержки между пакетами запросов
-                if deleted % 10 == 0:
-                    await asyncio.sleep(0.3)
-            except Exception:
-                continue
-    except Exception as e:
-        pass
+    # Удаляем по журналу все сообщения чата до команды включительно — пачками по 100
+    await clear_chat(message.bot, message.chat.id, message.message_id)
 
     # Отправляем главное меню, которое будет единственным сообщением
     await message.answer("👋 Главное меню:", reply_markup=get_main_menu())
 
 
+def render_stats():
+    g = gemini_metrics.snapshot()
+    lines = [
+        "📊 <b>Gemini</b> (с запуска бота)",
+        f"Запросов: {g['calls']}, успешных {g['ok']}, ошибок {g['error_rate']:.0%}",
+        f"Задержка: p50 {g['p50_s']:.1f} с · p95 {g['p95_s']:.1f} с · p99 {g['p99_s']:.1f} с",
+        f"Токены: промпт {g['prompt_tokens']}, ответ {g['response_tokens']}",
+    ]
+    if g["ok"]:
+        lines.append(
+            f"В среднем на запрос: {g['prompt_tokens'] // g['ok']} + {g['response_tokens'] // g['ok']} токенов"
+        )
+    if g["errors"]:
+        lines.append("Ошибки: " + ", ".join(f"{kind} {count}" for kind, count in sorted(g["errors"].items())))
+    lines.append(f"Возвратов исходного текста: {g['fallbacks']}")
+    lines.append(f"Обработано правилами без запроса: {g['local_rewrites']}")
+    if rewrite_service.cache:
+        c = rewrite_service.cache.stats()
+        lines.append(f"Кэш: попаданий {c['saved_calls']} ({c['hit_rate']:.0%}), сэкономлено {c['saved_seconds']} с")
+
+    m = session_engine.stats()
+    lines += [
+        "",
+        "🗂 <b>Модерация</b>",
+        f"Следующий пост: p50 {m['p50_ms']:.0f} мс · p95 {m['p95_ms']:.0f} мс "
+        f"(замеров {m['samples']}, готовых заранее {m['hit_ratio']:.0%})",
+    ]
+    return "\n".join(lines)
+
+
+@menu_router.message(Command("stats"))
+async def stats_command(message: Message):
+    if message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    await message.answer(render_stats())
+
+
+@menu_router.message(Command("timeline"))
+async def timeline_command(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    args = (command.args or "").strip()
+    if args and not (args.isdigit() and int(args) > 0):
+        await message.answer("Использование: /timeline [часы]\nНапример: /timeline 24")
+        return
+    await message.answer(await build_report(int(args) if args else 24))
+
+
 @menu_router.callback_query(F.data == "manage_channels")
 async def show_channels(callback: types.CallbackQuery):
     channels = load_channels()
@@ -153,11 +189,8 @@ async def remove_channel(callback: types.CallbackQuery):
         channels.remove(channel_to_remove)
         save_channels(channels)
 
-        # Показываем временное сообщение об успехе
-        temp_message = await callback.message.edit_text(f"Канал {channel_to_remove} удален.")
-
-        # Небольшая задержка и возврат к списку каналов
-        await asyncio.sleep(1)
+        # Сообщаем об успехе всплывающим уведомлением и сразу возвращаемся к списку каналов
+        await callback.answer(f"Канал {channel_to_remove} удален.")
         await show_delete_channel_menu(callback)
     else:
         await callback.answer("Канал не найден в списке")
@@ -183,8 +216,11 @@ async def handle_add_channels(message: types.Message, state: FSMContext):
     except Exception:
         pass
 
-    # Остальной код обработки
-    # ...
+    channels = load_channels()
+    input_channels = [c.strip().lstrip("@") for c in (message.text or "").replace(",", " ").split()]
+    added = [f"@{c}" for c in dict.fromkeys(input_channels) if c and f"@{c}" not in channels]
+    if added:
+        save_channels(channels + added)
 
     # Получаем предыдущее сообщение с инструкцией и удаляем его
     data = await state.get_data()
@@ -196,12 +232,8 @@ async def handle_add_channels(message: types.Message, state: FSMContext):
             pass
 
     # Отправляем временное сообщение об успехе и затем удаляем его
-    status_message = await message.answer(f"✅ Каналы добавлены.")
-    await asyncio.sleep(1)
-    try:
-        await status_message.delete()
-    except Exception:
-        pass
+    status_message = await message.answer(f"✅ Добавлено каналов: {len(added)}")
+    cleanup.delete_later(status_message, 1)
 
     # Показываем главное меню
     await message.answer("👋 Главное меню:", reply_markup=get_main_menu())
@@ -231,11 +263,7 @@ async def handle_delete_channels(message: types.Message, state: FSMContext):
     main_menu_msg = await message.answer("👋 Главное меню:", reply_markup=get_main_menu())
 
     # Удаляем статусное сообщение после задержки
-    await asyncio.sleep(2)
-    try:
-        await status_msg.delete()
-    except Exception as e:
-        logger.error(f"Не удалось удалить статусное сообщение: {e}")
+    cleanup.delete_later(status_msg, 2)
 
 
 @menu_router.callback_query(F.data == "start_monitoring")
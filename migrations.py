@@ -0,0 +1,533 @@
+# migrations.py
+
+import json
+import logging
+import zlib
+
+from dedup import fingerprint, band_keys
+
+logger = logging.getLogger(__name__)
+
+
+# --- Сжатие текста архивных постов ---
+
+def pack_text(text):
+    return None if text is None else zlib.compress(text.encode("utf-8"), 6)
+
+
+def unpack_text(blob):
+    return None if blob is None else zlib.decompress(blob).decode("utf-8")
+
+
+def register_functions(conn):
+    """SQL-функции, на которые ссылается схема (представление news_all); нужны каждому соединению"""
+    conn.create_function("unpack_text", 1, unpack_text, deterministic=True)
+
+
+# --- Миграция 1: исходная схема ---
+
+def _initial_schema(conn):
+    # --- Таблица с новостями ---
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS news (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source_id TEXT,
+        raw_text TEXT,
+        styled_text TEXT,
+        status TEXT,
+        notified INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # В старых базах колонка notified добавлялась вручную
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(news)")}
+    if "notified" not in columns:
+        conn.execute("ALTER TABLE news ADD COLUMN notified INTEGER DEFAULT 0")
+
+    # --- Таблица сессий модерации ---
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS moderation_session (
+        admin_id INTEGER PRIMARY KEY,
+        post_ids TEXT,
+        current_index INTEGER
+    )
+    """)
+
+    # --- Кэш переписываний Gemini ---
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rewrite_cache (
+        key TEXT PRIMARY KEY,
+        revised_text TEXT,
+        latency REAL,
+        created_at REAL,
+        last_used_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rewrite_cache_last_used ON rewrite_cache (last_used_at)")
+
+    # --- Очередь уведомлений (outbox) и последние уведомления админам ---
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS admin_notification (
+        admin_id INTEGER PRIMARY KEY,
+        message_id INTEGER
+    )
+    """)
+
+
+# --- Миграция 2: индексы очереди модерации и счётчики по статусам ---
+
+_status_indexes = [
+    # Покрывающий индекс для выборок по статусу (id входит в индекс как rowid)
+    "CREATE INDEX IF NOT EXISTS idx_news_status ON news (status)",
+    # Частичный индекс ровно под предикат непрочитанных новых постов
+    "CREATE INDEX IF NOT EXISTS idx_news_unnotified ON news (id) WHERE notified = 0 AND status = 'new'",
+    """
+    CREATE TABLE IF NOT EXISTS news_status_count (
+        status TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "DELETE FROM news_status_count",
+    """
+    INSERT INTO news_status_count (status, count)
+    SELECT COALESCE(status, ''), COUNT(*) FROM news GROUP BY COALESCE(status, '')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_status_count_insert AFTER INSERT ON news
+    BEGIN
+        INSERT INTO news_status_count (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_status_count_delete AFTER DELETE ON news
+    BEGIN
+        UPDATE news_status_count SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_status_count_update AFTER UPDATE OF status ON news
+    WHEN OLD.status IS NOT NEW.status
+    BEGIN
+        UPDATE news_status_count SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+        INSERT INTO news_status_count (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+        ON CONFLICT (status) DO UPDATE SET count = count + 1;
+    END
+    """,
+]
+
+
+# --- Миграция 3: отпечатки постов для поиска дубликатов и список источников ---
+
+def _fingerprints(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS news_fingerprint (
+        post_id INTEGER PRIMARY KEY,
+        content_hash TEXT,
+        signature BLOB
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_news_fingerprint_hash ON news_fingerprint (content_hash)")
+    # LSH-полосы MinHash-подписей: пост-кандидат ищется по совпадению любой полосы
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS news_lsh (
+        band_key INTEGER,
+        post_id INTEGER,
+        PRIMARY KEY (band_key, post_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS news_source (
+        post_id INTEGER,
+        source_id TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_news_source_post ON news_source (post_id)")
+
+    conn.execute("""
+    INSERT INTO news_source (post_id, source_id, created_at)
+    SELECT id, source_id, created_at FROM news
+    """)
+    for post_id, raw_text in conn.execute("SELECT id, raw_text FROM news").fetchall():
+        digest, signature = fingerprint(raw_text)
+        conn.execute(
+            "INSERT OR REPLACE INTO news_fingerprint (post_id, content_hash, signature) VALUES (?, ?, ?)",
+            (post_id, digest, signature)
+        )
+        if signature:
+            conn.executemany(
+                "INSERT OR IGNORE INTO news_lsh (band_key, post_id) VALUES (?, ?)",
+                [(key, post_id) for key in band_keys(signature)]
+            )
+
+
+# --- Миграция 4: нормализованные элементы сессий модерации вместо JSON ---
+
+def _session_items(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS moderation_session_item (
+        admin_id INTEGER,
+        position INTEGER,
+        post_id INTEGER,
+        PRIMARY KEY (admin_id, position)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("ALTER TABLE moderation_session ADD COLUMN total INTEGER DEFAULT 0")
+    for admin_id, post_ids in conn.execute("SELECT admin_id, post_ids FROM moderation_session").fetchall():
+        post_ids = json.loads(post_ids or "[]")
+        conn.executemany(
+            "INSERT INTO moderation_session_item (admin_id, position, post_id) VALUES (?, ?, ?)",
+            [(admin_id, position, post_id) for position, post_id in enumerate(post_ids)]
+        )
+        conn.execute(
+            "UPDATE moderation_session SET total = ?, post_ids = NULL WHERE admin_id = ?",
+            (len(post_ids), admin_id)
+        )
+
+
+# --- Миграция 5: ID сообщений Telegram и high-water mark по каналам ---
+
+_message_ids = [
+    "ALTER TABLE news ADD COLUMN message_date DATETIME",
+    "ALTER TABLE news_source ADD COLUMN channel_id INTEGER",
+    "ALTER TABLE news_source ADD COLUMN message_id INTEGER",
+    # Одно сообщение канала попадает в базу не больше одного раза (в том числе как дубликат)
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_news_source_message ON news_source (channel_id, message_id)
+    WHERE message_id IS NOT NULL
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS channel_state (
+        channel_id INTEGER PRIMARY KEY,
+        last_message_id INTEGER NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+# --- Миграция 6: кэш разрешённых каналов-источников ---
+
+_channel_peers = [
+    """
+    CREATE TABLE IF NOT EXISTS channel_peer (
+        channel TEXT PRIMARY KEY,
+        peer_id INTEGER NOT NULL,
+        access_hash INTEGER,
+        title TEXT,
+        username TEXT,
+        resolved_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+]
+
+
+# --- Миграция 7: медиа постов (ссылки на файлы источника и копии в relay-чате) ---
+
+_media = [
+    """
+    CREATE TABLE IF NOT EXISTS news_media (
+        post_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        channel_id INTEGER,
+        message_id INTEGER,
+        grouped_id INTEGER,
+        media_id INTEGER,
+        access_hash INTEGER,
+        file_reference BLOB,
+        mime_type TEXT,
+        file_size INTEGER,
+        relay_chat_id INTEGER,
+        relay_message_id INTEGER,
+        relay_status TEXT NOT NULL DEFAULT 'pending',
+        PRIMARY KEY (post_id, position)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_news_media_pending ON news_media(channel_id, post_id) WHERE relay_status = 'pending'",
+]
+
+
+# --- Миграция 8: отложенное удаление служебных сообщений бота ---
+
+_pending_deletions = [
+    """
+    CREATE TABLE IF NOT EXISTS pending_deletion (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        due_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID
+    """,
+]
+
+
+# --- Миграция 9: outbox публикации ---
+
+_publish_jobs = [
+    """
+    CREATE TABLE IF NOT EXISTS publish_job (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER NOT NULL,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        scheduled_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        message_id INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_publish_job_due ON publish_job(scheduled_at) WHERE status = 'pending'",
+    # Посты, поставленные в очередь публикации до появления outbox
+    """
+    INSERT OR IGNORE INTO publish_job (post_id, idempotency_key, scheduled_at)
+    SELECT id, 'post:' || id, strftime('%s', 'now') FROM news WHERE status = 'queued'
+    """,
+]
+
+
+# --- Миграция 10: журнал сообщений в чатах админов (для /clear) ---
+
+_chat_messages = [
+    """
+    CREATE TABLE IF NOT EXISTS chat_message (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        sent_at INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_chat_message_sent_at ON chat_message(sent_at)",
+]
+
+
+# --- Миграция 11: состояния FSM бота ---
+
+_fsm_states = [
+    """
+    CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    """,
+]
+
+
+# --- Миграция 12: полнотекстовый поиск по постам ---
+
+_news_search = [
+    # Внешнее содержимое: текст хранится только в news, индекс — только токены
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5(
+        raw_text, styled_text,
+        content = 'news', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_fts_insert AFTER INSERT ON news BEGIN
+        INSERT INTO news_fts (rowid, raw_text, styled_text) VALUES (new.id, new.raw_text, new.styled_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS news_fts_delete AFTER DELETE ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, raw_text, styled_text)
+        VALUES ('delete', old.id, old.raw_text, old.styled_text);
+    END
+    """,
+    # Смена статуса индекс не трогает — только правка текста
+    """
+    CREATE TRIGGER IF NOT EXISTS news_fts_update AFTER UPDATE OF raw_text, styled_text ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, raw_text, styled_text)
+        VALUES ('delete', old.id, old.raw_text, old.styled_text);
+        INSERT INTO news_fts (rowid, raw_text, styled_text) VALUES (new.id, new.raw_text, new.styled_text);
+    END
+    """,
+    "INSERT INTO news_fts (news_fts) VALUES ('rebuild')",
+]
+
+
+# --- Миграция 13: архив старых постов со сжатым текстом ---
+
+def _archive(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS news_archive (
+        id INTEGER PRIMARY KEY,
+        source_id TEXT,
+        raw_text BLOB,
+        styled_text BLOB,
+        status TEXT,
+        notified INTEGER,
+        created_at DATETIME,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Все посты — горячие и архивные — с распакованным текстом
+    conn.execute("""
+    CREATE VIEW IF NOT EXISTS news_all AS
+    SELECT id, source_id, raw_text, styled_text, status, notified, created_at FROM news
+    UNION ALL
+    SELECT id, source_id, unpack_text(raw_text), unpack_text(styled_text), status, notified, created_at
+    FROM news_archive
+    """)
+    # Отбор кандидатов в архив: диапазон по (status, created_at); заменяет индекс по status
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_news_status_created ON news (status, created_at)")
+    conn.execute("DROP INDEX IF EXISTS idx_news_status")
+
+    # Поиск переезжает на news_all, чтобы архивные посты оставались в индексе.
+    # Перенос в архив не трогает индекс (текст тот же), поэтому 'rebuild' допустим
+    # только через news_all — как здесь.
+    for trigger in ("news_fts_insert", "news_fts_delete", "news_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS news_fts")
+    conn.execute("""
+    CREATE VIRTUAL TABLE news_fts USING fts5(
+        raw_text, styled_text,
+        content = 'news_all', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+    conn.execute("""
+    CREATE TRIGGER news_fts_insert AFTER INSERT ON news BEGIN
+        INSERT INTO news_fts (rowid, raw_text, styled_text) VALUES (new.id, new.raw_text, new.styled_text);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER news_fts_delete AFTER DELETE ON news
+    WHEN NOT EXISTS (SELECT 1 FROM news_archive WHERE id = old.id)
+    BEGIN
+        INSERT INTO news_fts (news_fts, rowid, raw_text, styled_text)
+        VALUES ('delete', old.id, old.raw_text, old.styled_text);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER news_fts_update AFTER UPDATE OF raw_text, styled_text ON news BEGIN
+        INSERT INTO news_fts (news_fts, rowid, raw_text, styled_text)
+        VALUES ('delete', old.id, old.raw_text, old.styled_text);
+        INSERT INTO news_fts (rowid, raw_text, styled_text) VALUES (new.id, new.raw_text, new.styled_text);
+    END
+    """)
+    conn.execute("INSERT INTO news_fts (news_fts) VALUES ('rebuild')")
+
+
+# --- Миграция 14: хронология этапов жизни поста ---
+
+_post_timeline = [
+    # Время этапов — unix-время; каждый этап фиксируется один раз, при первом наступлении
+    """
+    CREATE TABLE IF NOT EXISTS post_timeline (
+        post_id INTEGER PRIMARY KEY,
+        channel TEXT,
+        message_at REAL,
+        ingested_at REAL,
+        notified_at REAL,
+        first_shown_at REAL,
+        edited_at REAL,
+        published_at REAL,
+        declined_at REAL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_post_timeline_ingested ON post_timeline (ingested_at)",
+    # Посты, которые ещё в работе, получают хронологию с момента создания
+    """
+    INSERT OR IGNORE INTO post_timeline (post_id, channel, ingested_at)
+    SELECT id, source_id, CAST(strftime('%s', created_at) AS REAL) FROM news
+    WHERE status IN ('new', 'pending', 'skipped', 'queued')
+    """,
+]
+
+
+# --- Миграция 15: курсор догрузки истории ---
+
+_backfill_cursor = [
+    # last_message_id поднимает и живой приём, поэтому после обрыва догрузки по нему
+    # недогруженный промежуток терялся. Курсор двигает только догрузка, по порядку сообщений
+    "ALTER TABLE channel_state ADD COLUMN backfill_message_id INTEGER",
+    "UPDATE channel_state SET backfill_message_id = last_message_id",
+]
+
+
+# --- Миграция 16: шаги отправки задания публикации ---
+
+_publish_progress = [
+    # Пост уходит несколькими запросами (медиа, подпись, текст); выполненные шаги
+    # (JSON) сохраняются, и повтор продолжает с невыполненного, не дублируя медиа
+    "ALTER TABLE publish_job ADD COLUMN progress TEXT",
+]
+
+
+# Номер миграции -> список SQL-выражений или функция fn(conn).
+# Новые миграции только добавляются в конец, применённые не редактируются.
+MIGRATIONS = [
+    (1, _initial_schema),
+    (2, _status_indexes),
+    (3, _fingerprints),
+    (4, _session_items),
+    (5, _message_ids),
+    (6, _channel_peers),
+    (7, _media),
+    (8, _pending_deletions),
+    (9, _publish_jobs),
+    (10, _chat_messages),
+    (11, _fsm_states),
+    (12, _news_search),
+    (13, _archive),
+    (14, _post_timeline),
+    (15, _backfill_cursor),
+    (16, _publish_progress),
+]
+
+
+def apply_migrations(conn):
+    """Применяет недостающие миграции; версия схемы хранится в PRAGMA user_version"""
+    register_functions(conn)
+    for number, migration in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Перечитываем версию под блокировкой: бот и парсер могут стартовать одновременно
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if number <= version:
+                conn.execute("COMMIT")
+                continue
+            if callable(migration):
+                migration(conn)
+            else:
+                for statement in migration:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+            logger.info(f"🧱 Применена миграция схемы {number}")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    _enable_incremental_vacuum(conn)
+
+
+def _enable_incremental_vacuum(conn):
+    """
+    Разово переводит базу в auto_vacuum=INCREMENTAL, чтобы место после архивации
+    возвращалось файлу по частям. Режим меняется только VACUUM (вне транзакции,
+    поэтому не миграцией); для новой базы это мгновенно, для старой — один раз
+    при старте. Если база занята другим процессом, попробуем при следующем запуске.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось включить auto_vacuum=INCREMENTAL: {e}")
+        return
+    logger.info("🧹 База переведена в режим auto_vacuum=INCREMENTAL")
@@ -1,16 +1,19 @@
-import sqlite3
 import logging
-import asyncio
+import time
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from config import ADMIN_CHAT_IDS, TARGET_CHANNEL_ID
+from config import ADMIN_CHAT_IDS
 from db import (
-    get_new_posts, create_session, get_post,
+    create_session_from_queue, get_post,
     get_current_post_for_admin, set_post_status,
-    get_session_index, get_session_total,
-    advance_session, end_session
+    advance_session, end_session,
+    set_styled_text, count_posts_by_status
 )
-from gemini import revise_text_with_chatgpt
+from gemini import rewrite_service
+from cleanup import cleanup
+from publisher import publish_queue
+from session_engine import session_engine
+from timeline import stage_recorder
 from menu_router import get_main_menu  # Для кнопки "Назад"
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -27,8 +30,8 @@ moderation_router = Router()
 
 @moderation_router.callback_query(F.data == "go_to_moderation")
 async def show_moderation_button(callback: types.CallbackQuery):
-    new_posts = get_new_posts()
-    if not new_posts:
+    new_posts_count = await count_posts_by_status("new", "pending", "skipped")
+    if not new_posts_count:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
         ])
@@ -40,10 +43,12 @@ async def show_moderation_button(callback: types.CallbackQuery):
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🚀 Начать модерацию", callback_data="start_moderation")],
+        [InlineKeyboardButton(text="📋 Пакетная модерация", callback_data="bulk_moderation")],
+        [InlineKeyboardButton(text="🧠 Gemini для очереди", callback_data="bulk_gemini")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
     ])
     await callback.message.edit_text(
-        f"📬 Получено <b>{len(new_posts)}</b> новых постов.",
+        f"📬 Получено <b>{new_posts_count}</b> новых постов.",
         reply_markup=keyboard
     )
 
@@ -59,7 +64,7 @@ async def start_moderation(callback: types.CallbackQuery):
     admin_id = callback.from_user.id
 
     # Проверяем, есть ли уже активная сессия
-    current_post = get_current_post_for_admin(admin_id)
+    current_post = await get_current_post_for_admin(admin_id)
     if current_post is not None:
         # Сессия существует - предлагаем продолжить или перезапустить
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -73,13 +78,13 @@ async def start_moderation(callback: types.CallbackQuery):
         )
         return
 
-    # Нет активной сессии, создаем новую
-    new_posts = get_new_posts()
+    # Нет активной сессии, создаем новую из всей очереди модерации
+    total = await create_session_from_queue(admin_id)
+    session_engine.reset(admin_id)
 
-    logger.info(f"🔎 Модерация запущена. Найдено постов: {len(new_posts)}")
-    logger.info(f"📝 ID новых постов: {new_posts}")
+    logger.info(f"🔎 Модерация запущена. Найдено постов: {total}")
 
-    if not new_posts:
+    if not total:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
         ])
@@ -89,9 +94,6 @@ async def start_moderation(callback: types.CallbackQuery):
         )
         return
 
-    create_session(admin_id, new_posts)
-    logger.info(f"📦 Создана сессия модерации для {admin_id} с постами: {new_posts}")
-
     # Отправляем и сразу сохраняем сообщение о начале модерации
     start_message = await callback.message.edit_text("Модерация началась ✅")
 
@@ -99,11 +101,7 @@ async def start_moderation(callback: types.CallbackQuery):
     await send_current_post(admin_id, callback.bot, callback.message.chat.id)
 
     # Удаляем сообщение "Модерация началась" через небольшую задержку
-    await asyncio.sleep(1)
-    try:
-        await start_message.delete()
-    except Exception as e:
-        logger.error(f"Не удалось удалить сообщение о начале модерации: {e}")
+    cleanup.delete_later(start_message, 1)
 
 
 @moderation_router.callback_query(F.data == "continue_session")
@@ -111,26 +109,24 @@ async def continue_moderation_session(callback: types.CallbackQuery):
     admin_id = callback.from_user.id
     start_message = await callback.message.edit_text("Продолжаем модерацию ✅")
     await send_current_post(admin_id, callback.bot, callback.message.chat.id)
-    await asyncio.sleep(1)
-    try:
-        await start_message.delete()
-    except Exception as e:
-        logger.error(f"Не удалось удалить сообщение: {e}")
+    cleanup.delete_later(start_message, 1)
 
 
 @moderation_router.callback_query(F.data == "restart_session")
 async def restart_moderation_session(callback: types.CallbackQuery):
     admin_id = callback.from_user.id
     # Завершаем текущую сессию
-    end_session(admin_id)
+    await end_session(admin_id)
+    session_engine.reset(admin_id)
     # Перенаправляем на start_moderation
     await start_moderation(callback)
 
 
-async def send_current_post(admin_id: int, bot, chat_id: int):
-    post_id = get_current_post_for_admin(admin_id)
+async def send_current_post(admin_id: int, bot, chat_id: int, started: float = None):
+    # Пост обычно уже подготовлен движком сессии — остаётся один запрос к API
+    view = await session_engine.current(admin_id)
 
-    if post_id is None:
+    if view is None:
         await bot.send_message(
             chat_id=chat_id,
             text="✅ Все посты из сессии обработаны.",
@@ -140,31 +136,10 @@ async def send_current_post(admin_id: int, bot, chat_id: int):
         )
         return
 
-    post = get_post(post_id)
-    if not post:
-        advance_session(admin_id)
-        await send_current_post(admin_id, bot, chat_id)
-        return
-
-    post_number = get_session_index(admin_id) + 1
-    total = get_session_total(admin_id)
-
-    # Используем styled_text (который может быть обработан Gemini), если он доступен
-    post_text = post[3] if post[3] else post[2]
-
-    text = f"<b>Пост {post_number} из {total}</b>\n\n{post_text}"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="✅ Опубликовать", callback_data=f"publish_{post_id}"),
-            InlineKeyboardButton(text="⏳ Отложить", callback_data=f"skip_{post_id}")
-        ],
-        [InlineKeyboardButton(text="🧠 Обработать (Gemini)", callback_data=f"gemini_{post_id}")],
-        [InlineKeyboardButton(text="🗑 Отклонить", callback_data=f"decline_{post_id}")],
-        [InlineKeyboardButton(text="🔙 В меню", callback_data="end_moderation")]
-    ])
-
-    await bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard)
+    await bot.send_message(chat_id=chat_id, text=view.text, reply_markup=view.keyboard)
+    stage_recorder.mark("first_shown_at", [view.post_id])
+    if started is not None:
+        session_engine.record_time_to_next_post(admin_id, started)
 
 
 @moderation_router.callback_query(F.data == "end_moderation")
@@ -175,68 +150,49 @@ async def end_moderation(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.delete()
 
     # Очищаем сессию
-    end_session(admin_id)
+    await end_session(admin_id)
+    session_engine.reset(admin_id)
 
     # Возвращаемся в главное меню
     await callback.message.answer("👋 Главное меню:", reply_markup=get_main_menu())
 
 
-@moderation_router.callback_query(F.data.startswith(("publish_", "gemini_", "skip_", "decline_")))
-async def handle_post_action(callback: types.CallbackQuery, state: FSMContext):
+async def next_post(callback: types.CallbackQuery, status_text: str, started: float):
+    """Показывает следующий пост сессии, затем убирает текущий; статус — всплывающим уведомлением"""
     admin_id = callback.from_user.id
-    data = callback.data
-
-    if data.startswith("publish_"):
-        post_id = int(data.split("_")[1])
-        post = get_post(post_id)
-        if not post:
-            await callback.message.edit_text("⚠️ Пост не найден.")
-            return
-
-        # Используем текст с стилем (после Gemini), если он есть
-        publish_text = post[3] if post[3] else post[2]
-
-        await callback.bot.send_message(chat_id=TARGET_CHANNEL_ID, text=publish_text)
-        set_post_status(post_id, "published")
-
-        # Удаляем сообщение с постом вместо редактирования
+    await advance_session(admin_id)
+    await send_current_post(admin_id, callback.bot, callback.message.chat.id, started)
+    await callback.answer(status_text)
+    # Удаляем сообщение с постом вместо редактирования
+    try:
         await callback.message.delete()
+    except Exception as e:
+        logger.error(f"Не удалось удалить сообщение с постом: {e}")
 
-        # Сохраняем message_id для последующего удаления
-        status_message = await callback.bot.send_message(
-            chat_id=callback.message.chat.id,
-            text="✅ Пост опубликован."
-        )
-
-        # Сохраняем ID сообщения для удаления
-        await state.update_data(status_message_id=status_message.message_id)
 
-        advance_session(admin_id)
-        await send_current_post(admin_id, callback.bot, callback.message.chat.id)
+@moderation_router.callback_query(F.data.startswith(("publish_", "schedule_", "gemini_", "skip_", "decline_")))
+async def handle_post_action(callback: types.CallbackQuery, state: FSMContext):
+    started = time.monotonic()  # Для метрики time-to-next-post
+    data = callback.data
 
-        # Удаляем сообщение о статусе через небольшую задержку
-        await asyncio.sleep(1)
-        await status_message.delete()
+    if data.startswith(("publish_", "schedule_")):
+        post_id = int(data.split("_")[1])
+        # Публикацией занимается outbox: здесь только ставим задание (мгновенно)
+        scheduled = data.startswith("schedule_")
+        enqueued = await publish_queue.enqueue([post_id], scheduled=scheduled)
+        session_engine.invalidate_post(post_id)
+        if not enqueued:
+            status_text = "⚠️ Пост уже обработан."
+        elif scheduled:
+            status_text = "🕒 Пост поставлен в расписание."
+        else:
+            status_text = "✅ Пост поставлен в очередь публикации."
+        await next_post(callback, status_text, started)
 
     elif data.startswith("skip_"):
         post_id = int(data.split("_")[1])
-        set_post_status(post_id, "skipped")
-
-        # Удаляем сообщение с постом
-        await callback.message.delete()
-
-        # Отправляем статус (который будет удален)
-        status_message = await callback.bot.send_message(
-            chat_id=callback.message.chat.id,
-            text="⏳ Пост отложен."
-        )
-
-        advance_session(admin_id)
-        await send_current_post(admin_id, callback.bot, callback.message.chat.id)
-
-        # Удаляем сообщение о статусе
-        await asyncio.sleep(1)
-        await status_message.delete()
+        await set_post_status(post_id, "skipped")
+        await next_post(callback, "⏳ Пост отложен.", started)
 
     elif data.startswith("gemini_"):
         post_id = int(data.split("_")[1])
@@ -262,34 +218,20 @@ async def handle_post_action(callback: types.CallbackQuery, state: FSMContext):
     elif data.startswith("decline_"):
         post_id = int(data.split("_")[1])
         try:
-            conn = sqlite3.connect("news.db", check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM news WHERE id = ?", (post_id,))
-            conn.commit()
-            conn.close()
-            await callback.message.delete()
-
-            # Добавляем сообщение о статусе, которое будет удалено
-            status_message = await callback.message.answer("🗑 Пост удален.")
-
-            # Переходим к следующему посту
-            advance_session(admin_id)
-            await send_current_post(admin_id, callback.bot, callback.message.chat.id)
-
-            # Удаляем сообщение о статусе после задержки
-            await asyncio.sleep(1)
-            await status_message.delete()
+            # Пост не удаляется: отклонённые со временем уходят в архив
+            await set_post_status(post_id, "declined")
+            session_engine.invalidate_post(post_id)
+            await next_post(callback, "🗑 Пост отклонён.", started)
 
         except Exception as e:
             error_msg = await callback.message.edit_text(
-                f"❌ Ошибка при удалении поста: {e}",
+                f"❌ Ошибка при отклонении поста: {e}",
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_main")]
                 ])
             )
             # Удаляем сообщение об ошибке через некоторое время
-            await asyncio.sleep(3)
-            await error_msg.delete()
+            cleanup.delete_later(error_msg, 3)
             return
 
 
@@ -342,17 +284,15 @@ async def handle_admin_comment(message: types.Message, state: FSMContext):
         error_message = await message.answer("⚠️ Ошибка состояния: не найден ID поста.")
         await state.clear()
         # Удаляем сообщение об ошибке через некоторое время
-        await asyncio.sleep(3)
-        await error_message.delete()
+        cleanup.delete_later(error_message, 3)
         return
 
-    post = get_post(post_id)
+    post = await get_post(post_id)
     if not post:
         error_message = await message.answer("⚠️ Пост не найден.")
         await state.clear()
         # Удаляем сообщение об ошибке через некоторое время
-        await asyncio.sleep(3)
-        await error_message.delete()
+        cleanup.delete_later(error_message, 3)
         return
 
     raw_text = post[2]
@@ -364,14 +304,11 @@ async def handle_admin_comment(message: types.Message, state: FSMContext):
     logger.info(f"🔍 Начинаем обработку поста {post_id} с комментарием: {message.text}")
 
     try:
-        revised_text = revise_text_with_chatgpt(raw_text, message.text, post[1])
+        revised_text = await rewrite_service.revise(raw_text, message.text, post[1])
         logger.info(f"📩 Gemini вернул: {revised_text}")
 
-        conn = sqlite3.connect("news.db", check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE news SET styled_text = ?, status = ? WHERE id = ?", (revised_text, "pending", post_id))
-        conn.commit()
-        conn.close()
+        await set_styled_text(post_id, revised_text, "pending")
+        session_engine.invalidate_post(post_id)
 
         # Удаляем сообщение о процессе обработки
         await processing_message.delete()
@@ -391,8 +328,7 @@ async def handle_admin_comment(message: types.Message, state: FSMContext):
         await send_current_post(message.from_user.id, message.bot, chat_id)
 
         # Удаляем сообщение об успешной обработке
-        await asyncio.sleep(1)
-        await success_message.delete()
+        cleanup.delete_later(success_message, 1)
 
     except Exception as e:
         logger.error(f"❌ Ошибка при обработке поста: {e}")
@@ -411,11 +347,7 @@ async def handle_admin_comment(message: types.Message, state: FSMContext):
         )
 
         # Удаляем сообщение об ошибке через некоторое время
-        await asyncio.sleep(5)
-        try:
-            await error_message.delete()
-        except Exception:
-            pass
+        cleanup.delete_later(error_message, 5)
 
     # В любом случае очищаем состояние
     await state.clear()
\ No newline at end of file
@@ -0,0 +1,111 @@
+# notifier.py
+
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from db import (
+    get_pending_notifications, ack_notifications,
+    get_notification_messages, set_notification_message,
+    has_active_session
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_notification_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🚀 Начать модерацию", callback_data="start_moderation")]
+    ])
+
+
+class Notifier:
+    """
+    Рассылка уведомлений о новых постах по событиям.
+
+    Ингест пишет событие в notification_outbox (в той же транзакции, что и пост)
+    и вызывает publish(). Нотификатор ждёт первое событие, склеивает всё,
+    что пришло за окно debounce, и обновляет последнее уведомление каждого админа.
+    Outbox разбирается и при старте, так что события не теряются при перезапуске.
+    """
+
+    def __init__(self, bot, admin_ids, debounce=0.5):
+        self.bot = bot
+        self.admin_ids = admin_ids
+        self.debounce = debounce
+        self._queue = asyncio.Queue()
+        self._last_notification = {}  # admin_id: message_id
+
+    def publish(self, post_ids=None):
+        """Сообщает нотификатору о новых постах (не блокирует)"""
+        self._queue.put_nowait(post_ids)
+
+    async def run(self):
+        self._last_notification = await get_notification_messages()
+        self.publish()  # Разбираем то, что осталось в outbox с прошлого запуска
+        while True:
+            await self._queue.get()
+            await self._wait_for_burst()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка при рассылке уведомлений: {e}")
+
+    async def _wait_for_burst(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.debounce
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+    async def _flush(self):
+        events = await get_pending_notifications()
+        if not events:
+            return
+
+        event_ids = [event_id for event_id, _ in events]
+        post_ids = [post_id for _, post_id in events]
+        text = f"📬 Получено <b>{len(post_ids)}</b> новых постов."
+
+        # Рассылаем всем админам параллельно; темп задаёт RateLimiter бота
+        await asyncio.gather(*(self._notify(admin_id, text) for admin_id in self.admin_ids))
+
+        await ack_notifications(event_ids, post_ids)
+
+    async def _notify(self, admin_id, text):
+        # Пропускаем админов, которые уже в сессии модерации
+        if await has_active_session(admin_id):
+            logger.info(f"Админ {admin_id} уже в сессии модерации, пропускаем уведомление")
+            return
+
+        keyboard = get_notification_keyboard()
+        message_id = self._last_notification.get(admin_id)
+        if message_id:
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=admin_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=keyboard
+                )
+                logger.info(f"🔁 Обновлено уведомление для {admin_id}")
+                return
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    return
+                # Сообщение удалено или слишком старое — отправляем новое
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось обновить сообщение для {admin_id}: {e}")
+
+        try:
+            sent = await self.bot.send_message(chat_id=admin_id, text=text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"❌ Не удалось вообще отправить уведомление: {e}")
+            return
+        self._last_notification[admin_id] = sent.message_id
+        await set_notification_message(admin_id, sent.message_id)
+        logger.info(f"📤 Отправлено новое уведомление администратору {admin_id}")
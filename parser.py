@@ -1,13 +1,24 @@
 import asyncio
 import logging
-import json
-import os
 from telethon import TelegramClient, events
 from aiogram import Bot
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
 from dotenv import load_dotenv
-from config import API_ID, API_HASH, SESSION_NAME, TELEGRAM_BOT_TOKEN, ADMIN_CHAT_IDS
-from db import add_post, get_unnotified_posts, mark_posts_notified, get_current_post_for_admin
+from config import (
+    API_ID, API_HASH, SESSION_NAME, TELEGRAM_BOT_TOKEN, ADMIN_CHAT_IDS, NOTIFY_DEBOUNCE,
+    INGEST_BATCH_SIZE, INGEST_MAX_DELAY, INGEST_MAX_PENDING,
+    BACKFILL_BATCH_SIZE, BACKFILL_MAX_AGE_HOURS, CHANNELS_FILE, CHANNELS_POLL_INTERVAL,
+    MEDIA_RELAY_CHAT_ID
+)
+from db import close_db
+from ingest import IngestBuffer, IncomingMessage
+from backfill import backfill_all
+from media import MediaRelay
+from notifier import Notifier
+from sender import install_rate_limiter
+from ledger import install_message_ledger
+from subscriptions import ChannelRegistry
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,65 +32,81 @@ load_dotenv()
 
 # 🤖 Инициализация Telethon и aiogram
 client = TelegramClient(SESSION_NAME, API_ID, API_HASH)
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+install_rate_limiter(bot)
+install_message_ledger(bot, ADMIN_CHAT_IDS)  # Уведомления тоже попадают в журнал для /clear
+notifier = Notifier(bot, ADMIN_CHAT_IDS, debounce=NOTIFY_DEBOUNCE)
+media_relay = None
 
+# Фоновые задачи парсера: ссылки держим, чтобы отменить их до закрытия базы
+background = set()
 
-# 📡 Загрузка списка каналов из channels.json
-def load_channels():
-    try:
-        with open("channels.json", "r", encoding="utf-8") as f:
-            channels = json.load(f)
-        if not channels:
-            raise ValueError("Список каналов пуст")
-        return channels
-    except Exception as e:
-        logger.error(f"❌ Не удалось загрузить список каналов: {e}")
-        return []
 
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background.add(task)
+    task.add_done_callback(background.discard)
+    return task
 
-SOURCE_CHANNELS = load_channels()
-logger.info(f"🎯 Каналы для мониторинга: {SOURCE_CHANNELS}")
 
-if not SOURCE_CHANNELS:
-    logger.warning("⚠️ Нет каналов для мониторинга. Добавьте их через меню бота.")
-    exit()
+# Пачки сохранённых постов сразу передаются нотификатору и пересылке медиа
+def on_ingested(post_ids):
+    notifier.publish(post_ids)
+    if media_relay:
+        media_relay.submit(post_ids)
 
 
-# 🔁 Обработка новых сообщений
-@client.on(events.NewMessage(chats=SOURCE_CHANNELS))
-async def handler(event):
-    logger.info("🚨 Сработал handler от Telethon!")
+ingest_buffer = IngestBuffer(
+    on_flushed=on_ingested,
+    batch_size=INGEST_BATCH_SIZE,
+    max_delay=INGEST_MAX_DELAY,
+    max_pending=INGEST_MAX_PENDING
+)
+
+
+# ⏪ Догружаем то, что пришло, пока парсер был выключен (живые сообщения принимаются параллельно).
+# Вызывается при старте для всех каналов и потом для каждого добавленного через меню.
+def start_backfill(subscriptions):
+    run_in_background(backfill_all(
+        client, subscriptions,
+        on_ingested=on_ingested,
+        batch_size=BACKFILL_BATCH_SIZE,
+        max_age_hours=BACKFILL_MAX_AGE_HOURS
+    ))
+
+
+# 📡 Список каналов из channels.json; изменения подхватываются без перезапуска
+registry = ChannelRegistry(client, CHANNELS_FILE, CHANNELS_POLL_INTERVAL, on_added=start_backfill)
+if MEDIA_RELAY_CHAT_ID:
+    media_relay = MediaRelay(client, MEDIA_RELAY_CHAT_ID, registry)
+else:
+    logger.warning("⚠️ MEDIA_RELAY_CHAT_ID не задан — медиа будут сохраняться, но публиковаться без них.")
 
-    raw_text = event.message.message
-    source = event.chat.username or event.chat.title or str(event.chat_id)
+
+# 🔁 Обработка новых сообщений: один обработчик, фильтр по peer id подписанных каналов.
+# Части альбома пропускаются — их целиком получает album_handler.
+@client.on(events.NewMessage(func=lambda event: event.chat_id in registry and not event.message.grouped_id))
+async def handler(event):
+    subscription = registry.get(event.chat_id)
+    if subscription is None:
+        return  # Канал удалили из списка, пока событие ждало обработки
+    source = subscription.source_id
 
     logger.info(f"🆕 Новый пост из {source}")
-    post_id = add_post(source, raw_text)
-    logger.info(f"📥 Пост #{post_id} сохранён в БД")
-
-    # 🔔 Уведомление администратору только для тех, кто не в сессии модерации
-    unnotified = get_unnotified_posts()
-    if unnotified:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🚀 Начать модерацию", callback_data="start_moderation")]
-        ])
-        for admin_id in ADMIN_CHAT_IDS:
-            # Проверяем, не находится ли админ уже в сессии модерации
-            if get_current_post_for_admin(admin_id) is not None:
-                logger.info(f"Админ {admin_id} уже в сессии модерации, пропускаем уведомление")
-                continue
-
-            try:
-                await bot.send_message(
-                    chat_id=admin_id,
-                    text=f"📥 Получено <b>{len(unnotified)}</b> новых постов.",
-                    reply_markup=keyboard
-                )
-                logger.info(f"🔔 Уведомление отправлено администратору {admin_id}")
-            except Exception as e:
-                logger.error(f"❌ Ошибка при отправке уведомления: {e}")
-
-        mark_posts_notified(unnotified)
+    # 📥 Запись в БД пачками; уведомление отправит нотификатор после сохранения
+    await ingest_buffer.submit(IncomingMessage.from_telethon(event.message, source))
+
+
+# 🖼 Альбом (несколько фото/видео с общим grouped_id) сохраняется одним постом
+@client.on(events.Album(func=lambda event: event.chat_id in registry))
+async def album_handler(event):
+    subscription = registry.get(event.chat_id)
+    if subscription is None:
+        return
+    source = subscription.source_id
+
+    logger.info(f"🆕 Новый альбом из {source} ({len(event.messages)} частей)")
+    await ingest_buffer.submit(IncomingMessage.from_telethon_album(event.messages, source))
 
 
 # 🧪 Отладочная функция с ограничением вывода информации
@@ -105,8 +132,23 @@ async def debug_session_info():
 async def main():
     await client.start()
     await debug_session_info()
-    logger.info(f"✅ Парсер запущен. Мониторим: {', '.join(SOURCE_CHANNELS)}")
-    await client.run_until_disconnected()
+    run_in_background(notifier.run())
+    ingest_buffer.start()
+    if media_relay:
+        run_in_background(media_relay.run())
+    await registry.load()
+    run_in_background(registry.watch())
+    logger.info(f"✅ Парсер запущен. Мониторим: {', '.join(s.source_id for s in registry.subscriptions())}")
+    try:
+        await client.run_until_disconnected()
+    finally:
+        # Задачи останавливаем до сброса буфера и закрытия базы: их записи не должны упасть на закрытом хранилище
+        tasks = list(background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await ingest_buffer.close()
+        await close_db()
 
 
 if __name__ == "__main__":
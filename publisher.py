@@ -0,0 +1,157 @@
+# publisher.py
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from config import TARGET_CHANNEL_ID, MEDIA_RELAY_CHAT_ID, PUBLISH_RATE, PUBLISH_MAX_ATTEMPTS, PUBLISH_SLOTS
+from db import (
+    get_post, get_post_media, enqueue_publish, get_due_publish_job, get_scheduled_times,
+    mark_publish_sending, save_publish_progress, complete_publish_job, retry_publish_job, fail_publish_job,
+    recover_publish_jobs
+)
+from media import send_post
+from rewrite_rules import rewrite_rules
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, которые не лечатся повтором (неверный текст, бот не админ канала и т.п.)
+_PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError)
+
+
+def next_free_slot(slots, taken, now=None):
+    """
+    Ближайший слот расписания ("ЧЧ:ММ", местное время) не раньше now,
+    на который ещё не назначен пост; возвращает unix-время.
+    """
+    now = now or datetime.now().astimezone()
+    taken = {round(ts) for ts in taken}
+    times = sorted(datetime.strptime(slot, "%H:%M").time() for slot in slots)
+    day = now.date()
+    while True:
+        for slot_time in times:
+            candidate = datetime.combine(day, slot_time, tzinfo=now.tzinfo)
+            if candidate >= now and round(candidate.timestamp()) not in taken:
+                return candidate.timestamp()
+        day += timedelta(days=1)
+
+
+class PublishQueue:
+    """
+    Надёжная очередь публикации постов в целевой канал (outbox в таблице publish_job).
+
+    Кнопка «Опубликовать» только ставит задание (enqueue) — одной транзакцией
+    с переводом поста в статус queued. Ключ идемпотентности — пост, поэтому
+    повторные нажатия и пакетные действия не дают дублей. Воркер берёт
+    созревшие задания не чаще rate в минуту; перед запросом к Telegram
+    задание помечается sending, после — sent вместе со статусом поста.
+    Выполненные шаги отправки (медиа, подпись, текст) сохраняются в задании,
+    и повтор продолжает с невыполненного шага. Временные ошибки повторяются
+    с экспоненциальной паузой, постоянные (и исчерпанные попытки) возвращают
+    пост в очередь модерации — если ещё ничего не отправлено; иначе пост
+    считается опубликованным частично.
+    """
+
+    def __init__(self, chat_id, rate=20, max_attempts=5, slots=(), retry_delay=5.0):
+        self.chat_id = chat_id
+        self.interval = 60 / rate if rate else 0
+        self.max_attempts = max_attempts
+        self.slots = list(slots)
+        self.retry_delay = retry_delay
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def enqueue(self, post_ids, scheduled=False):
+        """Ставит посты в очередь сразу или (scheduled=True) в ближайшие свободные слоты"""
+        now = time.time()
+        if scheduled and self.slots:
+            taken = await get_scheduled_times(now)
+            times = []
+            for _ in post_ids:
+                times.append(next_free_slot(self.slots, taken + times))
+        else:
+            times = [now] * len(post_ids)
+        enqueued = await enqueue_publish(list(zip(post_ids, times)))
+        self._wakeup.set()
+        return enqueued
+
+    def start(self, bot):
+        self._task = asyncio.create_task(self.run(bot))
+        return self._task
+
+    async def run(self, bot):
+        interrupted = await recover_publish_jobs()
+        if interrupted:
+            logger.warning(
+                f"⚠️ Публикация постов {interrupted} прервалась во время отправки — "
+                f"они считаются опубликованными, проверьте канал"
+            )
+        while True:
+            # Сбрасываем сигнал до чтения: enqueue() во время запроса разбудит следующее ожидание
+            self._wakeup.clear()
+            job, next_at = await get_due_publish_job(time.time())
+            if job is None:
+                await self._sleep(next_at - time.time() if next_at else None)
+                continue
+            try:
+                await self._process(bot, *job)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки задания публикации {job[0]}: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def _sleep(self, timeout):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _process(self, bot, job_id, post_id, attempts, progress):
+        post = await get_post(post_id)
+        if not post:
+            await fail_publish_job(job_id, post_id, attempts, "пост удалён")
+            return
+
+        media = await get_post_media(post_id)
+        if MEDIA_RELAY_CHAT_ID and any(row[1] == "pending" for row in media):
+            # Медиа ещё пересылаются парсером — вернёмся к посту позже, попытку не считаем
+            await retry_publish_job(job_id, time.time() + self.retry_delay, attempts, "ожидание медиа")
+            return
+        relayed = [(row[2], row[3]) for row in media if row[1] == "relayed"]
+
+        await mark_publish_sending(job_id)
+        attempts += 1
+        progress = json.loads(progress) if progress else {}
+
+        async def save_step(steps):
+            progress.update(steps)
+            await save_publish_progress(job_id, json.dumps(steps))
+
+        try:
+            # Правила применяются ещё раз: они могли измениться после приёма поста или правки Gemini
+            text = rewrite_rules.apply(post[3] if post[3] else post[2])
+            message_id = await send_post(bot, self.chat_id, text, relayed, progress, save_step)
+        except Exception as e:
+            if progress and (isinstance(e, _PERMANENT_ERRORS) or attempts >= self.max_attempts):
+                # Часть поста уже в канале: возврат в модерацию привёл бы к повторной отправке медиа
+                logger.error(f"❌ Пост {post_id} опубликован не полностью (шаги {', '.join(progress)}): {e}")
+                await complete_publish_job(job_id, post_id, progress.get("media", [progress.get("text")])[0])
+            elif isinstance(e, _PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                logger.error(f"❌ Пост {post_id} не опубликован ({attempts} попыток): {e}")
+                await fail_publish_job(job_id, post_id, attempts, str(e))
+            else:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                logger.warning(f"⚠️ Ошибка публикации поста {post_id}, повтор через {delay:.0f} с: {e}")
+                await retry_publish_job(job_id, time.time() + delay, attempts, str(e))
+            return
+
+        await complete_publish_job(job_id, post_id, message_id)
+        logger.info(f"✅ Пост {post_id} опубликован")
+
+
+publish_queue = PublishQueue(
+    TARGET_CHANNEL_ID, rate=PUBLISH_RATE, max_attempts=PUBLISH_MAX_ATTEMPTS, slots=PUBLISH_SLOTS
+)
@@ -0,0 +1,86 @@
+# retention.py
+
+import asyncio
+import logging
+import time
+
+from config import (
+    ARCHIVE_STATUSES, ARCHIVE_AFTER_DAYS, ARCHIVE_INTERVAL, ARCHIVE_BATCH_SIZE, TIMELINE_RETENTION_DAYS
+)
+from db import archive_posts, incremental_vacuum, prune_timeline
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionService:
+    """
+    Архивация старых постов и возврат места файлу базы.
+
+    Раз в interval секунд переносит посты в конечных статусах старше
+    after_days дней из news в news_archive (текст сжимается zlib) пачками
+    по batch_size — каждая пачка отдельной транзакцией, чтобы не задерживать
+    остальные записи. Затем по частям выполняет incremental_vacuum. Таблица
+    news и её индексы остаются маленькими, а архивные посты по-прежнему
+    доступны через get_post и /search. Хронология этапов постов старше
+    timeline_days дней удаляется в том же проходе.
+    """
+
+    def __init__(self, statuses, after_days=30, interval=3600, batch_size=500, vacuum_pages=1000,
+                 timeline_days=90):
+        self.statuses = list(statuses)
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.timeline_days = timeline_days
+        self._task = None
+        self._vacuum_warned = False
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"❌ Ошибка архивации постов: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        archived = 0
+        while True:
+            count = await archive_posts(self.statuses, self.after_days, self.batch_size)
+            archived += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(0)  # Даём пройти другим записям между пачками
+        if archived:
+            logger.info(f"🗄 В архив перенесено {archived} постов")
+        pruned = await prune_timeline(time.time() - self.timeline_days * 86400)
+        if pruned:
+            logger.info(f"🗄 Удалено {pruned} старых записей хронологии постов")
+        await self.vacuum()
+        return archived
+
+    async def vacuum(self):
+        while True:
+            left = await incremental_vacuum(self.vacuum_pages)
+            if left is None:
+                if not self._vacuum_warned:
+                    self._vacuum_warned = True
+                    logger.warning(
+                        "⚠️ База ещё не в режиме auto_vacuum=INCREMENTAL — место после архивации "
+                        "переиспользуется, но файл не уменьшается. Режим включится при следующем запуске"
+                    )
+                return
+            if not left:
+                return
+            await asyncio.sleep(0)
+
+
+retention = RetentionService(
+    ARCHIVE_STATUSES, after_days=ARCHIVE_AFTER_DAYS, interval=ARCHIVE_INTERVAL, batch_size=ARCHIVE_BATCH_SIZE,
+    timeline_days=TIMELINE_RETENTION_DAYS
+)
@@ -0,0 +1,81 @@
+# rewrite_cache.py
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from db import get_cached_rewrite, put_cached_rewrite
+
+logger = logging.getLogger(__name__)
+
+
+class RewriteCache:
+    """
+    Двухуровневый кэш результатов Gemini: LRU в памяти и таблица
+    rewrite_cache в SQLite с TTL и ограничением на число записей.
+    """
+
+    def __init__(self, memory_size, ttl, max_rows):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = OrderedDict()  # key: (text, latency, created_at)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(raw_text, comment, prompt_version, model_name):
+        payload = "\x1f".join([raw_text or "", comment or "", str(prompt_version), model_name])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, text, latency, created_at):
+        self._memory[key] = (text, latency, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    async def get(self, key):
+        """Возвращает сохранённый текст или None"""
+        entry = self._memory.get(key)
+        if entry and entry[2] >= time.time() - self.ttl:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            self.saved_seconds += entry[1]
+            return entry[0]
+
+        row = await get_cached_rewrite(key, self.ttl)
+        if row:
+            text, latency, created_at = row
+            self._remember(key, text, latency, created_at)
+            self.disk_hits += 1
+            self.saved_seconds += latency
+            return text
+
+        self.misses += 1
+        return None
+
+    async def put(self, key, text, latency):
+        self._remember(key, text, latency, time.time())
+        await put_cached_rewrite(key, text, latency, self.ttl, self.max_rows)
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_calls": hits,
+            "saved_seconds": round(self.saved_seconds, 1),
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        logger.info(
+            f"💾 Кэш Gemini: попаданий {s['saved_calls']} (память {s['memory_hits']}, БД {s['disk_hits']}), "
+            f"промахов {s['misses']}, сэкономлено {s['saved_seconds']} с"
+        )
@@ -0,0 +1,112 @@
+# rewrite_rules.py
+
+import json
+import logging
+import os
+import re
+import time
+from typing import Callable, NamedTuple, Pattern, Union
+
+from config import REWRITE_RULES_FILE
+
+logger = logging.getLogger(__name__)
+
+# Российский номер: +7 / 7 / 8, код в скобках или без, разделители — пробелы и дефисы
+PHONE_PATTERN = r"(?<![\d+])(?:\+\s?7|7|8)[ \-–]*\(?\d{3}\)?[ \-–]*\d{3}[ \-–]*\d{2}[ \-–]*\d{2}(?!\d)"
+
+# Правила, которые раньше были зашиты в промпт Gemini; действуют, если файла правил нет
+DEFAULT_RULES = [
+    # Восклицательный знак уже в замене — не удваиваем его после «CashTaxi!»
+    {"type": "regex", "pattern": r"\bCashTaxi\b!?", "replace": "Таксопарк СВОИ!", "ignore_case": True},
+    {"type": "phone", "replace": "+7 929 515 80 66"},
+]
+
+
+class CompiledRule(NamedTuple):
+    pattern: Pattern
+    replace: Union[str, Callable]
+
+
+def compile_rule(rule):
+    """
+    Собирает правило из словаря файла правил:
+    literal — {"find", "replace", "ignore_case"}: замена подстроки как есть;
+    regex — {"pattern", "replace", "ignore_case"}: замена по регулярному выражению
+    (в replace допустимы \\1, \\g<name>);
+    phone — {"replace", "pattern"?}: любой номер телефона заменяется на replace.
+    """
+    kind = rule.get("type", "literal")
+    flags = re.IGNORECASE if rule.get("ignore_case") else 0
+    replace = rule["replace"]
+    if kind == "literal":
+        # Функция вместо строки — чтобы обратные слэши в замене не разбирались как шаблон
+        return CompiledRule(re.compile(re.escape(rule["find"]), flags), lambda match: replace)
+    if kind == "regex":
+        return CompiledRule(re.compile(rule["pattern"], flags), replace)
+    if kind == "phone":
+        return CompiledRule(re.compile(rule.get("pattern", PHONE_PATTERN), flags), lambda match: replace)
+    raise ValueError(f"Неизвестный тип правила {kind}")
+
+
+class RewriteRules:
+    """
+    Детерминированные правки текста без Gemini: замены подстрок, регулярные
+    выражения и приведение номеров телефона к одному.
+
+    Правила читаются из JSON-файла (список словарей, см. compile_rule) и
+    компилируются один раз; применяются по порядку файла. Файл перечитывается,
+    когда у него меняется mtime (проверка не чаще раза в reload_interval
+    секунд — один stat), так что бот и парсер подхватывают правку без
+    перезапуска. Без файла действуют DEFAULT_RULES.
+    """
+
+    def __init__(self, path, reload_interval=5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._rules = []
+        self._mtime = None
+        self._next_check = 0.0
+        self.reload()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        mtime = self._file_mtime()
+        try:
+            if mtime is None:
+                rules = DEFAULT_RULES
+            else:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    rules = json.load(f)
+            compiled = [compile_rule(rule) for rule in rules]
+        except Exception as e:
+            # mtime не запоминаем — попробуем ещё раз на следующей проверке, пока действуют старые правила
+            logger.error(f"❌ Не удалось загрузить правила из {self.path}: {e}")
+            return
+        self._mtime = mtime
+        self._rules = compiled
+        logger.info(f"📏 Загружено правил замены: {len(compiled)}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        if self._file_mtime() != self._mtime:
+            self.reload()
+
+    def apply(self, text):
+        """Возвращает текст после всех правил"""
+        if not text:
+            return text
+        self._maybe_reload()
+        for rule in self._rules:
+            text = rule.pattern.sub(rule.replace, text)
+        return text
+
+
+rewrite_rules = RewriteRules(REWRITE_RULES_FILE)
@@ -0,0 +1,123 @@
+# search_router.py
+
+import html
+import logging
+
+from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import ADMIN_CHAT_IDS, SEARCH_PAGE_SIZE, SEARCH_MAX_CANDIDATES
+from db import fts_query, search_posts, SNIPPET_OPEN, SNIPPET_CLOSE
+
+logger = logging.getLogger(__name__)
+
+search_router = Router()
+
+# Фильтр -> (подпись кнопки, статусы); пустой кортеж — без фильтра
+SEARCH_FILTERS = {
+    "all": ("Все", ()),
+    "queue": ("В очереди", ("new", "pending", "skipped")),
+    "published": ("Опубликованные", ("queued", "published")),
+    "declined": ("Отклонённые", ("declined",)),
+}
+
+STATUS_ICONS = {
+    "new": "🆕", "pending": "📝", "skipped": "⏳", "queued": "🕒", "published": "✅", "declined": "🗑",
+}
+
+
+def render_results(query, results, page_number):
+    if not results:
+        return f"🔍 По запросу «{html.escape(query)}» ничего не найдено."
+    lines = [f"🔍 <b>{html.escape(query)}</b> — страница {page_number}\n"]
+    for post_id, source_id, status, created_at, snippet, _ in results:
+        snippet = html.escape(" ".join(snippet.split()))
+        snippet = snippet.replace(SNIPPET_OPEN, "<b>").replace(SNIPPET_CLOSE, "</b>")
+        lines.append(
+            f"{STATUS_ICONS.get(status, '•')} <b>#{post_id}</b> <i>{html.escape(source_id or '')}</i>, "
+            f"{(created_at or '')[:16]}\n{snippet}\n"
+        )
+    return "\n".join(lines)
+
+
+def get_results_keyboard(current_filter, has_prev, has_next):
+    rows = [[
+        InlineKeyboardButton(
+            text=f"{'• ' if name == current_filter else ''}{label}",
+            callback_data=f"search_filter_{name}"
+        )
+        for name, (label, _) in SEARCH_FILTERS.items()
+    ]]
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data="search_prev"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data="search_next"))
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def render_search(state: FSMContext):
+    """
+    Читает страницу результатов по сохранённому в FSM запросу.
+
+    Результаты упорядочены по релевантности; страница берётся по ключу
+    (rank, id) последнего результата предыдущей, стек ключей — в FSM.
+    """
+    data = await state.get_data()
+    query, current_filter = data["search_query"], data.get("search_filter", "all")
+    cursors = data.get("search_cursors", [None])
+    results = await search_posts(
+        fts_query(query), SEARCH_FILTERS[current_filter][1], cursors[-1],
+        limit=SEARCH_PAGE_SIZE + 1, max_candidates=SEARCH_MAX_CANDIDATES
+    )
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+    last = [results[-1][5], results[-1][0]] if results else None
+    await state.update_data(search_cursors=cursors, search_last=last)
+    return (
+        render_results(query, results, len(cursors)),
+        get_results_keyboard(current_filter, len(cursors) > 1, has_next)
+    )
+
+
+@search_router.message(Command("search"))
+async def search_command(message: types.Message, command: CommandObject, state: FSMContext):
+    if message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    query = (command.args or "").strip()
+    if not fts_query(query):
+        await message.answer("Использование: /search &lt;слова&gt;\nНапример: /search выборы мэра\nслово* — поиск по началу слова")
+        return
+
+    await state.update_data(search_query=query, search_filter="all", search_cursors=[None])
+    text, keyboard = await render_search(state)
+    await message.answer(text, reply_markup=keyboard)
+    logger.info(f"🔍 Админ {message.from_user.id} ищет: {query}")
+
+
+@search_router.callback_query(F.data.startswith("search_"))
+async def search_navigation(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if "search_query" not in data:
+        await callback.answer("Поиск устарел, повторите /search")
+        return
+
+    cursors = data.get("search_cursors", [None])
+    if callback.data.startswith("search_filter_"):
+        current_filter = callback.data.replace("search_filter_", "")
+        if current_filter not in SEARCH_FILTERS or current_filter == data.get("search_filter"):
+            await callback.answer()
+            return
+        await state.update_data(search_filter=current_filter, search_cursors=[None])
+    elif callback.data == "search_next" and data.get("search_last"):
+        await state.update_data(search_cursors=cursors + [data["search_last"]])
+    elif callback.data == "search_prev" and len(cursors) > 1:
+        await state.update_data(search_cursors=cursors[:-1])
+
+    text, keyboard = await render_search(state)
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
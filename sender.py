@@ -0,0 +1,111 @@
+# sender.py
+
+import asyncio
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые создают или меняют сообщения и попадают под лимиты Telegram
+_LIMITED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # Больше ёмкости ведро не накопит — крупный запрос ждёт полного ведра
+        amount = min(amount, self.capacity)
+        # Лок сохраняет порядок ожидающих (FIFO)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.blocked_until - now
+                if wait <= 0 and self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep(max(wait, (amount - self.tokens) / self.rate))
+
+    def block(self, seconds):
+        """Запрещает выдачу токенов на seconds секунд (после RetryAfter)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self):
+        return not self._lock.locked() and self.tokens >= self.capacity and self.blocked_until <= time.monotonic()
+
+
+class RateLimiter(BaseRequestMiddleware):
+    """
+    Общий диспетчер исходящих запросов бота (middleware сессии aiogram).
+
+    Запросы на отправку и редактирование проходят через глобальное ведро
+    (по умолчанию 30 сообщений/с) и ведро конкретного чата (1/с для личных
+    чатов, 20/мин для групп и каналов). На TelegramRetryAfter блокируется
+    только затронутый чат, запрос повторяется после паузы. Одновременно ждут
+    повтора не больше max_pending_retries запросов — остальные получают ошибку сразу.
+    """
+
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20 / 60,
+                 max_retries=3, max_pending_retries=100):
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._retry_slots = asyncio.Semaphore(max_pending_retries)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = self.private_rate if is_private else self.group_rate
+            # Личным чатам разрешаем короткие всплески, группам — нет
+            bucket = self._chats[chat_id] = TokenBucket(rate, 3 if is_private else 1)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        limited = type(method).__name__.startswith(_LIMITED_PREFIXES)
+        attempt = 0
+        while True:
+            if limited:
+                if chat_id is not None:
+                    await self._chat_bucket(chat_id).acquire()
+                await self._global.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries or self._retry_slots.locked():
+                    raise
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.block(e.retry_after)
+                logger.warning(
+                    f"⏳ Flood wait {e.retry_after} с для {type(method).__name__} в чате {chat_id}, "
+                    f"повтор {attempt}/{self.max_retries}"
+                )
+                async with self._retry_slots:
+                    await asyncio.sleep(e.retry_after)
+
+
+def install_rate_limiter(bot, **kwargs):
+    """Подключает общий ограничитель ко всем запросам бота"""
+    limiter = RateLimiter(**kwargs)
+    bot.session.middleware(limiter)
+    return limiter
+
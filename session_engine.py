@@ -0,0 +1,169 @@
+# session_engine.py
+
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import NamedTuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import MODERATION_PREFETCH_DEPTH, PUBLISH_SLOTS
+from db import advance_session, get_session_cursor, get_session_views
+from rewrite_rules import rewrite_rules
+
+logger = logging.getLogger(__name__)
+
+
+class RenderedPost(NamedTuple):
+    """Готовое к отправке сообщение с постом сессии"""
+    post_id: int
+    position: int
+    text: str
+    keyboard: InlineKeyboardMarkup
+
+
+def get_post_keyboard(post_id):
+    rows = [
+        [
+            InlineKeyboardButton(text="✅ Опубликовать", callback_data=f"publish_{post_id}"),
+            InlineKeyboardButton(text="⏳ Отложить", callback_data=f"skip_{post_id}")
+        ],
+        [InlineKeyboardButton(text="🧠 Обработать (Gemini)", callback_data=f"gemini_{post_id}")],
+        [InlineKeyboardButton(text="🗑 Отклонить", callback_data=f"decline_{post_id}")],
+        [InlineKeyboardButton(text="🔙 В меню", callback_data="end_moderation")]
+    ]
+    if PUBLISH_SLOTS:
+        rows.insert(1, [InlineKeyboardButton(text="🕒 По расписанию", callback_data=f"schedule_{post_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def render_post(position, total, post_id, post, sources, media):
+    # Используем styled_text (который может быть обработан Gemini), если он доступен;
+    # правила замены — те же, что при публикации, чтобы админ видел итоговый текст
+    post_text = rewrite_rules.apply(post[3] if post[3] else post[2])
+
+    text = f"<b>Пост {position + 1} из {total}</b>\n\n{post_text}"
+
+    # Если тот же пост пришёл из нескольких каналов, показываем все источники
+    if len(sources) > 1:
+        text += f"\n\n🔁 Источники: {', '.join(sources)}"
+
+    if media:
+        kinds = ", ".join(f"{kind} ×{count}" for kind, count in Counter(row[0] for row in media).items())
+        text += f"\n\n📎 Медиа: {kinds}"
+
+    return RenderedPost(post_id, position, text, get_post_keyboard(post_id))
+
+
+class SessionEngine:
+    """
+    Подготовка постов сессии модерации заранее.
+
+    Пока админ читает текущий пост, в фоне одним обращением к БД читаются
+    и рендерятся (текст, клавиатура, счётчики) следующие depth постов.
+    После нажатия кнопки следующий пост уходит одним send_message.
+    Кэш сбрасывается при пересоздании сессии (reset) и при изменении поста
+    (invalidate_post). Время от нажатия кнопки до показа следующего поста
+    копится в метрике time-to-next-post.
+    """
+
+    def __init__(self, depth=3, window=500):
+        self.depth = depth
+        self._rendered = {}      # admin_id: {position: RenderedPost | None}
+        self._generations = {}   # admin_id: номер поколения кэша
+        self._prefetching = {}   # admin_id: asyncio.Task
+        self._timings = deque(maxlen=window)
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, admin_id):
+        """Сбрасывает подготовленные посты админа (новая или завершённая сессия)"""
+        self._generations[admin_id] = self._generations.get(admin_id, 0) + 1
+        self._rendered.pop(admin_id, None)
+
+    def invalidate_post(self, post_id):
+        """Убирает пост из кэша всех админов (текст изменён, пост опубликован или удалён)"""
+        for rendered in self._rendered.values():
+            for position, view in list(rendered.items()):
+                if view is not None and view.post_id == post_id:
+                    del rendered[position]
+
+    async def current(self, admin_id):
+        """Возвращает RenderedPost текущего поста сессии или None, если постов больше нет"""
+        while True:
+            cursor = await get_session_cursor(admin_id)
+            if not cursor or cursor[0] >= cursor[1]:
+                return None
+            index, total = cursor
+
+            rendered = self._rendered.setdefault(admin_id, {})
+            for position in [p for p in rendered if p < index]:
+                del rendered[position]
+
+            if index in rendered:
+                self.hits += 1
+                view = rendered[index]
+            else:
+                self.misses += 1
+                views = await self._load(admin_id, index, total, 1)
+                view = views.get(index)
+
+            self._schedule_prefetch(admin_id, index, total)
+            if view is not None:
+                return view
+            # Пост удалён, пока был в сессии — пропускаем его
+            await advance_session(admin_id)
+
+    async def _load(self, admin_id, from_position, total, limit):
+        generation = self._generations.get(admin_id, 0)
+        views = {}
+        for position, post_id, post, sources, media in await get_session_views(admin_id, from_position, limit):
+            views[position] = render_post(position, total, post_id, post, sources, media) if post else None
+        # Пока шло чтение, кэш могли сбросить — тогда результат не сохраняем
+        if self._generations.get(admin_id, 0) == generation:
+            self._rendered.setdefault(admin_id, {}).update(views)
+        return views
+
+    def _schedule_prefetch(self, admin_id, index, total):
+        task = self._prefetching.get(admin_id)
+        if task and not task.done():
+            return
+        rendered = self._rendered.get(admin_id, {})
+        missing = [p for p in range(index + 1, min(index + 1 + self.depth, total)) if p not in rendered]
+        if missing:
+            self._prefetching[admin_id] = asyncio.create_task(
+                self._prefetch(admin_id, missing[0], total, missing[-1] - missing[0] + 1)
+            )
+
+    async def _prefetch(self, admin_id, from_position, total, limit):
+        try:
+            await self._load(admin_id, from_position, total, limit)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось подготовить посты сессии админа {admin_id}: {e}")
+
+    def record_time_to_next_post(self, admin_id, started):
+        elapsed = (time.monotonic() - started) * 1000
+        self._timings.append(elapsed)
+        stats = self.stats()
+        logger.info(
+            f"⏱ Следующий пост админу {admin_id} за {elapsed:.0f} мс "
+            f"(p50 {stats['p50_ms']:.0f} мс, p95 {stats['p95_ms']:.0f} мс, из кэша {stats['hit_ratio']:.0%})"
+        )
+
+    def stats(self):
+        timings = sorted(self._timings)
+        requests = self.hits + self.misses
+
+        def percentile(q):
+            return timings[min(len(timings) - 1, int(len(timings) * q))] if timings else 0.0
+
+        return {
+            "samples": len(timings),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "hit_ratio": self.hits / requests if requests else 0.0,
+        }
+
+
+session_engine = SessionEngine(depth=MODERATION_PREFETCH_DEPTH)
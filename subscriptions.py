@@ -0,0 +1,156 @@
+# subscriptions.py
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, NamedTuple
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser, PeerChannel, PeerChat
+
+from db import get_channel_peers, save_channel_peer
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_channel(channel):
+    """Приводит '@Name', 'https://t.me/name' и 'name' к одному ключу"""
+    channel = str(channel).strip()
+    for prefix in ("https://", "http://", "t.me/", "@"):
+        if channel.lower().startswith(prefix):
+            channel = channel[len(prefix):]
+    return channel.lower()
+
+
+class Subscription(NamedTuple):
+    channel: str
+    peer_id: int      # "помеченный" id (-100...), как event.chat_id
+    input_peer: Any   # InputPeer для запросов без resolve
+    source_id: str    # имя источника в news.source_id
+
+
+def _subscription(channel, peer_id, access_hash, title, username):
+    real_id, peer_type = utils.resolve_id(peer_id)
+    if peer_type is PeerChannel:
+        input_peer = InputPeerChannel(real_id, access_hash)
+    elif peer_type is PeerChat:
+        input_peer = InputPeerChat(real_id)
+    else:
+        input_peer = InputPeerUser(real_id, access_hash)
+    return Subscription(channel, peer_id, input_peer, username or title or str(peer_id))
+
+
+class ChannelRegistry:
+    """
+    Живой список каналов-источников парсера.
+
+    Каналы читаются из channels.json и перечитываются, когда у файла меняется
+    mtime (проверка раз в poll_interval секунд — один stat). Разрешённые peer id,
+    access hash и названия хранятся в таблице channel_peer, поэтому сеть
+    нужна только для каналов, которых ещё нет в кэше. Обработчик Telethon
+    один и фильтрует сообщения по peer id, так что клиент не перезапускается.
+    """
+
+    def __init__(self, client, path="channels.json", poll_interval=5.0, on_added=None):
+        self.client = client
+        self.path = path
+        self.poll_interval = poll_interval
+        self.on_added = on_added  # on_added(list[Subscription])
+        self._peers = {}          # channel: (peer_id, access_hash, title, username)
+        self._active = {}         # peer_id: Subscription
+        self._mtime = None
+
+    def __contains__(self, peer_id):
+        return peer_id in self._active
+
+    def __len__(self):
+        return len(self._active)
+
+    def get(self, peer_id):
+        return self._active.get(peer_id)
+
+    def subscriptions(self):
+        return list(self._active.values())
+
+    async def load(self):
+        """Поднимает кэш из базы и применяет текущий channels.json"""
+        self._peers = await get_channel_peers()
+        await self.reload()
+
+    async def watch(self):
+        """Следит за channels.json, пока не отменят"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if self._file_mtime() != self._mtime:
+                    await self.reload()
+            except Exception as e:
+                logger.error(f"❌ Ошибка при обновлении списка каналов: {e}")
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_channels(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    async def reload(self):
+        mtime = self._file_mtime()
+        try:
+            channels = self._read_channels()
+        except Exception as e:
+            # mtime не запоминаем — попробуем ещё раз на следующей проверке
+            logger.error(f"❌ Не удалось прочитать {self.path}: {e}")
+            return
+        self._mtime = mtime
+
+        active = {}
+        for channel in dict.fromkeys(normalize_channel(c) for c in channels if c):
+            peer = self._peers.get(channel) or await self._resolve(channel)
+            if peer:
+                subscription = _subscription(channel, *peer)
+                active[subscription.peer_id] = subscription
+
+        added = [s for peer_id, s in active.items() if peer_id not in self._active]
+        removed = [s for peer_id, s in self._active.items() if peer_id not in active]
+        self._active = active
+
+        if added:
+            logger.info(f"➕ Подписка на каналы: {', '.join(s.source_id for s in added)}")
+        if removed:
+            logger.info(f"➖ Отписка от каналов: {', '.join(s.source_id for s in removed)}")
+        if not active:
+            logger.warning("⚠️ Нет каналов для мониторинга. Добавьте их через меню бота.")
+        if added and self.on_added:
+            self.on_added(added)
+
+    async def _resolve(self, channel):
+        """Разрешает канал через API и сохраняет результат в кэш"""
+        while True:
+            try:
+                entity = await self.client.get_entity(channel)
+                break
+            except FloodWaitError as e:
+                logger.warning(f"⏳ Flood wait {e.seconds} с при разрешении канала {channel}")
+                await asyncio.sleep(e.seconds)
+            except Exception as e:
+                logger.error(f"❌ Не удалось найти канал {channel}: {e}")
+                return None
+
+        peer = (
+            utils.get_peer_id(entity),
+            getattr(entity, "access_hash", None),
+            getattr(entity, "title", None),
+            getattr(entity, "username", None),
+        )
+        self._peers[channel] = peer
+        await save_channel_peer(channel, *peer)
+        logger.info(f"🔎 Канал {channel} разрешён и сохранён в кэш")
+        return peer
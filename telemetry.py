@@ -0,0 +1,157 @@
+# telemetry.py
+
+import asyncio
+import bisect
+import logging
+import os
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60)
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: O(log n) на замер, память не растёт"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последняя корзина — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class GeminiMetrics:
+    """
+    Счётчики вызовов Gemini в памяти процесса.
+
+    Каждый вызов записывается с результатом (ok или вид ошибки), задержкой
+    и токенами из usage_metadata. Отдельно считаются ответы из кэша,
+    обработки одними локальными правилами без запроса и случаи, когда
+    вместо ответа Gemini вернули исходный текст (fallback).
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.cache_hits = 0
+        self.fallbacks = 0
+        self.local_rewrites = 0
+        self.version = 0  # Растёт при каждом изменении — экспорт пишет файл только по изменению
+
+    def record_call(self, outcome, latency, prompt_tokens=0, response_tokens=0):
+        self.calls[outcome] += 1
+        self.latency.observe(latency)
+        self.prompt_tokens += prompt_tokens
+        self.response_tokens += response_tokens
+        self.version += 1
+
+    def record_cache_hit(self):
+        self.cache_hits += 1
+        self.version += 1
+
+    def record_local_rewrite(self):
+        self.local_rewrites += 1
+        self.version += 1
+
+    def record_fallback(self):
+        self.fallbacks += 1
+        self.version += 1
+
+    def snapshot(self):
+        total = sum(self.calls.values())
+        ok = self.calls.get("ok", 0)
+        return {
+            "calls": total,
+            "ok": ok,
+            "errors": {kind: n for kind, n in self.calls.items() if kind != "ok"},
+            "error_rate": (total - ok) / total if total else 0.0,
+            "p50_s": self.latency.quantile(0.5),
+            "p95_s": self.latency.quantile(0.95),
+            "p99_s": self.latency.quantile(0.99),
+            "prompt_tokens": self.prompt_tokens,
+            "response_tokens": self.response_tokens,
+            "cache_hits": self.cache_hits,
+            "fallbacks": self.fallbacks,
+            "local_rewrites": self.local_rewrites,
+        }
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP gemini_requests_total Запросы к Gemini по результату (ok или вид ошибки)",
+            "# TYPE gemini_requests_total counter",
+        ]
+        for outcome, count in sorted(self.calls.items()):
+            lines.append(f'gemini_requests_total{{outcome="{outcome}"}} {count}')
+        lines += [
+            "# HELP gemini_request_duration_seconds Задержка запросов к Gemini",
+            "# TYPE gemini_request_duration_seconds histogram",
+        ]
+        cumulative = 0
+        for bound, count in zip(self.latency.buckets + ("+Inf",), self.latency.counts):
+            cumulative += count
+            lines.append(f'gemini_request_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+        lines += [
+            f"gemini_request_duration_seconds_sum {self.latency.sum:.6f}",
+            f"gemini_request_duration_seconds_count {self.latency.count}",
+            "# HELP gemini_tokens_total Токены по usage_metadata",
+            "# TYPE gemini_tokens_total counter",
+            f'gemini_tokens_total{{kind="prompt"}} {self.prompt_tokens}',
+            f'gemini_tokens_total{{kind="response"}} {self.response_tokens}',
+            "# HELP gemini_cache_hits_total Ответы из кэша переписываний без запроса к Gemini",
+            "# TYPE gemini_cache_hits_total counter",
+            f"gemini_cache_hits_total {self.cache_hits}",
+            "# HELP gemini_fallbacks_total Ошибки, при которых вернули исходный текст",
+            "# TYPE gemini_fallbacks_total counter",
+            f"gemini_fallbacks_total {self.fallbacks}",
+            "# HELP gemini_local_rewrites_total Обработки только локальными правилами, без запроса к Gemini",
+            "# TYPE gemini_local_rewrites_total counter",
+            f"gemini_local_rewrites_total {self.local_rewrites}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, text=None):
+        """Пишет метрики в текстовом формате Prometheus атомарно (для node_exporter textfile)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text if text is not None else self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    async def export(self, path, interval=15.0):
+        """Фоновая выгрузка файла метрик, только если что-то изменилось"""
+        written = None
+        while True:
+            version = self.version
+            if version != written:
+                try:
+                    # Текст собираем в цикле событий, в поток уходит только запись файла
+                    await asyncio.to_thread(self.write_prometheus, path, self.render_prometheus())
+                    written = version
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось записать метрики в {path}: {e}")
+            await asyncio.sleep(interval)
+
+
+gemini_metrics = GeminiMetrics()
@@ -0,0 +1,105 @@
+# timeline.py
+
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from db import record_stages, get_timeline
+
+logger = logging.getLogger(__name__)
+
+# Отрезки отчёта: (этап начала, этап конца, подпись)
+STAGE_SPANS = [
+    ("message_at", "ingested_at", "📥 пост в канале → парсер"),
+    ("ingested_at", "notified_at", "🔔 парсер → уведомление"),
+    ("notified_at", "first_shown_at", "👀 уведомление → показ"),
+    ("first_shown_at", "edited_at", "✏️ показ → правка"),
+    ("first_shown_at", "published_at", "✅ показ → публикация"),
+    ("first_shown_at", "declined_at", "🗑 показ → отклонение"),
+    ("ingested_at", "published_at", "⏱ парсер → публикация"),
+]
+_COLUMNS = ("channel", "message_at", "ingested_at", "notified_at", "first_shown_at",
+            "edited_at", "published_at", "declined_at")
+
+
+class StageRecorder:
+    """
+    Буфер отметок этапов, для которых нет своей записи в БД (показ поста
+    модератору). Отметки копятся flush_interval секунд и уходят писателю
+    одной задачей; этапы, совпадающие с записью в БД (правка, публикация,
+    отклонение, уведомление), фиксируются прямо в тех транзакциях.
+    """
+
+    def __init__(self, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self._marks = []
+        self._flush_task = None
+
+    def mark(self, stage, post_ids):
+        now = time.time()
+        self._marks.extend((stage, post_id, now) for post_id in post_ids)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self):
+        if self._marks:
+            marks, self._marks = self._marks, []
+            record_stages(marks)
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+
+async def build_report(hours=24, top_channels=10):
+    """
+    Перцентили длительности этапов для постов, принятых за последние hours
+    часов: по всем постам и по каналам-источникам (самые активные каналы).
+    """
+    until = time.time()
+    rows = [dict(zip(_COLUMNS, row)) for row in await get_timeline(until - hours * 3600, until)]
+    if not rows:
+        return f"⏱ За {hours} ч постов с хронологией нет."
+
+    lines = [f"⏱ <b>Этапы постов за {hours} ч</b> (постов: {len(rows)})", "p50 / p95 / p99, в скобках — число постов\n"]
+    for start, end, label in STAGE_SPANS:
+        durations = sorted(
+            row[end] - row[start] for row in rows if row[start] is not None and row[end] is not None
+        )
+        if durations:
+            lines.append(
+                f"{label}: {format_duration(percentile(durations, 0.5))} / "
+                f"{format_duration(percentile(durations, 0.95))} / "
+                f"{format_duration(percentile(durations, 0.99))} ({len(durations)})"
+            )
+
+    by_channel = defaultdict(list)
+    for row in rows:
+        by_channel[row["channel"] or "?"].append(row)
+    lines.append("\n📡 <b>По каналам</b>: парсер → показ · парсер → публикация")
+    for channel, channel_rows in sorted(by_channel.items(), key=lambda item: -len(item[1]))[:top_channels]:
+        spans = []
+        for end in ("first_shown_at", "published_at"):
+            durations = sorted(row[end] - row["ingested_at"] for row in channel_rows if row[end] is not None)
+            spans.append(
+                f"p50 {format_duration(percentile(durations, 0.5))}, p95 {format_duration(percentile(durations, 0.95))}"
+                if durations else "—"
+            )
+        lines.append(f"{channel} ({len(channel_rows)}): {spans[0]} · {spans[1]}")
+    return "\n".join(lines)
+
+
+stage_recorder = StageRecorder()